@@ -1,10 +1,104 @@
-import time, threading, json, random, os, requests, re, sys, queue
+import time, threading, json, random, os, requests, re, sys, queue, atexit, struct, zlib, math, heapq, bisect, hashlib, codecs, base64
+import asyncio
+import numpy as np
+from collections import Counter, OrderedDict, deque
+from itertools import chain, islice
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-
-SAVE_FILE = "ai_brain_ultra.json"
+from html.parser import HTMLParser
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qs
+
+SAVE_FILE = "ai_brain_ultra.bin"
+LEGACY_SAVE_FILE = "ai_brain_ultra.json"  # старый формат — конвертируется в SAVE_FILE при загрузке
+JOURNAL_FILE = "ai_brain_ultra.journal"
+JOURNAL_COMPACT_BYTES = 8 * 1024 * 1024  # после стольких байт журнала — сворачиваем в снапшот
+JOURNAL_COMPACT_RECORDS = 250
+SAVE_COALESCE_SEC = 0.25  # окно, в котором несколько save() склеиваются в одну запись
+BRAIN_MAGIC = b"UEAI"
+BRAIN_VERSION = 1
+BRAIN_COMPRESS_MIN = 64 * 1024  # секции крупнее этого сжимаются zlib
+BRAIN_ZLIB_LEVEL = 3
+FETCH_WORKERS = 4        # параллельных загрузчиков в FetchPipeline
+FETCH_QUEUE_DEPTH = 16   # сколько готовых документов может ждать evolve()
+FETCH_POOL_SIZE = 8      # keep-alive соединений на хост в каждой сессии
+FETCH_TIMEOUT = 14
+FETCH_WAIT_SEC = 1.0     # сколько evolve() ждёт документ из очереди
+FETCH_TEXT_BUDGET = 18000  # столько очищенного текста берём со страницы — дальше не читаем
+FETCH_MIN_TEXT = 1500      # страницы с меньшим количеством текста отбрасываются
+FETCH_CHUNK = 16384
+FETCH_MAX_BYTES = 1536 * 1024   # больше этого со страницы не читаем, даже если текста мало
+EXTERNAL_MAX_BYTES = 512 * 1024  # потолок для README/ipynb в integrate_external_data
+TEXT_CONTENT_TYPES = ("text/", "application/xhtml+xml", "application/xml", "application/json")
+FETCH_IDLE_SEC = 0.5     # пауза загрузчика после пустой/неизменившейся страницы
+CRAWL_RATE = 0.5         # запросов в секунду на домен (token bucket)
+CRAWL_BURST = 2          # ёмкость ведра
+CRAWL_BACKOFF = (2, 300) # экспоненциальная пауза после ошибки: база и потолок, сек
+CRAWL_BREAKER = 5        # подряд ошибок, после которых домен отключается
+CRAWL_BREAKER_SEC = 900  # на сколько отключается домен
+CACHE_DIR = "ai_cache"
+# Сколько секунд ответ источника считается свежим без запроса; после — условный GET
+# (If-None-Match / If-Modified-Since). Ключ — хост, "*" — остальные
+CACHE_MAX_AGE = {
+    "raw.githubusercontent.com": 3600,
+    "github.com": 900,
+    "news.ycombinator.com": 120,
+    "*": 0,
+}
+EVOLVE_PAUSE = (2, 6)    # пауза между эпохами, сек
+BM25_K1, BM25_B = 1.5, 0.75
+SEARCH_PAGE = 5          # результатов на страницу ranked_search()
+TRENDS_CAPACITY = 4096   # сколько слов держит сводка трендов (Space-Saving)
+SKILLS_TOP = 64          # размер поддерживаемого топа навыков
+TRENDS_TOP = 64          # размер поддерживаемого топа трендов
+VIEW_TRENDS = 30         # трендов в опубликованном срезе для читателей (ReadView)
+VIEW_TAIL = 50           # записей каждой истории в срезе
+SEARCH_RETRIES = 4       # попыток чтения индексов без блокировки, дальше — под state_lock
+SEARCH_SCAN_CAP = 50     # записей, которые find() проверяет напрямую для коротких запросов без точного терма
+RESPONSE_CACHE_SIZE = 256  # ответов handle_external_query в LRU (в пределах одного среза)
+CACHED_QUERIES = ("status", "state", "project", "skills", "trends", "search", "rank")  # без случайных idea/code/fact
+READ_QUERIES = CACHED_QUERIES + ("idea",)  # не меняют состояние — в пакете идут параллельно (code/fact пишут command_history)
+BATCH_WORKERS = 4        # потоков для пакетных запросов batch_*_task
+API_HOST = "127.0.0.1"   # встроенный HTTP/JSON API (ApiServer) — по умолчанию только локально
+API_PORT = 8377
+API_WORKERS = 8          # потоков под вызовы ai.* из обработчиков API
+API_MAX_INFLIGHT = 16    # одновременно выполняемых запросов; остальные ждут слота
+API_QUEUE_SEC = 5        # сколько запрос ждёт слота, дальше 503 + Retry-After
+API_MAX_CONNECTIONS = 256  # открытых соединений; сверх — 503 и закрытие
+API_KEEPALIVE_SEC = 15   # простой keep-alive соединения до закрытия
+API_MAX_HEADER = 16 * 1024   # предел строки запроса/заголовка
+API_MAX_BODY = 256 * 1024    # предел тела POST
+API_STREAM_CHUNK = 32 * 1024  # размер куска chunked-ответа (экспорт)
+EXPORT_SECTIONS = ("summary", "knowledge", "code_metrics", "command_history", "diag_history", "user_feedback",
+                   "self_tests", "experience", "projects", "facts", "skills")  # порядок: истории — раньше крупных словарей
+EXPORT_UNWINDOWED = ("facts", "skills")  # текущее состояние без эпох/времени — при заданном окне по умолчанию не выгружаются
+EXPORT_DICTS = ("skills", "facts", "projects")  # берутся из ReadView, остальные — записи из живых историй
+ADMIN_SECTIONS = ("summary", "diag_history", "user_feedback", "code_metrics")
+ADMIN_TAIL = 20          # записей на секцию в admin_report()
+EXPORT_CHUNK = 3900      # символов в сообщении chunk_lines() — с запасом до лимита Telegram 4096
+CODE_EXAMPLES_CAP = 555  # примеров кода в SnippetStore
+LANG_SNIPPETS_CAP = 600  # сниппетов language_models на все языки
+DEDUP_CAPACITY = 4096    # сколько отпечатков документов помним
+DEDUP_HAMMING = 3        # до скольки различающихся бит SimHash документ считается почти-дубликатом
+DEDUP_LOG_EVERY = 25     # раз в сколько проверок писать статистику дедупликации в diag_history
+DOCS_CAPACITY = 4096     # документов с отметками пройденных этапов
+DOC_CACHE = 64           # документов с закэшированными токенами/сущностями (в памяти)
+DOC_STAGES = {"smart_learn": 1, "deep_analyze": 2, "expand_keywords": 4, "nlp": 8}
+HISTORY_CAP = 1000       # записей {эпоха, оценка} в self.history (в памяти)
+# Ёмкость историй-колец (RingBuffer): при заполнении самая старая запись вытесняется
+RING_CAPS = {"experience": 2000, "command_history": 1200, "user_feedback": 444, "self_tests": 500,
+             "diag_history": 800, "code_metrics": 1000}
+PROJECT_SAMPLES = 8      # образцов текста на проект
 BACKUP_DIR = "ai_backups"
 DATA_DIR = "ai_data"
 LOG_FILE = "ai.log"
+LOG_FLUSH_SEC = 0.5      # как часто фоновый писатель сбрасывает буфер в LOG_FILE
+LOG_BUFFER_MAX = 10000   # строк в буфере; сверх — самые старые отбрасываются
+LOG_MAX_BYTES = 5 * 1024 * 1024  # ротация ai.log -> ai.log.1 -> ... по размеру
+LOG_ROTATE_DAILY = True  # и при смене суток: записи за прошлый день уходят в ai.log.1
+LOG_BACKUPS = 3
+LOG_REPEAT_SEC = 60      # одно и то же сообщение в пределах окна пишется один раз, повторы считаются
+LOG_SEEN_CAP = 2048      # сколько разных сообщений отслеживается для подавления повторов
 URLS = [
     "https://en.wikipedia.org/wiki/Special:Random",
     "https://news.ycombinator.com/",
@@ -30,44 +124,2181 @@ KEYWORDS = [
     "python", "javascript", "html", "css", "ai", "machine learning", "data science", "android", "blockchain", "algorithms", "math", "linux", "web", "frontend", "backend", "game dev", "automation", "deep learning", "nlp", "robotics", "computer vision", "api", "database", "flask", "django", "fastapi", "sql", "postgres", "mongodb", "json", "scraping", "pandas", "numpy", "tensorflow", "torch", "keras", "transformers", "chatbot", "network", "security", "crypto", "ethereum", "bitcoin", "solidity", "react", "vue", "angular"
 ]
 
+class EventLog:
+    # Журнал событий с одним писателем: log_event() только кладёт строку в буфер, фоновый
+    # поток раз в flush_sec дописывает весь буфер одним open/write и ротирует файл по размеру
+    # или при смене суток (файл последний раз писался вчера или раньше).
+    # Повторы того же сообщения в течение repeat_sec не пишутся, а считаются; когда окно
+    # закрывается, выходит одна строка "... (repeated N times)"
+    def __init__(self, path=LOG_FILE, flush_sec=LOG_FLUSH_SEC, max_bytes=LOG_MAX_BYTES, backups=LOG_BACKUPS,
+                 repeat_sec=LOG_REPEAT_SEC, daily=LOG_ROTATE_DAILY):
+        self.path = path
+        self.flush_sec = flush_sec
+        self.max_bytes = max_bytes
+        self.daily = daily
+        self.backups = backups
+        self.repeat_sec = repeat_sec
+        self._cond = threading.Condition()
+        self._buf = deque(maxlen=LOG_BUFFER_MAX)
+        self._seen = {}  # сообщение -> [начало окна, подавлено повторов]
+        self._thread = None
+        self._running = True
+        self.stats = {"lines": 0, "suppressed": 0, "dropped": 0, "rotations": 0, "errors": 0}
+
+    def write(self, msg):
+        now = time.time()
+        with self._cond:
+            seen = self._seen.get(msg)
+            if seen is not None:
+                if now - seen[0] < self.repeat_sec:
+                    seen[1] += 1
+                    self.stats["suppressed"] += 1
+                    return
+                del self._seen[msg]
+                if seen[1]:
+                    self._push(now, f"{msg} (repeated {seen[1]} times)")
+            if len(self._seen) < LOG_SEEN_CAP:
+                self._seen[msg] = [now, 0]
+            self._push(now, msg)
+            if self._running:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._loop, daemon=True)
+                    self._thread.start()
+                    atexit.register(self.stop)
+                elif len(self._buf) >= LOG_BUFFER_MAX // 2:
+                    self._cond.notify()  # буфер наполовину полон — сбросить, не дожидаясь таймера
+                return
+            lines, self._buf = list(self._buf), deque(maxlen=LOG_BUFFER_MAX)
+        self._flush(lines)  # после stop() (выход процесса) — пишем сразу
+
+    def _push(self, now, msg):
+        if len(self._buf) == self._buf.maxlen:
+            self.stats["dropped"] += 1
+        self._buf.append(f"{datetime.fromtimestamp(now)} | {msg}\n")
+
+    def _expire(self, now, force=False):
+        # Закрывшиеся окна: накопленные повторы -> одна итоговая строка
+        for msg, (start, repeats) in list(self._seen.items()):
+            if force or now - start >= self.repeat_sec:
+                del self._seen[msg]
+                if repeats:
+                    self._push(now, f"{msg} (repeated {repeats} times)")
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                if self._running:
+                    self._cond.wait(self.flush_sec)
+                running = self._running
+                self._expire(time.time(), force=not running)
+                lines, self._buf = list(self._buf), deque(maxlen=LOG_BUFFER_MAX)
+            if lines:
+                self._flush(lines)
+            if not running:
+                return
+
+    def _flush(self, lines):
+        data = "".join(lines)
+        try:
+            if self._rotation_due(len(data)):
+                self._rotate()
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(data)
+            self.stats["lines"] += len(lines)
+        except OSError:
+            self.stats["errors"] += 1
+
+    def _rotation_due(self, size):
+        if not os.path.exists(self.path):
+            return False
+        if self.max_bytes and os.path.getsize(self.path) + size > self.max_bytes:
+            return True
+        return self.daily and datetime.fromtimestamp(os.path.getmtime(self.path)).date() < datetime.now().date()
+
+    def _rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.stats["rotations"] += 1
+
+    def stop(self):
+        # Дописывает буфер и итоги повторов; дальнейшие write() пишут в файл сразу
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout=10)
+
+EVENT_LOG = EventLog()
+
 def log_event(msg):
-    with open(LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(f"{datetime.now()} | {msg}\n")
+    EVENT_LOG.write(msg)
 
 def ensure_dirs():
-    for d in [BACKUP_DIR, DATA_DIR]:
+    for d in [BACKUP_DIR, DATA_DIR, CACHE_DIR]:
         if not os.path.exists(d):
             os.makedirs(d)
 
+# --- Персистентность: журнал дельт + снапшот ---
+# Каждая эпоха дописывает в JOURNAL_FILE только то, что изменилось (новые документы,
+# изменённые ключи счётчиков, новые факты/примеры). Фоновое сворачивание переносит
+# журнал в снапшот SAVE_FILE, а load() читает снапшот и догоняет хвост журнала.
+
+STATE_SCALARS = ("epoch", "weights", "complexity", "best_score", "topics", "skills_offset")
+STATE_LISTS = ("experience", "knowledge", "corpus", "command_history",
+               "user_feedback", "self_tests", "diag_history", "code_metrics")
+STATE_DICTS = ("skills", "facts", "trends", "projects", "language_models", "coding_examples",
+               "fingerprints", "docs")
+LAZY_SECTIONS = ("corpus", "language_models", "experience", "code_metrics")  # грузятся при первом обращении
+
+class JournaledList(list):
+    # Список, который помнит, сколько элементов добавлено с последнего save().
+    # Удалять можно только с начала (del lst[:-N]) — тогда дельта = хвост + длина.
+    # _base — сколько элементов срезано с начала: id элемента = _base + индекс не меняется
+    # при обрезке. watch (SearchIndex) получает добавления и удаления.
+    def __init__(self, items=()):
+        super().__init__(items)
+        self._added = 0
+        self._flushed_len = len(self)
+        self._rewritten = False
+        self._base = 0
+        self.watch = None
+
+    # Изменения с watch идут внутри watch.begin()/end(): индекс помечен нечётной version ещё до
+    # того, как сдвинулся сам список или _base, — читатель без лока не сопоставит id не тому документу
+
+    def append(self, item):
+        if self.watch is None:
+            return self._append(item)
+        self.watch.begin()
+        try:
+            self._append(item)
+            self.watch.add(self._base + len(self) - 1, item)
+        finally:
+            self.watch.end()
+
+    def _append(self, item):
+        super().append(item)
+        self._added += 1
+
+    def extend(self, items):
+        n = len(self)
+        if self.watch is not None:
+            self.watch.begin()
+        try:
+            super().extend(items)
+            self._added += len(self) - n
+            if self.watch is not None:
+                for i in range(n, len(self)):
+                    self.watch.add(self._base + i, self[i])
+        finally:
+            if self.watch is not None:
+                self.watch.end()
+
+    def __delitem__(self, key):
+        if self.watch is not None:
+            self.watch.begin()
+        try:
+            if isinstance(key, slice) and not key.start and key.step is None:
+                gone = self[key]
+                super().__delitem__(key)
+                if self.watch is not None:
+                    for i, item in enumerate(gone):
+                        self.watch.remove(self._base + i, item)
+                self._base += len(gone)
+            else:
+                super().__delitem__(key)
+                if self.watch is not None:
+                    self.watch.rebuild()
+        finally:
+            if self.watch is not None:
+                self.watch.end()
+
+    def rewrite(self, items):
+        # Полная перезапись (сортировка/отбор) — в журнал уйдёт весь список
+        if self.watch is not None:
+            self.watch.begin()
+        try:
+            self[:] = items
+            self._rewritten = True
+            if self.watch is not None:
+                self.watch.rebuild()
+        finally:
+            if self.watch is not None:
+                self.watch.end()
+
+    def take_delta(self):
+        n = len(self)
+        if self._rewritten:
+            delta = {"reset": list(self)}
+        elif self._added or n != self._flushed_len:
+            new = min(self._added, n)
+            delta = {"add": self[n - new:] if new else [], "keep": n}
+        else:
+            delta = None
+        self._added, self._flushed_len, self._rewritten = 0, n, False
+        return delta
+
+class JournaledDict(dict):
+    # Словарь с учётом "грязных" ключей. Вложенные изменения (skills[k]['level'] += 1)
+    # не проходят через __setitem__ — для них вызывается touch(k).
+    def __init__(self, items=()):
+        super().__init__(items)
+        self._dirty = set()
+        self._reset = False
+        self.watch = None
+        self.version = 0  # растёт при каждом изменении — publish() по нему решает, копировать ли секцию
+
+    def __setitem__(self, key, value):
+        if self.watch is not None:
+            self.watch.begin()  # индекс и значение меняются в одном окне нечётной version
+            try:
+                self.watch.put(key, value)
+                super().__setitem__(key, value)
+            finally:
+                self.watch.end()
+        else:
+            super().__setitem__(key, value)
+        self._dirty.add(key)
+        self.version += 1
+
+    def __delitem__(self, key):
+        if self.watch is not None and key in self:
+            self.watch.remove(key, self[key])
+        super().__delitem__(key)
+        self._dirty.add(key)
+        self.version += 1
+
+    def touch(self, key):
+        self._dirty.add(key)
+        self.version += 1
+
+    def touch_all(self):
+        self._reset = True
+        self.version += 1
+
+    def take_delta(self):
+        dirty, self._dirty = self._dirty, set()
+        if self._reset:
+            self._reset = False
+            return {"reset": dict(self)}
+        if not dirty:
+            return None
+        delta = {"put": {k: self[k] for k in dirty if k in self}}
+        gone = [k for k in dirty if k not in self]
+        if gone: delta["del"] = gone
+        return delta
+
+class RingBuffer:
+    # История фиксированной ёмкости на deque(maxlen): append с вытеснением самой старой
+    # записи — O(1), обрезок срезами больше нет. Хвост ([-n:], tail(n)) собирается с конца
+    # за O(n) от n, а не от всей истории. Дельта для журнала — как у JournaledList:
+    # {"add": новый хвост, "keep": длина}; _base — сколько записей вытеснено (id = _base + индекс)
+    __slots__ = ("_items", "_added", "_flushed_len", "_rewritten", "_base")
+
+    def __init__(self, items=(), capacity=1000):
+        items = list(items)
+        self._items = deque(items, maxlen=capacity)
+        self._added = 0
+        self._flushed_len = len(items)  # длиннее ёмкости — обрезка уйдёт в журнал с первой дельтой
+        self._rewritten = False
+        self._base = len(items) - len(self._items)
+
+    @property
+    def capacity(self):
+        return self._items.maxlen
+
+    def append(self, item):
+        if len(self._items) == self._items.maxlen:
+            self._base += 1
+        self._items.append(item)
+        self._added += 1
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __reversed__(self):
+        return reversed(self._items)
+
+    def tail(self, n):
+        if n >= len(self._items):
+            return list(self._items)
+        if n <= 0:
+            return []
+        out = list(islice(reversed(self._items), n))
+        out.reverse()
+        return out
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            if key.start is not None and key.start < 0 and key.stop is None and key.step is None:
+                return self.tail(-key.start)
+            return list(self._items)[key]
+        return self._items[key]
+
+    def rewrite(self, items):
+        self._items = deque(items, maxlen=self._items.maxlen)
+        self._rewritten = True
+
+    def take_delta(self):
+        n = len(self._items)
+        if self._rewritten:
+            delta = {"reset": list(self._items)}
+        elif self._added or n != self._flushed_len:
+            new = min(self._added, n)
+            delta = {"add": self.tail(new) if new else [], "keep": n}
+        else:
+            delta = None
+        self._added, self._flushed_len, self._rewritten = 0, n, False
+        return delta
+
+class EpochScore:
+    # Запись self.history: только в памяти, без словаря на каждую эпоху
+    __slots__ = ("epoch", "score")
+
+    def __init__(self, epoch, score):
+        self.epoch, self.score = epoch, score
+
+class TrendSketch(JournaledDict):
+    # Space-Saving: не больше capacity слов, значение — [count, err], истинная частота слова
+    # в [count - err, count]. Новое слово при заполненной сводке вытесняет слово с минимальным
+    # счётчиком и наследует этот минимум как count/err. Слова разложены по корзинам
+    # "значение счётчика -> слова", минимум берётся из кучи значений (устаревшие снимаются
+    # лениво), поэтому add() — O(1) амортизированно. Как у SkillStore, рядом держится
+    # отсортированный топ из TRENDS_TOP слов: счётчики только растут, и слово вне топа
+    # попадает в него, лишь обогнав минимум топа, — top(n) читает n записей, не обходя сводку.
+    def __init__(self, items=(), capacity=TRENDS_CAPACITY, top=TRENDS_TOP):
+        entries = {k: (list(v) if isinstance(v, list) else [v, 0]) for k, v in dict(items).items()}
+        legacy = any(not isinstance(v, list) for v in dict(items).values()) or len(entries) > capacity
+        if len(entries) > capacity:
+            entries = dict(heapq.nlargest(capacity, entries.items(), key=lambda kv: kv[1][0]))
+        super().__init__(entries)
+        self.capacity = capacity
+        self.top_size = top
+        self._buckets, self._heap = {}, []
+        for k, v in self.items():
+            self._link(k, v[0])
+        self._top = sorted((v[0], k) for k, v in
+                           heapq.nlargest(top, self.items(), key=lambda kv: kv[1][0]))
+        self._in_top = {k for _, k in self._top}
+        if legacy:
+            self.touch_all()  # старый формат {слово: count} или урезание — секция уйдёт целиком
+
+    def _link(self, key, count):
+        bucket = self._buckets.get(count)
+        if bucket is None:
+            bucket = self._buckets[count] = set()
+            heapq.heappush(self._heap, count)
+            if len(self._heap) > 4 * len(self._buckets) + 64:
+                self._heap = list(self._buckets)
+                heapq.heapify(self._heap)
+        bucket.add(key)
+
+    def _unlink(self, key, count):
+        bucket = self._buckets[count]
+        bucket.discard(key)
+        if not bucket:
+            del self._buckets[count]
+
+    def add(self, key, c=1):
+        entry = self.get(key)
+        if entry is not None:
+            old = entry[0]
+            self._unlink(key, old)
+            entry[0] = old + c
+            self._link(key, old + c)
+            self.touch(key)
+            self._rank(key, old, old + c)
+            return
+        err = 0
+        if len(self) >= self.capacity:
+            while self._heap[0] not in self._buckets:
+                heapq.heappop(self._heap)
+            err = self._heap[0]
+            bucket = self._buckets[err]
+            victim = bucket.pop()
+            if not bucket:
+                del self._buckets[err]
+            del self[victim]
+            if victim in self._in_top:  # топ покрывает всю сводку до минимума
+                self._top.remove((err, victim))
+                self._in_top.discard(victim)
+        self[key] = [err + c, err]
+        self._link(key, err + c)
+        self._rank(key, None, err + c)
+
+    def _rank(self, key, old, new):
+        top = self._top
+        if key in self._in_top:
+            top.remove((old, key))
+        elif len(top) >= self.top_size:
+            if new < top[0][0] or (new, key) <= top[0]:
+                return
+            self._in_top.discard(top.pop(0)[1])
+        bisect.insort(top, (new, key))
+        self._in_top.add(key)
+
+    def top(self, n):
+        # [(слово, count, err)] по убыванию count
+        if n > len(self._top) and len(self._top) < len(self):
+            ranked = heapq.nlargest(n, ((v[0], k) for k, v in self.items()))
+        else:
+            ranked = self._top[:-n - 1:-1] if n else []
+        return [(k, c, self[k][1]) for c, k in ranked]
+
+class SkillStore(JournaledDict):
+    # {навык: {'level': ..., 'count': ...}}, level хранится относительно общего offset:
+    # "всем навыкам +1" (grow_complexity) меняет только offset, и в журнал уходит одно
+    # число, а не весь словарь. Рядом поддерживаются сумма хранимых уровней и отсортированный
+    # топ из SKILLS_TOP навыков. Уровни только растут, поэтому навык вне топа может попасть
+    # в него, лишь обогнав минимум топа — evaluate() и get_top_skills() не обходят словарь.
+    # Менять навыки — только через bump()/shift(), иначе сумма и топ разойдутся со словарём.
+    def __init__(self, items=(), offset=0, top=SKILLS_TOP):
+        super().__init__(items)
+        self.offset = offset
+        self.top_size = top
+        self._sum = sum(v['level'] for v in self.values())
+        self._top = sorted((v['level'], k) for k, v in
+                           heapq.nlargest(top, self.items(), key=lambda kv: kv[1]['level']))
+        self._in_top = {k for _, k in self._top}
+
+    def bump(self, key, level, count=0, new=(1, 0)):
+        # Новый навык создаётся как {'level': new[0], 'count': new[1]}, затем прибавка
+        entry = self.get(key)
+        old = None
+        if entry is None:
+            entry = {'level': new[0] - self.offset, 'count': new[1]}
+            self[key] = entry
+            self._sum += entry['level']
+        else:
+            old = entry['level']
+            self.touch(key)
+        entry['level'] += level
+        entry['count'] += count
+        self._sum += level
+        self._rank(key, old, entry['level'])
+
+    def _rank(self, key, old, new):
+        top = self._top
+        if key in self._in_top:
+            top.remove((old, key))
+        elif len(top) >= self.top_size:
+            if (new, key) <= top[0]:
+                return
+            self._in_top.discard(top.pop(0)[1])
+        bisect.insort(top, (new, key))
+        self._in_top.add(key)
+
+    def shift(self, level):
+        self.offset += level
+        self.version += 1
+
+    def level(self, key):
+        return self[key]['level'] + self.offset
+
+    def levels(self):
+        return {k: v['level'] + self.offset for k, v in self.items()}
+
+    def total(self):
+        return self._sum + self.offset * len(self)
+
+    def top(self, n):
+        # [(навык, уровень)] по убыванию уровня
+        if n > len(self._top) and len(self._top) < len(self):
+            ranked = heapq.nlargest(n, ((v['level'], k) for k, v in self.items()))
+        else:
+            ranked = self._top[:-n - 1:-1] if n else []
+        return [(k, lv + self.offset) for lv, k in ranked]
+
+class KeyArray:
+    # Массив ключей с удалением за O(1) (последний встаёт на место удалённого) — для random.choice
+    __slots__ = ("keys", "pos")
+
+    def __init__(self):
+        self.keys, self.pos = [], {}
+
+    def add(self, key):
+        self.pos[key] = len(self.keys)
+        self.keys.append(key)
+
+    def remove(self, key):
+        i = self.pos.pop(key)
+        last = self.keys.pop()
+        if last != key:
+            self.keys[i] = last
+            self.pos[last] = i
+
+class SnippetStore(JournaledDict):
+    # Сниппеты по адресу содержимого: ключ — blake2b текста (в language_models с префиксом
+    # языка, "python:9f1c..."), значение — сам текст. Дубликат — это поиск ключа, а не скан
+    # списка. Не больше capacity сниппетов: при переполнении вытесняется тот, что дольше всех
+    # не встречался (LRU, повторная встреча освежает). Для выборки без копирования списков
+    # держатся массивы ключей — общий и по языкам.
+    def __init__(self, items=(), capacity=CODE_EXAMPLES_CAP):
+        entries, legacy = {}, not isinstance(items, dict)
+        for k, v in (items.items() if isinstance(items, dict) else ((None, x) for x in items)):
+            if isinstance(v, list):  # старый language_models: {язык: [сниппеты]}
+                legacy = True
+                for x in v:
+                    entries[self.key_of(x, k)] = x
+            else:
+                entries[k if k is not None else self.key_of(v)] = v
+        if len(entries) > capacity:
+            entries = dict(list(entries.items())[-capacity:])
+        super().__init__(entries)
+        self.capacity = capacity
+        self._lru = OrderedDict.fromkeys(self)
+        self._all, self._langs = KeyArray(), {}
+        for k in self:
+            self._link(k)
+        if legacy:
+            self.touch_all()  # старый формат (список / по языкам) — секция уйдёт целиком
+
+    @staticmethod
+    def key_of(text, lang=None):
+        h = hashlib.blake2b(text.encode("utf-8", "replace"), digest_size=8).hexdigest()
+        return f"{lang}:{h}" if lang else h
+
+    def _link(self, key):
+        self._all.add(key)
+        lang, _, _ = key.rpartition(":")
+        if lang:
+            self._langs.setdefault(lang, KeyArray()).add(key)
+
+    def add(self, text, lang=None):
+        # True — сниппет новый
+        key = self.key_of(text, lang)
+        if key in self:
+            self._lru.move_to_end(key)
+            return False
+        while len(self) >= self.capacity:
+            old, _ = self._lru.popitem(last=False)
+            self._all.remove(old)
+            lang_old = old.rpartition(":")[0]
+            if lang_old:
+                self._langs[lang_old].remove(old)
+            del self[old]
+        self[key] = text
+        self._lru[key] = None
+        self._link(key)
+        return True
+
+    def sample(self, lang=None):
+        # Случайный сниппет (всех или одного языка) или None
+        arr = self._all if lang is None else self._langs.get(lang)
+        try:
+            return self[random.choice(arr.keys)] if arr and arr.keys else None
+        except (IndexError, KeyError):
+            return None  # параллельное вытеснение
+
+    def recent(self, n):
+        keys = list(self)[-n:] if n else []
+        return [self[k] for k in keys]
+
+    def languages(self):
+        return {lang: len(arr.keys) for lang, arr in self._langs.items()}
+
+# --- Почти-дубликаты: SimHash + LSH ---
+# SimHash — 64 бита, каждый бит — знак взвешенной суммы соответствующих бит хэшей токенов.
+# Суммы всех 64 разрядов считаются разом в одном большом int: хэш токена "разворачивается"
+# в 64 поля по SIMHASH_FIELD бит (по таблице на каждый байт) и умножается на вес.
+
+SIMHASH_FIELD = 32
+SIMHASH_SPREAD = [sum(((x >> i) & 1) << (SIMHASH_FIELD * i) for i in range(8)) for x in range(256)]
+
+def simhash(weights):
+    # {токен: вес} -> 64-битный отпечаток
+    acc = total = 0
+    for tok, w in weights.items():
+        data = tok.encode("utf-8", "replace")
+        h = zlib.crc32(data) | (zlib.crc32(data, 0x5bd1e995) << 32)
+        spread = 0
+        for k in range(8):
+            spread |= SIMHASH_SPREAD[(h >> (8 * k)) & 0xFF] << (SIMHASH_FIELD * 8 * k)
+        acc += w * spread
+        total += w
+    mask, half, fp = (1 << SIMHASH_FIELD) - 1, total / 2, 0
+    for i in range(64):
+        if (acc >> (SIMHASH_FIELD * i)) & mask > half:
+            fp |= 1 << i
+    return fp
+
+class FingerprintIndex(JournaledDict):
+    # Отпечатки выученных документов {hex: эпоха, когда видели последний раз}, не больше
+    # capacity (вытесняются самые старые по вставке). LSH: 64 бита режутся на 4 полосы по 16;
+    # при расстоянии Хэмминга <= 3 хотя бы одна полоса совпадает, поэтому сравниваются
+    # только отпечатки с общей полосой
+    def __init__(self, items=(), capacity=DEDUP_CAPACITY):
+        super().__init__(items)
+        self.capacity = capacity
+        self._bands = {}
+        for k in self:
+            self._link(int(k, 16))
+
+    @staticmethod
+    def bands(fp):
+        return [(i, (fp >> (16 * i)) & 0xFFFF) for i in range(4)]
+
+    def _link(self, fp):
+        for band in self.bands(fp):
+            self._bands.setdefault(band, set()).add(fp)
+
+    def _unlink(self, fp):
+        for band in self.bands(fp):
+            fps = self._bands.get(band)
+            if fps is not None:
+                fps.discard(fp)
+                if not fps:
+                    del self._bands[band]
+
+    def match(self, fp):
+        # (ключ, расстояние) ближайшего известного отпечатка в пределах DEDUP_HAMMING или None
+        key = f"{fp:016x}"
+        if key in self:
+            return key, 0
+        best = None
+        for band in self.bands(fp):
+            for other in self._bands.get(band, ()):
+                d = bin(fp ^ other).count("1")
+                if d <= DEDUP_HAMMING and (best is None or d < best[1]):
+                    best = (f"{other:016x}", d)
+        return best
+
+    def remember(self, fp, epoch):
+        key = f"{fp:016x}"
+        if key not in self:
+            while len(self) >= self.capacity:
+                old = next(iter(self))
+                self._unlink(int(old, 16))
+                del self[old]
+            self._link(fp)
+        self[key] = epoch
+
+class DocStore(JournaledDict):
+    # Документы корпуса по адресу содержимого {blake2b: битовая маска пройденных этапов
+    # DOC_STAGES}: id не зависит от позиции в corpus и переживает обрезку и перезапуск,
+    # поэтому каждый этап отрабатывает по документу ровно один раз. Не больше capacity
+    # (вытесняются самые старые по вставке). Токены/сущности последних DOC_CACHE документов
+    # кэшируются в памяти и не журналируются
+    def __init__(self, items=(), capacity=DOCS_CAPACITY):
+        super().__init__(items)
+        self.capacity = capacity
+        self._cache = OrderedDict()
+
+    @staticmethod
+    def key_of(text):
+        return hashlib.blake2b(text.encode("utf-8", "replace"), digest_size=10).hexdigest()
+
+    def done(self, text, stage):
+        return bool(self.get(self.key_of(text), 0) & DOC_STAGES[stage])
+
+    def claim(self, text, stage):
+        # True, если этап по документу ещё не запускался; отметка ставится сразу, так что
+        # упавший этап не повторяется на каждой эпохе
+        key, bit = self.key_of(text), DOC_STAGES[stage]
+        mask = self.get(key)
+        if mask is None:
+            while len(self) >= self.capacity:
+                del self[next(iter(self))]
+            mask = 0
+        elif mask & bit:
+            return False
+        self[key] = mask | bit
+        return True
+
+    def cached(self, text, field, compute):
+        key = self.key_of(text)
+        entry = self._cache.get(key)
+        if entry is None:
+            entry = self._cache[key] = {}
+            if len(self._cache) > DOC_CACHE:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(key)
+        if field not in entry:
+            entry[field] = compute(text)
+        return entry[field]
+
+def replay_delta(value, delta):
+    # Применяет дельту секции к "плоскому" значению (как оно лежит в JSON)
+    if "reset" in delta:
+        return delta["reset"]
+    if "add" in delta:
+        value = value if isinstance(value, list) else []
+        value.extend(delta["add"])
+        keep = delta.get("keep", len(value))
+        if len(value) > keep:
+            del value[:len(value) - keep]
+        return value
+    value = value if isinstance(value, dict) else {}
+    value.update(delta.get("put", {}))
+    for k in delta.get("del", []):
+        value.pop(str(k), None)
+    return value
+
+def atomic_write(path, data):
+    # Временный файл + fsync + os.replace: на диске всегда либо старая, либо новая версия целиком.
+    # data — str, bytes или функция, которая сама пишет в открытый бинарный файл
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        if callable(data):
+            data(f)
+        else:
+            f.write(data.encode("utf-8") if isinstance(data, str) else data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    except OSError:
+        pass
+
+# --- Бинарный секционный снапшот ---
+# Заголовок: BRAIN_MAGIC, версия, число секций; затем таблица (имя, флаги, смещение, длина)
+# и сами секции — JSON, крупные сжаты zlib. Таблица читается сразу, секции — по запросу.
+
+SECTION_ZLIB = 1
+
+def encode_section(value):
+    data = json.dumps(value, ensure_ascii=False).encode("utf-8")
+    if len(data) >= BRAIN_COMPRESS_MIN:
+        return SECTION_ZLIB, zlib.compress(data, BRAIN_ZLIB_LEVEL)
+    return 0, data
+
+def pack_weights(weights):
+    # Вектор весов в журнал/снапшот: "f8:" + base64 little-endian float64 — точно и вдвое
+    # короче JSON-списка, который уходил целиком в каждую запись журнала
+    return "f8:" + base64.b64encode(np.asarray(weights, dtype="<f8").tobytes()).decode("ascii")
+
+def unpack_weights(value, default):
+    # Принимает и упакованную строку, и старый JSON-список
+    if isinstance(value, str) and value.startswith("f8:"):
+        return np.frombuffer(base64.b64decode(value[3:]), dtype="<f8").astype(np.float64)
+    if isinstance(value, list) and value:
+        return np.asarray(value, dtype=np.float64)
+    return default
+
+class BrainFile:
+    def __init__(self, path):
+        self.path = path
+        self._f = open(path, "rb")
+        self._lock = threading.Lock()
+        magic, version, count = struct.unpack("<4sHH", self._f.read(8))
+        if magic != BRAIN_MAGIC or version > BRAIN_VERSION:
+            self._f.close()
+            raise ValueError(f"{path}: неизвестный формат состояния")
+        self.sections = {}
+        for _ in range(count):
+            name = self._f.read(self._f.read(1)[0]).decode("utf-8")
+            self.sections[name] = struct.unpack("<BQQ", self._f.read(17))
+
+    def __contains__(self, name):
+        return name in self.sections
+
+    def names(self):
+        return list(self.sections)
+
+    def read_raw(self, name):
+        flags, offset, length = self.sections[name]
+        with self._lock:
+            self._f.seek(offset)
+            return self._f.read(length)
+
+    def read(self, name):
+        data = self.read_raw(name)
+        if self.sections[name][0] & SECTION_ZLIB:
+            data = zlib.decompress(data)
+        return json.loads(data)
+
+    def copy_raw(self, name, out, chunk=1 << 20):
+        # Переносит секцию в новый файл без распаковки и разбора
+        flags, offset, length = self.sections[name]
+        with self._lock:
+            self._f.seek(offset)
+            while length > 0:
+                buf = self._f.read(min(chunk, length))
+                if not buf:
+                    raise IOError(f"{self.path}: секция {name} обрезана")
+                out.write(buf)
+                length -= len(buf)
+
+    def close(self):
+        self._f.close()
+
+def write_brain_file(path, entries):
+    # entries: [(name, flags, bytes | BrainFile)]; BrainFile — скопировать секцию из старого снапшота
+    rows, offset = [], 8 + sum(1 + len(name.encode("utf-8")) + 17 for name, _, _ in entries)
+    for name, flags, data in entries:
+        length = data.sections[name][2] if isinstance(data, BrainFile) else len(data)
+        rows.append((name.encode("utf-8"), flags, offset, length))
+        offset += length
+    def dump(f):
+        f.write(struct.pack("<4sHH", BRAIN_MAGIC, BRAIN_VERSION, len(rows)))
+        for bname, flags, off, length in rows:
+            f.write(bytes([len(bname)]) + bname + struct.pack("<BQQ", flags, off, length))
+        for name, flags, data in entries:
+            if isinstance(data, BrainFile):
+                data.copy_raw(name, f)
+            else:
+                f.write(data)
+    atomic_write(path, dump)
+
+def convert_json_brain(src=LEGACY_SAVE_FILE, dst=SAVE_FILE):
+    # Конвертер старого ai_brain_ultra.json в секционный формат
+    with open(src, encoding="utf-8") as f:
+        state = json.load(f)
+    write_brain_file(dst, [(name, *encode_section(value)) for name, value in state.items()])
+    log_event(f"[Convert] {src} -> {dst}: {len(state)} секций")
+    return dst
+
+class StateJournal:
+    # Движок хранения: append-only журнал + сворачивание в секционный снапшот.
+    # Пишет в него только поток StateWriter, поэтому собственных блокировок нет.
+    def __init__(self, snapshot_file=SAVE_FILE, journal_file=JOURNAL_FILE):
+        self.snapshot_file = snapshot_file
+        self.journal_file = journal_file
+        self.seq = 0
+        self.records = 0
+        self.bytes = 0
+        self._torn = False  # прошлая запись упала посреди строки — следующая начнётся с новой строки
+
+    def _repair_tail(self):
+        # Падение посреди write() оставляет последнюю строку без "\n". Следующая запись "ab"
+        # приклеилась бы к ней, и при загрузке склейка пропала бы целиком вместе с целой записью.
+        # Поэтому перед чтением файл обрезается до последнего "\n"
+        if not os.path.exists(self.journal_file):
+            return
+        with open(self.journal_file, "rb+") as f:
+            end = f.seek(0, os.SEEK_END)
+            pos = end
+            while pos > 0:
+                step = min(FETCH_CHUNK, pos)
+                f.seek(pos - step)
+                block = f.read(step)
+                i = block.rfind(b"\n")
+                if i >= 0:
+                    pos = pos - step + i + 1
+                    break
+                pos -= step
+            if pos < end:
+                f.truncate(pos)
+                f.flush()
+                os.fsync(f.fileno())
+                log_event(f"[JournalRepair] Отрезан оборванный хвост журнала: {end - pos} байт")
+
+    def _read_journal(self):
+        if not os.path.exists(self.journal_file):
+            return
+        with open(self.journal_file, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # Оборванная при падении последняя строка — просто пропускаем
+                    continue
+
+    def _open_snapshot(self):
+        if not os.path.exists(self.snapshot_file):
+            if not os.path.exists(LEGACY_SAVE_FILE):
+                return None
+            convert_json_brain(LEGACY_SAVE_FILE, self.snapshot_file)
+        return BrainFile(self.snapshot_file)
+
+    def load(self):
+        # Горячие секции читаются сразу, тяжёлые (LAZY_SECTIONS) возвращаются загрузчиками:
+        # секция распакуется и догонит свои записи журнала только при первом обращении
+        snap = self._open_snapshot()
+        state = {}
+        if snap:
+            for name in snap.names():
+                if name not in LAZY_SECTIONS:
+                    state[name] = snap.read(name)
+        base = state.get("journal_seq", 0)
+        pending = {name: [] for name in LAZY_SECTIONS}
+        self._repair_tail()
+        self.seq, self.records = base, 0
+        for rec in self._read_journal():
+            if rec.get("seq", 0) <= base:
+                continue
+            state.update(rec.get("scalars", {}))
+            for name, delta in rec.get("sections", {}).items():
+                if name in pending:
+                    pending[name].append(delta)
+                else:
+                    state[name] = replay_delta(state.get(name), delta)
+            self.seq = rec["seq"]
+            self.records += 1
+        self.bytes = os.path.getsize(self.journal_file) if os.path.exists(self.journal_file) else 0
+        def loader(name):
+            def load_section():
+                value = snap.read(name) if snap and name in snap else None
+                for delta in pending.pop(name):
+                    value = replay_delta(value, delta)
+                return value
+            return load_section
+        return state, {name: loader(name) for name in LAZY_SECTIONS}
+
+    def record(self, scalars, sections):
+        # Кодирует одну запись журнала (строка JSON)
+        self.seq += 1
+        rec = {"seq": self.seq, "time": time.time(), "scalars": scalars, "sections": sections}
+        return json.dumps(rec, ensure_ascii=False) + "\n"
+
+    def write(self, line):
+        data = line.encode("utf-8")
+        if self._torn:
+            data = b"\n" + data
+        try:
+            with open(self.journal_file, "ab") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError:
+            self._torn = True  # могла уйти часть строки
+            raise
+        self._torn = False
+        self.records += 1
+        self.bytes += len(data)
+        return len(data)
+
+    def needs_compaction(self):
+        return self.bytes > JOURNAL_COMPACT_BYTES or self.records > JOURNAL_COMPACT_RECORDS
+
+    def compact(self):
+        # Сворачивает журнал в новый снапшот: секции, которых журнал не касался,
+        # копируются из старого файла байт в байт, остальные пересобираются
+        old = BrainFile(self.snapshot_file) if os.path.exists(self.snapshot_file) else None
+        try:
+            base = old.read("journal_seq") if old and "journal_seq" in old else 0
+            touched = {}
+            for rec in self._read_journal():
+                if rec.get("seq", 0) <= base:
+                    continue
+                touched.update(rec.get("scalars", {}))
+                for name, delta in rec.get("sections", {}).items():
+                    if name not in touched:
+                        touched[name] = old.read(name) if old and name in old else None
+                    touched[name] = replay_delta(touched[name], delta)
+            touched["journal_seq"] = self.seq
+            entries = [(name, old.sections[name][0], old) for name in (old.names() if old else [])
+                       if name not in touched]
+            entries += [(name, *encode_section(value)) for name, value in touched.items()]
+            write_brain_file(self.snapshot_file, entries)
+        finally:
+            if old:
+                old.close()
+        atomic_write(self.journal_file, "")
+        self.records, self.bytes = 0, 0
+        log_event(f"[Compact] Журнал свернут в снапшот до seq={self.seq}")
+
+class StateWriter:
+    # Отдельный поток записи: save() только ставит запрос, а все запросы, пришедшие
+    # за окно склейки (evolve, авто-backup, авто-расширение, обслуживание),
+    # превращаются в один согласованный срез и одну запись на диск
+    def __init__(self, ai, journal, delay=SAVE_COALESCE_SEC):
+        self.ai = ai
+        self.journal = journal
+        self.delay = delay
+        self._cond = threading.Condition()
+        self._requested = 0
+        self._done = 0
+        self._running = True
+        self._full = False
+        self.stats = {"writes": 0, "requests": 0, "coalesced": 0, "bytes": 0, "errors": 0, "last_ms": 0.0}
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def request(self, wait=False):
+        # wait=True — дождаться, пока запрос окажется на диске (не вызывать под state_lock!)
+        with self._cond:
+            self._requested += 1
+            ticket = self._requested
+            self._cond.notify_all()
+            while wait and self._done < ticket and self._thread.is_alive():
+                self._cond.wait(1)
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self._thread.join(timeout=30)
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while self._running and self._done >= self._requested:
+                    self._cond.wait()
+                if not self._running and self._done >= self._requested:
+                    return
+                running = self._running
+            if running:
+                time.sleep(self.delay)
+            with self._cond:
+                target = self._requested
+                served = target - self._done
+            self._write(served)
+            with self._cond:
+                self._done = target
+                self._cond.notify_all()
+
+    def _write(self, served):
+        t0 = time.perf_counter()
+        nbytes = 0
+        try:
+            with self.ai.state_lock:
+                line = self.ai.capture_state(full=self._full)
+            nbytes = self.journal.write(line)
+            self._full = False
+        except Exception as e:
+            # Дельты уже забраны из контейнеров — следующая запись будет полной
+            self._full = True
+            self.stats["errors"] += 1
+            log_event(f"[SaveError] {e}")
+        if nbytes and self.journal.needs_compaction():
+            try:
+                self.journal.compact()
+            except Exception as e:
+                log_event(f"[CompactError] {e}")
+        ms = (time.perf_counter() - t0) * 1000
+        self.stats["writes"] += 1
+        self.stats["requests"] += served
+        self.stats["coalesced"] += served - 1
+        self.stats["bytes"] += nbytes
+        self.stats["last_ms"] = round(ms, 2)
+        with self.ai.state_lock:
+            self.ai.log_metric("save", {"ms": round(ms, 2), "bytes": nbytes, "requests": served,
+                                        "coalesced_total": self.stats["coalesced"]})
+
+# --- Сеть: пул загрузчиков с keep-alive сессиями ---
+
+def make_session(pool=FETCH_POOL_SIZE):
+    # Session держит соединения открытыми — повторные запросы к тому же хосту без нового TLS
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool, pool_maxsize=pool)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["User-Agent"] = "Mozilla/5.0"
+    return session
+
+def iter_text(r, max_bytes, chunk=FETCH_CHUNK):
+    # Тело ответа кусками str. Нетекстовый Content-Type отбрасывается до чтения тела,
+    # декодирование инкрементальное (многобайтовые символы на стыке кусков не бьются),
+    # чтение обрывается на max_bytes. Без charset в заголовке — utf-8, а не ISO-8859-1
+    ctype = r.headers.get("Content-Type", "")
+    if ctype and not ctype.split(";")[0].strip().lower().startswith(TEXT_CONTENT_TYPES):
+        return
+    try:
+        decoder = codecs.getincrementaldecoder(r.encoding if "charset" in ctype.lower() else "utf-8")("replace")
+    except (LookupError, TypeError):
+        decoder = codecs.getincrementaldecoder("utf-8")("replace")
+    got = 0
+    for data in r.iter_content(chunk_size=chunk):
+        got += len(data)
+        yield decoder.decode(data)
+        if got >= max_bytes:
+            break
+    yield decoder.decode(b"", True)
+
+class HttpCache:
+    # Дисковый кэш GET по URL: ETag/Last-Modified и уже очищенный текст ответа. Свежая по
+    # CACHE_MAX_AGE запись отдаётся без сети, устаревшая перепроверяется условным запросом —
+    # на 304 текст берётся с диска без скачивания и разбора
+    def __init__(self, folder=CACHE_DIR, max_age=None):
+        self.folder = folder
+        self.max_age = CACHE_MAX_AGE if max_age is None else max_age
+        self.stats = {"fresh": 0, "not_modified": 0, "fetched": 0, "errors": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def path(self, url):
+        return os.path.join(self.folder, hashlib.blake2b(url.encode(), digest_size=10).hexdigest() + ".json")
+
+    def policy(self, url):
+        host = url.split('/')[2] if url.count('/') >= 2 else ""
+        return self.max_age.get(host, self.max_age.get("*", 0))
+
+    def load(self, url):
+        try:
+            with open(self.path(url), encoding="utf-8") as f:
+                entry = json.load(f)
+            return entry if entry.get("url") == url else None
+        except (OSError, ValueError):
+            return None
+
+    def store(self, url, entry):
+        path = self.path(url)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp, path)
+        except OSError as e:
+            self._count("errors")
+            log_event(f"[HttpCacheError] {url}: {e}")
+
+    def get(self, session, url, read, timeout=FETCH_TIMEOUT):
+        # read(response) -> текст. Возвращает (текст, changed); changed=False — источник не
+        # изменился с прошлого раза (304), текст взят из кэша; changed=None — запись ещё
+        # свежая, сеть не трогали
+        entry = self.load(url)
+        now = time.time()
+        if entry and now - entry["time"] < self.policy(url):
+            self._count("fresh")
+            return entry["text"], None
+        headers = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        r = session.get(url, timeout=timeout, stream=True, headers=headers)
+        try:
+            if r.status_code == 304 and entry:
+                entry["time"] = now
+                self.store(url, entry)
+                self._count("not_modified")
+                return entry["text"], False
+            if r.status_code == 429 or r.status_code >= 500:
+                raise requests.HTTPError(f"HTTP {r.status_code} {url}", response=r)
+            if r.status_code != 200:
+                return "", False
+            text = read(r)
+            etag, modified = r.headers.get("ETag"), r.headers.get("Last-Modified")
+        finally:
+            r.close()
+        self._count("fetched")
+        if text and (etag or modified or self.policy(url)):
+            self.store(url, {"url": url, "etag": etag, "last_modified": modified, "time": now, "text": text})
+        return text, True
+
+class HtmlTextExtractor(HTMLParser):
+    # Потоковый HTML -> текст: страница подаётся в feed() кусками прямо из ответа,
+    # script/style и комментарии пропускаются, сущности декодируются (convert_charrefs),
+    # пробелы схлопываются. Как только набран budget символов — done, дальше не читаем.
+    SKIP_TAGS = {"script", "style"}
+    BREAK_TAGS = {"br", "p", "div", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6"}
+    DROP = re.compile(r'[^a-zA-Zа-яА-Я0-9\s:;.,_+=\-\/\(\)\[\]\{\}#@!%*]')
+    SPACES = re.compile(r'\s+')
+
+    def __init__(self, budget=None):
+        super().__init__(convert_charrefs=True)
+        self.budget = budget
+        self.size = 0
+        self.done = False
+        self._parts = []
+        self._skip = 0
+
+    def feed(self, data):
+        if not self.done:
+            super().feed(data)
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self._skip += 1
+        elif tag in self.BREAK_TAGS:
+            self._emit("\n")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self._skip = max(0, self._skip - 1)
+
+    def handle_data(self, data):
+        if not self._skip:
+            self._emit(self.SPACES.sub(self._space, self.DROP.sub('', data)))
+
+    @staticmethod
+    def _space(m):
+        return "\n" if "\n" in m.group() else " "
+
+    def _emit(self, text):
+        if not text:
+            return
+        self._parts.append(text)
+        self.size += len(text)
+        if self.budget and self.size >= self.budget:
+            self.done = True
+
+    def result(self):
+        text = self.SPACES.sub(self._space, "".join(self._parts)).strip()
+        return text[:self.budget] if self.budget else text
+
+class DomainState:
+    __slots__ = ("tokens", "refill", "requests", "errors", "fails", "retry_at", "open_until", "trial",
+                 "latency", "yield_")
+
+    def __init__(self):
+        self.tokens, self.refill = CRAWL_BURST, time.time()
+        self.requests = self.errors = self.fails = 0
+        self.retry_at = self.open_until = 0.0
+        self.trial = False  # полуоткрытый размыкатель: пробный запрос уже в пути
+        self.latency = 0.0
+        self.yield_ = 1.0  # оптимистично: новый домен сначала пробуем
+
+class CrawlScheduler:
+    # Какой URL качать следующим. По каждому домену: token bucket (CRAWL_RATE, CRAWL_BURST),
+    # экспоненциальная пауза после ошибки, размыкание после CRAWL_BREAKER ошибок подряд
+    # (по истечении CRAWL_BREAKER_SEC — полуоткрытое состояние: ровно одна пробная попытка,
+    # успех замыкает, ошибка снова размыкает), скользящие задержка и выход
+    # (килобайты текста + попадания ключевых слов; дубликат/пустая страница — 0).
+    # Из готовых доменов выбор случайный с весом выход / задержка. Ответ из свежего
+    # HttpCache сети не касался — refund() возвращает токен и не трогает выход и задержку
+    def __init__(self, urls=None):
+        self.urls = list(urls or URLS)
+        self.domains = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def domain(url):
+        return url.split('/')[2] if url.count('/') >= 2 else url
+
+    def _state(self, url):
+        d = self.domain(url)
+        st = self.domains.get(d)
+        if st is None:
+            st = self.domains[d] = DomainState()
+        return st
+
+    def _ready(self, st, now):
+        st.tokens = min(CRAWL_BURST, st.tokens + (now - st.refill) * CRAWL_RATE)
+        st.refill = now
+        if st.open_until and (now < st.open_until or st.trial):
+            return False  # разомкнут или пробный запрос ещё не вернулся
+        return st.tokens >= 1 and now >= st.retry_at
+
+    def pick(self):
+        # URL, на который можно идти прямо сейчас, или None
+        now = time.time()
+        with self._lock:
+            ready, weights = [], []
+            for url in self.urls:
+                st = self._state(url)
+                if self._ready(st, now):
+                    ready.append((url, st))
+                    weights.append((0.1 + st.yield_) / (1 + st.latency))
+            if not ready:
+                return None
+            url, st = random.choices(ready, weights)[0]
+            st.tokens -= 1
+            st.requests += 1
+            st.trial = bool(st.open_until)
+            return url
+
+    def refund(self, url):
+        # Запрос обслужен свежим кэшем без сети: токен возвращается, пробная попытка
+        # полуоткрытого домена остаётся за следующим настоящим запросом
+        with self._lock:
+            st = self._state(url)
+            st.tokens = min(CRAWL_BURST, st.tokens + 1)
+            st.requests -= 1
+            st.trial = False
+
+    def wait(self):
+        # Через сколько секунд освободится хоть один домен
+        now = time.time()
+        with self._lock:
+            waits = [max(st.retry_at, st.open_until, now + max(0.0, 1 - st.tokens) / CRAWL_RATE) - now
+                     for st in (self._state(u) for u in self.urls) if not st.trial]
+        return max(0.05, min(waits, default=1.0))
+
+    def report(self, url, latency, error=None):
+        now = time.time()
+        with self._lock:
+            st = self._state(url)
+            st.latency = latency if not st.latency else 0.7 * st.latency + 0.3 * latency
+            trial, st.trial = st.trial, False
+            if error is None:
+                st.fails = 0
+                st.open_until = 0.0
+                return
+            st.errors += 1
+            st.fails += 1
+            base, cap = CRAWL_BACKOFF
+            st.retry_at = now + min(cap, base * 2 ** (st.fails - 1)) * random.uniform(0.8, 1.2)
+            if trial or st.fails >= CRAWL_BREAKER:
+                st.open_until = now + CRAWL_BREAKER_SEC
+        if st.fails >= CRAWL_BREAKER:
+            log_event(f"[Crawl] {self.domain(url)}: {st.fails} ошибок подряд, отключён на {CRAWL_BREAKER_SEC} c ({error})")
+
+    def credit(self, url, value):
+        # Выход очередного документа с этого домена
+        with self._lock:
+            st = self._state(url)
+            st.yield_ = 0.7 * st.yield_ + 0.3 * value
+
+    def table(self):
+        now = time.time()
+        with self._lock:
+            return {d: {"requests": st.requests, "errors": st.errors,
+                        "error_rate": round(st.errors / st.requests, 3) if st.requests else 0,
+                        "latency_ms": round(st.latency * 1000), "yield": round(st.yield_, 2),
+                        "state": "open" if now < st.open_until else "half-open" if st.open_until
+                        else "backoff" if now < st.retry_at else "ok"}
+                    for d, st in self.domains.items()}
+
+class FetchPipeline:
+    # Производители: workers потоков, у каждого своя Session, качают и чистят страницы.
+    # Потребитель: evolve() забирает готовые документы из ограниченной очереди docs,
+    # так что анализ никогда не ждёт сеть, а при полной очереди загрузчики притормаживают.
+    def __init__(self, fetch, scheduler, workers=FETCH_WORKERS, depth=FETCH_QUEUE_DEPTH):
+        self.fetch = fetch  # fetch(session, url) -> очищенный текст, "" или None (свежий кэш)
+        self.scheduler = scheduler
+        self.workers = workers
+        self.docs = queue.Queue(maxsize=depth)
+        self.stats = {"fetched": 0, "empty": 0, "cached": 0, "failed": 0}
+        self._stats_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"fetch-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def stop(self, timeout=None):
+        # timeout — дождаться выхода загрузчиков (не дольше timeout сек на поток)
+        self._stop.set()
+        if timeout is not None:
+            for t in self._threads:
+                t.join(timeout)
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def _worker(self):
+        session = make_session()
+        while not self._stop.is_set():
+            url = self.scheduler.pick()
+            if url is None:
+                self._stop.wait(self.scheduler.wait())
+                continue
+            t0 = time.time()
+            try:
+                text = self.fetch(session, url)
+            except Exception as ex:
+                self.scheduler.report(url, time.time() - t0, ex)
+                self._count("failed")
+                log_event(f"[fetch_data_error] {ex}")
+                continue
+            if text is None:
+                self.scheduler.refund(url)
+                self._count("cached")
+                self._stop.wait(FETCH_IDLE_SEC)
+                continue
+            self.scheduler.report(url, time.time() - t0)
+            if not text:
+                self.scheduler.credit(url, 0)
+                self._count("empty")
+                self._stop.wait(FETCH_IDLE_SEC)
+                continue
+            self._count("fetched")
+            while not self._stop.is_set():
+                try:
+                    self.docs.put((text, url), timeout=1)
+                    break
+                except queue.Full:
+                    continue
+
+    def get(self, timeout=FETCH_WAIT_SEC):
+        try:
+            return self.docs.get(timeout=timeout)
+        except queue.Empty:
+            return "", ""
+
+# --- Слитный анализатор текста ---
+
+class DocFeatures:
+    # Все признаки документа, посчитанные анализатором за один раз
+    __slots__ = ("words", "keyword_hits", "trend_words", "skill_words", "lines", "code",
+                 "facts", "stats", "funcs", "has_return", "has_project", "project")
+
+class TextAnalyzer:
+    # Вместо отдельного скана в каждом этапе evolve() (а в update_skills — по скану
+    # на каждое ключевое слово) текст приводится к нижнему регистру один раз, и одно
+    # регулярное выражение выдаёт и токены \w+, и многословные ключевые слова
+    # ("machine learning"). Дальше все этапы работают со счётчиками уникальных токенов.
+    PROJECT_WORDS = ("project", "repo", "package", "framework", "dataset")
+
+    def __init__(self, keywords=KEYWORDS):
+        phrases = sorted((k for k in keywords if " " in k), key=len, reverse=True)
+        alt = "|".join(re.escape(k) for k in phrases) or "(?!)"
+        self._scan = re.compile(r'\b(' + alt + r')\b|(\w+)').findall
+        self.single = [k for k in keywords if " " not in k]
+
+    def analyze(self, text):
+        low = text.lower()
+        f = DocFeatures()
+        words, hits = {}, {}
+        for (phrase, tok), c in Counter(self._scan(low)).items():
+            if phrase:
+                hits[phrase] = c
+                for w in phrase.split():
+                    words[w] = words.get(w, 0) + c
+            else:
+                words[tok] = words.get(tok, 0) + c
+        for kw in self.single:
+            if kw in words:
+                hits[kw] = words[kw]
+        trend, skill = {}, set()
+        for w, c in words.items():
+            if not w.isascii():
+                continue
+            if len(w) >= 6 and w.isalpha():
+                trend[w] = c  # \b[a-zA-Z]{6,}\b
+            if 3 <= len(w) <= 24 and w.replace('_', 'a').isalpha():
+                skill.add(w)  # \b[a-zA-Z_]{3,24}\b
+        f.words, f.keyword_hits, f.trend_words, f.skill_words = words, hits, trend, skill
+        f.lines = text.count('\n')
+        f.code = text.count("def ") + text.count("class ") + text.count("import ")
+        f.facts = re.findall(r'([A-Z][a-z]+ is [^\.]{10,110}\.)', text)
+        f.stats = re.findall(r'([A-Za-z_]{3,32}[:=]\s*[0-9\.]+)', text)
+        f.funcs = re.findall(r'def ([a-zA-Z_][\w]*)\(', text) if "def " in text else []
+        f.has_return = "return" in text
+        f.has_project = any(w in low for w in self.PROJECT_WORDS)
+        match = re.search(r'project ([a-zA-Z0-9_\-]+)', text) if f.has_project else None
+        f.project = match.group(1) if match else ""
+        return f
+
+# --- Поисковый индекс ---
+# По источнику (документы корпуса, примеры кода, факты, проекты, тренды, скиллы) — свой
+# инвертированный индекс: терм \w+ -> {id: tf} (id — позиция в JournaledList или ключ
+# JournaledDict); длины документов нужны для BM25. Для подстрок есть второй индекс — триграммы словаря -> термы: токен на
+# краю запроса разворачивается в термы, которые его содержат. Кандидаты всегда проверяются
+# подстрокой, поэтому выдача та же, что у полного скана, а время не растёт с размером состояния.
+
+WORD_RE = re.compile(r'\w+')
+
+def trigrams(term):
+    return {term[i:i + 3] for i in range(len(term) - 2)}
+
+class SearchIndex:
+    def __init__(self, text_of=lambda key, item: item):
+        self.text_of = text_of  # (id, элемент) -> индексируемый текст
+        self.postings = {}
+        self.grams = {}
+        self.lengths = {}
+        self.total = 0
+        self.source = None
+        self.version = 0  # нечётная — индекс меняется прямо сейчас (см. UltraEvoAI.read_indexes)
+        self._depth = 0   # вложенные begin() (rebuild -> add, rewrite -> rebuild) — version меняется по краям
+
+    def attach(self, source):
+        # Новый контейнер (загрузка секции, system_reset) — индекс строится заново
+        self.source = source
+        source.watch = self
+        self.rebuild()
+
+    def begin(self):
+        if not self._depth:
+            self.version += 1
+        self._depth += 1
+
+    def end(self):
+        self._depth -= 1
+        if not self._depth:
+            self.version += 1
+
+    def rebuild(self):
+        self.begin()
+        try:
+            self.postings, self.grams, self.lengths, self.total = {}, {}, {}, 0
+            for key in self.keys():
+                self.add(key, self.get(key))
+        finally:
+            self.end()
+
+    def keys(self):
+        # Для списков — от новых к старым
+        s = self.source
+        if isinstance(s, list):
+            return range(s._base + len(s) - 1, s._base - 1, -1)
+        return iter(s)
+
+    def get(self, key):
+        s = self.source
+        return s[key - s._base] if isinstance(s, list) else s[key]
+
+    def terms(self, key, item):
+        return Counter(WORD_RE.findall(self.text_of(key, item).lower()))
+
+    def add(self, key, item):
+        self.begin()
+        try:
+            postings = self.postings
+            counts = self.terms(key, item)
+            for term, tf in counts.items():
+                ids = postings.get(term)
+                if ids is None:
+                    ids = postings[term] = {}
+                    for g in trigrams(term):
+                        self.grams.setdefault(g, set()).add(term)
+                ids[key] = tf
+            self.lengths[key] = n = sum(counts.values())
+            self.total += n
+        finally:
+            self.end()
+
+    def remove(self, key, item):
+        self.begin()
+        try:
+            self._remove(key, item)
+        finally:
+            self.end()
+
+    def _remove(self, key, item):
+        self.total -= self.lengths.pop(key, 0)
+        for term in self.terms(key, item):
+            ids = self.postings.get(term)
+            if ids is None:
+                continue
+            ids.pop(key, None)
+            if not ids:
+                del self.postings[term]
+                for g in trigrams(term):
+                    terms = self.grams.get(g)
+                    if terms is not None:
+                        terms.discard(term)
+                        if not terms:
+                            del self.grams[g]
+
+    def put(self, key, item):
+        # Вызывается до записи в словарь: старое значение ещё на месте
+        if key in self.source:
+            old = self.source[key]
+            if self.text_of(key, old) == self.text_of(key, item):
+                return  # trends/skills/projects индексируются по ключу — счётчики не трогают индекс
+            self.remove(key, old)
+        self.add(key, item)
+
+    def expand(self, tok, closed_left, closed_right):
+        # Термы, в которые может входить токен запроса. Внутренний токен — терм целиком,
+        # крайний — префикс/суффикс/подстрока терма. None — слишком короткий, не сужаем
+        if closed_left and closed_right:
+            return [tok] if tok in self.postings else []
+        if len(tok) < 3:
+            return None
+        sets = sorted((self.grams.get(g, ()) for g in trigrams(tok)), key=len)
+        terms = set(sets[0]).intersection(*sets[1:])
+        if closed_left:
+            return [t for t in terms if t.startswith(tok)]
+        if closed_right:
+            return [t for t in terms if t.endswith(tok)]
+        return [t for t in terms if tok in t]
+
+    def candidates(self, q):
+        result = None
+        for m in WORD_RE.finditer(q):
+            terms = self.expand(m.group(), m.start() > 0, m.end() < len(q))
+            if terms is None:
+                continue
+            ids = set().union(*(self.postings[t] for t in terms))
+            result = ids if result is None else result & ids
+            if not result:
+                break
+        return result
+
+    def scores(self, q):
+        # BM25 по термам запроса: {id: score} только для документов, где есть хоть один терм.
+        # Токен, которого нет в словаре (недописанное слово), разворачивается как префикс
+        n = len(self.lengths)
+        if not n:
+            return {}
+        avg = self.total / n or 1
+        terms = set()
+        for tok in WORD_RE.findall(q):
+            if tok in self.postings:
+                terms.add(tok)
+            else:
+                terms.update(self.expand(tok, True, False) or ())
+        acc, lengths = {}, self.lengths
+        for term in terms:
+            ids = self.postings[term]
+            idf = math.log(1 + (n - len(ids) + 0.5) / (len(ids) + 0.5))
+            for key, tf in ids.items():
+                norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * lengths[key] / avg)
+                acc[key] = acc.get(key, 0.0) + idf * tf * (BM25_K1 + 1) / norm
+        return acc
+
+    def find(self, q, limit):
+        # До limit совпадений подстроки q (уже в нижнем регистре): [(id, элемент)]
+        if limit <= 0 or self.source is None:
+            return []
+        ids = self.candidates(q)
+        if ids is None:
+            return self._find_short(q, limit)
+        out = []
+        for key in sorted(ids, reverse=isinstance(self.source, list)):
+            item = self.get(key)
+            if q in self.text_of(key, item).lower():
+                out.append((key, item))
+                if len(out) >= limit:
+                    break
+        return out
+
+    def _find_short(self, q, limit):
+        # В запросе нет токена от 3 символов (или вообще нет букв) — триграммы не сужают. Вместо
+        # скана всего источника: документы с точными термами запроса по postings (не больше
+        # SEARCH_SCAN_CAP проверок), затем SEARCH_SCAN_CAP самых новых записей
+        exact = None
+        for tok in sorted(set(WORD_RE.findall(q)), key=lambda t: len(self.postings.get(t, ()))):
+            ids = self.postings.get(tok, {})
+            exact = set(ids) if exact is None else exact.intersection(ids)
+            if not exact:
+                break
+        newest = isinstance(self.source, list)
+        keys = islice(sorted(exact, reverse=newest), SEARCH_SCAN_CAP) if exact else ()
+        seen, out = set(), []
+        for key in chain(keys, islice(self.keys(), SEARCH_SCAN_CAP)):
+            if key in seen:
+                continue
+            seen.add(key)
+            item = self.get(key)
+            if q in self.text_of(key, item).lower():
+                out.append((key, item))
+                if len(out) >= limit:
+                    break
+        if newest:
+            out.sort(key=lambda x: x[0], reverse=True)
+        return out
+
+class LazySection:
+    # Тяжёлая секция состояния: пока её нет в __dict__ экземпляра, первое обращение
+    # загружает её из снапшота; дальше атрибут читается напрямую, без накладных расходов
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        return obj._materialize(self.name)
+
+def experience_record(kind, epoch, score=0.0, **data):
+    # Запись experience одной формы: kind/epoch/score есть всегда. kind="analyze" — документ
+    # (его score идёт в evaluate), "deep" — признаки deep_analyze
+    return dict(data, kind=kind, epoch=epoch, score=score)
+
+def experience_kind(rec):
+    # Старые записи без kind: {'deep_features': ...} из deep_analyze или запись analyze_text
+    if not isinstance(rec, dict):
+        return None
+    return rec.get("kind") or ("deep" if "deep_features" in rec else "analyze")
+
+def in_window(rec, since_epoch=None, until_epoch=None, since=None, until=None):
+    # Окно экспорта по эпохам и по времени (unix). Граница проверяется, только если в записи есть
+    # такое поле: у auto_diag в diag_history нет epoch, у knowledge нет времени
+    if not isinstance(rec, dict):
+        return True
+    ep = rec.get("epoch")
+    if ep is not None and ((since_epoch is not None and ep < since_epoch) or (until_epoch is not None and ep > until_epoch)):
+        return False
+    t = rec.get("timestamp", rec.get("time"))
+    if t is not None and ((since is not None and t < since) or (until is not None and t > until)):
+        return False
+    return True
+
+def export_window(params):
+    # since_epoch/until_epoch/since/until из параметров запроса или команды; кривое значение — ValueError
+    window = {}
+    for name, cast in (("since_epoch", int), ("until_epoch", int), ("since", float), ("until", float)):
+        if params.get(name) not in (None, ""):
+            window[name] = cast(params[name])
+            if math.isnan(window[name]):
+                raise ValueError(f"{name} is NaN")
+    return window
+
+def chunk_lines(lines, limit=EXPORT_CHUNK):
+    # Склеивает строки JSON Lines в сообщения до limit символов, разрезая только между записями:
+    # каждое сообщение — самостоятельный JSONL. Запись длиннее limit заменяется валидной
+    # заглушкой {"truncated": длина, "head": начало её JSON}
+    buf, size = [], 0
+    for line in lines:
+        line = line.rstrip("\n")
+        if len(line) > limit:
+            line = clip_line(line, limit)
+        if buf and size + 1 + len(line) > limit:
+            yield "\n".join(buf)
+            buf, size = [], 0
+        size += len(line) + (1 if buf else 0)
+        buf.append(line)
+    if buf:
+        yield "\n".join(buf)
+
+def clip_line(line, limit):
+    head = line[:limit]
+    while True:
+        out = json.dumps({"truncated": len(line), "head": head}, ensure_ascii=False)
+        if len(out) <= limit or not head:
+            return out
+        head = head[:len(head) - (len(out) - limit)]
+
+def dict_tail(d, n):
+    # Последние n пар словаря в порядке вставки — с конца, без обхода всего словаря
+    items = list(islice(reversed(d.items()), n))
+    items.reverse()
+    return dict(items)
+
+class ReadView:
+    # Опубликованный срез состояния для читателей (Telegram, CLI, веб). Собирается писателем
+    # под state_lock в publish() и больше не меняется: читатели берут ai.view одной ссылкой,
+    # без блокировок, и не видят полуизменённых словарей. В срезе только ограниченные части:
+    # топ навыков и трендов, последние VIEW_TAIL фактов и проектов, хвосты историй — publish()
+    # не зависит от размера словарей. Полные словари отдаёт read_records() по запросу экспорта
+    __slots__ = ("seq", "epoch", "complexity", "best_score", "skills", "trends", "facts", "projects",
+                 "project_count", "topics", "docs", "examples", "knowledge", "command_history", "diag_history",
+                 "feedback", "code_metrics", "tests", "snippets", "versions")
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields[name])
+
+    def refreshed(self, **changes):
+        # Тот же срез с заменёнными полями и новым seq (кэш ответов старого среза не подходит)
+        fields = {name: getattr(self, name) for name in self.__slots__}
+        fields.update(changes, seq=self.seq + 1)
+        return ReadView(**fields)
+
+    def top_skills(self, topn=8):
+        return [f"{k}:{lv}" for k, lv in self.skills[:topn]]
+
+    def summarize_trends(self, topn=14):
+        return [f"{k}:{c}±{e}" if e else f"{k}:{c}" for k, c, e in self.trends[:topn]]
+
+    def top_trends(self, topn=15):
+        return {k: c for k, c, _ in self.trends[:topn]}
+
+    def sample_code(self):
+        return random.choice(self.snippets) if self.snippets else None
+
+class ResponseCache:
+    # Готовые ответы на внешние запросы по ключу (тип, нормализованный запрос). Ответ верен,
+    # пока не опубликован новый срез (ReadView.seq): со сменой среза кэш сбрасывается целиком,
+    # внутри среза держится LRU на capacity ответов (в основном разные search-запросы)
+    def __init__(self, capacity=RESPONSE_CACHE_SIZE):
+        self.capacity = capacity
+        self._entries = OrderedDict()
+        self._seq = None
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, seq, key, compute):
+        stale = False
+        with self._lock:
+            if self._seq is not None and seq < self._seq:
+                self.stats["misses"] += 1  # пакет с закреплённым старым срезом — мимо кэша, без сброса
+                stale = True
+            elif seq != self._seq:
+                if self._entries:
+                    self.stats["invalidations"] += 1
+                    self._entries.clear()
+                self._seq = seq
+            if not stale:
+                hit = self._entries.get(key)
+                if hit is not None:
+                    self._entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return hit
+                self.stats["misses"] += 1
+        value = compute()  # вне блокировки: одновременные промахи по одному ключу просто посчитают дважды
+        with self._lock:
+            if seq == self._seq:
+                self._entries[key] = value
+                if len(self._entries) > self.capacity:
+                    self._entries.popitem(last=False)
+                    self.stats["evictions"] += 1
+        return value
+
+class ApiServer:
+    # Встроенный HTTP/JSON API поверх asyncio, только stdlib: keep-alive (HTTP/1.1), предел
+    # одновременных запросов и соединений, chunked-отдача больших экспортов. Цикл событий только
+    # разбирает запросы и пишет ответы; вызовы ai.* блокирующие и идут в пул потоков API_WORKERS.
+    # Маршруты (GET, параметры в строке запроса; POST — JSON-тело):
+    #   /health                  эпоха, номер среза, счётчики сервера
+    #   /query?qtype=&data=      читающие запросы handle_external_query (ответ из кэша среза)
+    #   POST /query              любой qtype через web_api_task (с записью фидбека)
+    #   POST /batch {"tasks"}    batch_web_api_task
+    #   /search?q=&k=&cursor=    ranked_search со страницами
+    #   /export                  iter_export потоком (Transfer-Encoding: chunked); sections=a,b,
+    #                            format=json|jsonl, tail=, since_epoch=, until_epoch=, since=, until=
+    #   /admin                   admin_report; окно — те же since_epoch/until_epoch/since/until
+    ROUTES = {
+        "/health": ("GET", "api_health"),
+        "/query": ("GET POST", "api_query"),
+        "/batch": ("POST", "api_batch"),
+        "/search": ("GET", "api_search"),
+        "/export": ("GET", "api_export"),
+        "/admin": ("GET", "api_admin"),
+    }
+
+    def __init__(self, ai, host=API_HOST, port=API_PORT, workers=API_WORKERS, inflight=API_MAX_INFLIGHT):
+        self.ai = ai
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.inflight = inflight
+        self.loop = None
+        self.stats = {"connections": 0, "open": 0, "requests": 0, "streamed": 0, "rejected": 0, "errors": 0}
+        self._conns = {}  # writer -> задача соединения
+        self._ready = threading.Event()
+        self._thread = None
+
+    def start(self):
+        # В фоновом потоке; возвращается, когда порт уже слушается (port=0 — выбирает ОС)
+        self._thread = threading.Thread(target=self.run, name="api", daemon=True)
+        self._thread.start()
+        self._ready.wait(10)
+        return self
+
+    def run(self):
+        asyncio.run(self._serve())
+
+    def stop(self):
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._stopping.set)
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+
+    async def _serve(self):
+        self.loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.inflight)
+        pool = ThreadPoolExecutor(self.workers, thread_name_prefix="api")
+        server = await asyncio.start_server(self._client, self.host, self.port, limit=API_MAX_HEADER)
+        self.port = server.sockets[0].getsockname()[1]
+        log_event(f"[api] Слушаю http://{self.host}:{self.port}")
+        self._pool = pool
+        self._ready.set()
+        try:
+            await self._stopping.wait()
+        finally:
+            server.close()
+            for w in list(self._conns):
+                w.close()  # простаивающие keep-alive соединения получают EOF и выходят сами
+            if self._conns:
+                await asyncio.wait(list(self._conns.values()), timeout=5)
+            await server.wait_closed()
+            pool.shutdown(wait=False)
+            log_event("[api] Остановлен")
+
+    async def _client(self, reader, writer):
+        if self.stats["open"] >= API_MAX_CONNECTIONS:
+            self.stats["rejected"] += 1
+            await self._respond(writer, 503, {"error": "too many connections"}, False)
+            writer.close()
+            return
+        self.stats["connections"] += 1
+        self.stats["open"] += 1
+        self._conns[writer] = asyncio.current_task()
+        try:
+            keep = True
+            while keep:
+                try:
+                    head = await asyncio.wait_for(self._read_head(reader), API_KEEPALIVE_SEC)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+                    break
+                except ValueError as e:
+                    await self._respond(writer, 400, {"error": str(e)}, False)
+                    break
+                if head is None:
+                    break
+                method, target, keep, size = head
+                self.stats["requests"] += 1
+                if size > API_MAX_BODY:
+                    await self._respond(writer, 413, {"error": f"body over {API_MAX_BODY} bytes"}, False)
+                    break
+                body = await asyncio.wait_for(reader.readexactly(size), API_KEEPALIVE_SEC) if size else b""
+                await self._dispatch(writer, method, target, body, keep)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass
+        except Exception as e:
+            self.stats["errors"] += 1  # ошибка посреди потокового ответа — статус уже ушёл, просто рвём соединение
+            log_event(f"[ApiError] {e}")
+        finally:
+            self._conns.pop(writer, None)
+            self.stats["open"] -= 1
+            writer.close()
+
+    async def _read_head(self, reader):
+        # Строка запроса и заголовки. None — клиент закрыл соединение между запросами
+        line = await reader.readline()
+        if not line:
+            return None
+        parts = line.decode("latin-1").split()
+        if len(parts) != 3 or not parts[2].startswith("HTTP/1."):
+            raise ValueError("bad request line")
+        method, target, version = parts
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n"):
+                break
+            if not line:
+                raise asyncio.IncompleteReadError(b"", None)
+            name, sep, value = line.decode("latin-1").partition(":")
+            if not sep or len(headers) >= 100:
+                raise ValueError("bad header")
+            headers[name.strip().lower()] = value.strip()
+        conn = headers.get("connection", "").lower()
+        keep = "keep-alive" in conn if version == "HTTP/1.0" else "close" not in conn
+        if "chunked" in headers.get("transfer-encoding", ""):
+            raise ValueError("chunked request body is not supported")
+        try:
+            size = int(headers.get("content-length") or 0)
+        except ValueError:
+            raise ValueError("bad content-length")
+        return method, target, keep, size
+
+    async def _dispatch(self, writer, method, target, body, keep):
+        url = urlsplit(target)
+        route = self.ROUTES.get(url.path.rstrip("/") or "/")
+        if route is None:
+            return await self._respond(writer, 404, {"error": "not found", "routes": sorted(self.ROUTES)}, keep)
+        if method not in route[0].split():
+            return await self._respond(writer, 405, {"error": f"{method} not allowed"}, keep)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        if body:
+            try:
+                data = json.loads(body)
+            except ValueError:
+                return await self._respond(writer, 400, {"error": "body is not JSON"}, keep)
+            if not isinstance(data, dict):
+                return await self._respond(writer, 400, {"error": "body must be a JSON object"}, keep)
+            params.update(data)
+        try:
+            await asyncio.wait_for(self._slots.acquire(), API_QUEUE_SEC)
+        except asyncio.TimeoutError:
+            self.stats["rejected"] += 1
+            return await self._respond(writer, 503, {"error": "busy"}, keep)
+        try:
+            # Слот держится до конца ответа: потоковый /export тоже считается в API_MAX_INFLIGHT
+            try:
+                status, payload, *ctype = await self.loop.run_in_executor(
+                    self._pool, getattr(self, route[1]), method, params)
+            except Exception as e:
+                self.stats["errors"] += 1
+                log_event(f"[ApiError] {target}: {e}")
+                status, payload, ctype = 500, {"error": str(e)}, ()
+            await self._respond(writer, status, payload, keep, *ctype)
+        finally:
+            self._slots.release()
+
+    async def _respond(self, writer, status, payload, keep, ctype="application/json"):
+        # dict/list — JSON целиком с Content-Length, str — готовый текст, итератор строк — chunked
+        head = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}", f"Content-Type: {ctype}; charset=utf-8",
+                f"Connection: {'keep-alive' if keep else 'close'}"]
+        if status == 503:
+            head.append("Retry-After: 1")
+        if isinstance(payload, (dict, list)):
+            payload = json.dumps(payload, ensure_ascii=False)
+        if isinstance(payload, str):
+            body = payload.encode("utf-8")
+            head.append(f"Content-Length: {len(body)}")
+            writer.write("\r\n".join(head).encode("latin-1") + b"\r\n\r\n" + body)
+            await writer.drain()
+            return
+        self.stats["streamed"] += 1
+        head.append("Transfer-Encoding: chunked")
+        writer.write("\r\n".join(head).encode("latin-1") + b"\r\n\r\n")
+        parts = iter(payload)
+        while True:
+            # Генератор экспорта берёт state_lock и кодирует JSON — это делается в пуле, не в цикле событий
+            text = await self.loop.run_in_executor(self._pool, self._next_chunk, parts)
+            if text is None:
+                break
+            await self._chunk(writer, text)
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    @staticmethod
+    def _next_chunk(parts):
+        buf, size = [], 0
+        for part in parts:
+            buf.append(part)
+            size += len(part)
+            if size >= API_STREAM_CHUNK:
+                break
+        return "".join(buf) if buf else None
+
+    async def _chunk(self, writer, text):
+        data = text.encode("utf-8")
+        writer.write(b"%x\r\n" % len(data) + data + b"\r\n")
+        await writer.drain()  # медленный клиент притормаживает генерацию, а не копит её в памяти
+
+    # --- обработчики: выполняются в пуле потоков, возвращают (статус, ответ) ---
+    def api_health(self, method, params):
+        v = self.ai.view
+        return 200, {"ok": True, "epoch": v.epoch, "seq": v.seq, "server": dict(self.stats)}
+
+    @staticmethod
+    def bad_task(qtype, data):
+        # Запросы ai.* ждут строки: qtype.upper() в фидбеке, data.lower() в поиске
+        if not isinstance(qtype, str):
+            return "qtype must be a string"
+        if data is not None and not isinstance(data, str):
+            return "data must be a string"
+        return None
+
+    def api_query(self, method, params):
+        qtype, data = params.get("qtype", ""), params.get("data")
+        error = self.bad_task(qtype, data)
+        if error:
+            return 400, {"error": error}
+        if method == "POST":
+            return 200, {"qtype": qtype, "answer": self.ai.web_api_task(qtype, data)}
+        if qtype not in READ_QUERIES:
+            return 405, {"error": f"qtype {qtype!r} changes state or is unknown, use POST"}
+        return 200, {"qtype": qtype, "answer": self.ai.handle_external_query(qtype, data)}
+
+    def api_batch(self, method, params):
+        tasks = params.get("tasks")
+        if not isinstance(tasks, list) or not all(isinstance(t, dict) for t in tasks):
+            return 400, {"error": "tasks must be a list of {qtype, data}"}
+        for i, t in enumerate(tasks):
+            error = self.bad_task(t.get("qtype", ""), t.get("data"))
+            if error:
+                return 400, {"error": f"tasks[{i}]: {error}"}
+        return 200, {"answers": self.ai.batch_web_api_task(tasks)}
+
+    def api_search(self, method, params):
+        q = str(params.get("q", "")).strip()
+        if not q:
+            return 400, {"error": "q is required"}
+        try:
+            k = max(1, min(50, int(params.get("k", SEARCH_PAGE))))
+            results, nxt = self.ai.ranked_search(q, k, params.get("cursor") or None)
+        except ValueError:
+            return 400, {"error": "bad k or cursor"}
+        return 200, {"query": q, "results": results, "next": nxt}
+
+    def api_export(self, method, params):
+        sections = [s for s in str(params.get("sections") or "").split(",") if s] or None
+        fmt = params.get("format") or "json"
+        unknown = [s for s in sections or () if s not in EXPORT_SECTIONS]
+        if unknown or fmt not in ("json", "jsonl"):
+            return 400, {"error": f"sections: {', '.join(EXPORT_SECTIONS)}; format: json|jsonl", "unknown": unknown}
+        try:
+            window = export_window(params)
+            tail = int(params["tail"]) if params.get("tail") not in (None, "") else None
+            parts = self.ai.iter_export(sections, fmt, tail, **window)  # tail < 0 — ValueError до заголовков
+        except ValueError:
+            return 400, {"error": "bad tail or window"}
+        return 200, parts, "application/x-ndjson" if fmt == "jsonl" else "application/json"
+
+    def api_admin(self, method, params):
+        try:
+            return 200, self.ai.admin_report(**export_window(params))
+        except ValueError:
+            return 400, {"error": "bad window"}
+
 class UltraEvoAI:
+    corpus = LazySection()
+    language_models = LazySection()
+    experience = LazySection()
+    code_metrics = LazySection()
+
+    @property
+    def view(self):
+        # Пакетный запрос закрепляет за своими потоками один срез (_pinned), остальные видят последний
+        return getattr(self._pinned, "view", None) or self._view
+
+    @view.setter
+    def view(self, value):
+        self._view = value
+
     def __init__(self):
+        if getattr(self, "writer", None):
+            self.writer.stop()  # system_reset(): старый писатель дописывает хвост и выходит
+        pipeline = getattr(self, "fetcher", None)
+        if isinstance(pipeline, FetchPipeline):
+            pipeline.stop()  # system_reset(): старые загрузчики уходят, ниже поднимается новый пул
+        else:
+            pipeline = None
         self.epoch = 0
-        self.weights = [random.uniform(-1, 1) for _ in range(30)]
+        self.rng = np.random.default_rng()
+        self.weights = self.rng.uniform(-1, 1, 30)
         self.complexity = 1
-        self.experience = []
-        self.skills = {}
-        self.corpus = []
+        self.experience = RingBuffer(capacity=RING_CAPS["experience"])
+        self.skills = SkillStore()
+        self.corpus = JournaledList()
         self.best_score = 0
-        self.knowledge = []
-        self.history = []
-        self.facts = {}
-        self.coding_examples = []
-        self.trends = {}
+        self.knowledge = JournaledList()
+        self.history = RingBuffer(capacity=HISTORY_CAP)
+        self.facts = JournaledDict()
+        self.coding_examples = SnippetStore()
+        self.trends = TrendSketch()
         self.topics = set()
-        self.projects = {}
-        self.code_metrics = {}
-        self.user_feedback = []
-        self.self_tests = []
-        self.command_history = []
-        self.diag_history = []
+        self.projects = JournaledDict()
+        self.code_metrics = RingBuffer(capacity=RING_CAPS["code_metrics"])
+        self.user_feedback = RingBuffer(capacity=RING_CAPS["user_feedback"])
+        self.self_tests = RingBuffer(capacity=RING_CAPS["self_tests"])
+        self.command_history = RingBuffer(capacity=RING_CAPS["command_history"])
+        self.diag_history = RingBuffer(capacity=RING_CAPS["diag_history"])
         self.task_queue = queue.Queue()
         self.skill_keywords = set(KEYWORDS)
-        self.language_models = {}
+        self.language_models = SnippetStore(capacity=LANG_SNIPPETS_CAP)
+        self.fingerprints = FingerprintIndex()
+        self.docs = DocStore()
+        self.dedup_stats = {"checked": 0, "new": 0, "exact": 0, "near": 0}
+        self.stage_stats = {}
         self.last_backup = 0
+        self.fetcher = None
+        self._session = None
+        self.http_cache = HttpCache()
+        self.response_cache = ResponseCache()
+        self.crawler = CrawlScheduler(URLS)
+        self.analyzer = TextAnalyzer()
+        # Все изменения состояния идут под state_lock — писатель берёт под ним согласованный срез
+        self.state_lock = threading.RLock()
+        self.indexes = {
+            "corpus": SearchIndex(),
+            "coding_examples": SearchIndex(),
+            "facts": SearchIndex(lambda k, v: f"{k}\n{v}"),
+            "projects": SearchIndex(lambda k, v: k),
+            "trends": SearchIndex(lambda k, v: k),
+            "skills": SearchIndex(lambda k, v: k),
+        }
+        self._knowledge_json = {}
+        self._inbox = deque()  # записи читателей (команды, фидбек, диагностика) до переноса писателем
+        if not hasattr(self, "_pinned"):
+            self._pinned = threading.local()
+            self._batch_pool = None
+            self._batch_lock = threading.Lock()
+            self.api = None  # ApiServer переживает system_reset() — он держит ссылку на этот же объект
+        self.view = getattr(self, "view", None)  # system_reset(): читатели видят старый срез до новой публикации
+        self._lazy = {}
+        self._lazy_lock = threading.Lock()
+        self.journal = StateJournal()
         self._init_dirs()
         self.load()
+        self.writer = StateWriter(self, self.journal)
+        atexit.register(self.writer.stop)
+        with self.state_lock:
+            self.check_corpus_limit()
         self.save()
-        self.check_corpus_limit()
+        if pipeline:
+            self.start_fetch_pipeline(pipeline.scheduler.urls, pipeline.workers, pipeline.docs.maxsize)
 
     def _init_dirs(self):
         ensure_dirs()
@@ -75,119 +2306,194 @@ class UltraEvoAI:
             with open(LOG_FILE, "w", encoding="utf-8") as f:
                 f.write(f"{datetime.now()} | AI system log initialized\n")
 
+    def run_stage(self, name, fn, *args):
+        # Один этап цикла: исключение не обрывает эпоху — уже сделанное (скачанный документ,
+        # счётчики, предыдущие этапы) остаётся, а ошибка и время этапа копятся в stage_stats
+        st = self.stage_stats.get(name)
+        if st is None:
+            st = self.stage_stats[name] = {"runs": 0, "errors": 0, "ms": 0.0, "last_error": None}
+        t0 = time.perf_counter()
+        try:
+            return fn(*args)
+        except Exception as e:
+            st["errors"] += 1
+            st["last_error"] = f"{type(e).__name__}: {e}"
+            log_event(f"[StageError:{name}] {e}")
+        finally:
+            st["runs"] += 1
+            st["ms"] += (time.perf_counter() - t0) * 1000
+
+    def stage_report(self):
+        return {name: {"runs": st["runs"], "errors": st["errors"], "avg_ms": round(st["ms"] / max(1, st["runs"]), 3),
+                       "last_error": st["last_error"]} for name, st in list(self.stage_stats.items())}
+
     def evolve(self):
-        self.epoch += 1
-        text, url = self.fetch_data()
-        if text:
-            info = self.analyze_text(text, url)
-            self.experience.append(info)
-            self.update_skills(text)
-            self.learn_from_code(text)
-            self.find_facts(text)
-            self.update_trends(text, url)
-            self.corpus.append(text)
-            self.track_metrics(text)
-            self.auto_project_detection(text, url)
-            self.run_self_test(text)
-        self.grow_complexity()
-        score = self.evaluate()
-        if score > self.best_score:
-            self.best_score = score
-            self.knowledge.append({
-                'epoch': self.epoch,
-                'weights': list(self.weights),
-                'score': score,
-                'top_skills': self.get_top_skills(),
-                'trends': dict(self.trends),
-            })
-        self.save()
-        self.history.append({'epoch': self.epoch, 'score': score})
-        if len(self.history) > 1000: self.history.pop(0)
-        self.check_corpus_limit()
+        text, url = self.run_stage("fetch", self.next_document) or ("", "")  # сеть — вне state_lock
+        with self.state_lock:
+            self.drain_inbox()
+            self.epoch += 1
+            feats = self.run_stage("features", self.analyzer.analyze, text) if text else None
+            fresh = feats is not None and self.run_stage("dedup", self.admit_document, text, feats.words, url)
+            if url:
+                self.crawler.credit(url, len(text) / 1000 + sum(feats.keyword_hits.values()) if fresh else 0)
+            if fresh:
+                for name, fn, args in (
+                    ("experience", self.record_experience, (text, url, feats)),
+                    ("skills", self.update_skills, (text, feats)),
+                    ("code", self.learn_from_code, (text,)),
+                    ("facts", self.find_facts, (text, feats)),
+                    ("trends", self.update_trends, (text, url, feats)),
+                    ("corpus", self.corpus.append, (text,)),
+                    ("metrics", self.track_metrics, (text, feats)),
+                    ("projects", self.auto_project_detection, (text, url, feats)),
+                    ("self_test", self.run_self_test, (text, feats)),
+                ):
+                    self.run_stage(name, fn, *args)
+            self.run_stage("complexity", self.grow_complexity)
+            score = self.run_stage("evaluate", self.evaluate)
+            if score is not None:
+                if score > self.best_score:
+                    self.best_score = score
+                    self.knowledge.append({
+                        'epoch': self.epoch,
+                        'weights': self.weights.tolist(),
+                        'score': score,
+                        'top_skills': self.get_top_skills(),
+                        'trends': self.top_trends(15),
+                    })
+                self.history.append(EpochScore(self.epoch, score))
+            self.save()
+            self.run_stage("limits", self.check_corpus_limit)
         if self.epoch % 10 == 0:
-            self.backup()
+            self.run_stage("backup", self.backup)
+
+    def record_experience(self, text, url, feats):
+        self.experience.append(self.analyze_text(text, url, feats))
+
+    def admit_document(self, text, words=None, source=None):
+        # Проверка перед корпусом: точный или почти-дубликат (SimHash в пределах DEDUP_HAMMING
+        # бит) уже выученного документа не учится повторно. Отпечаток нового запоминается
+        fp = simhash(words or Counter(WORD_RE.findall(text.lower())))
+        hit = self.fingerprints.match(fp)
+        st = self.dedup_stats
+        st["checked"] += 1
+        if hit:
+            st["exact" if hit[1] == 0 else "near"] += 1
+            self.fingerprints[hit[0]] = self.epoch
+        else:
+            st["new"] += 1
+            self.fingerprints.remember(fp, self.epoch)
+        if st["checked"] % DEDUP_LOG_EVERY == 0:
+            dups = st["exact"] + st["near"]
+            self.log_metric("dedup", dict(st, hit_rate=round(dups / st["checked"], 3), last=source))
+        return not hit
+
+    def next_document(self):
+        # С запущенным пулом загрузчиков — готовый документ из очереди, иначе синхронная загрузка
+        if self.fetcher:
+            return self.fetcher.get()
+        return self.fetch_data()
+
+    def start_fetch_pipeline(self, urls=None, workers=FETCH_WORKERS, depth=FETCH_QUEUE_DEPTH):
+        if not self.fetcher:
+            if urls:
+                self.crawler.urls = list(urls)
+            self.fetcher = FetchPipeline(self.fetch_url, self.crawler, workers, depth).start()
+        return self.fetcher
+
+    def fetch_url(self, session, url):
+        # Через HttpCache: неизменившаяся страница ("" на выходе) не скачивается и не разбирается;
+        # None — ответ из свежего кэша, запроса в сеть не было
+        clean, changed = self.http_cache.get(session, url, self.read_html)
+        if changed is None:
+            return None
+        return clean if changed and len(clean) > FETCH_MIN_TEXT else ""
+
+    def read_html(self, r):
+        # Страница читается потоком и сразу чистится; чтение обрывается, как только
+        # набрано FETCH_TEXT_BUDGET символов текста или прочитано FETCH_MAX_BYTES
+        extractor = HtmlTextExtractor(FETCH_TEXT_BUDGET)
+        for chunk in iter_text(r, FETCH_MAX_BYTES):
+            extractor.feed(chunk)
+            if extractor.done: break
+        if not extractor.done: extractor.close()
+        return extractor.result()
+
+    def read_text(self, r):
+        return "".join(iter_text(r, EXTERNAL_MAX_BYTES))
 
     def fetch_data(self):
+        if self._session is None:
+            self._session = make_session()
         for i in range(5):
+            url = self.crawler.pick()
+            if url is None:
+                break  # все домены на паузе/отключены — не ждём таймаутов на мёртвых хостах
+            t0 = time.time()
             try:
-                url = random.choice(URLS)
-                headers = {'User-Agent': 'Mozilla/5.0'}
-                r = requests.get(url, timeout=14, headers=headers)
-                if r.status_code != 200: continue
-                text = r.text
-                clean = self.clean_html(text)
-                if len(clean) > 1500: return clean[:18000], url
+                clean = self.fetch_url(self._session, url)
             except Exception as ex:
+                self.crawler.report(url, time.time() - t0, ex)
                 log_event(f"[fetch_data_error] {ex}")
                 continue
+            if clean is None:
+                self.crawler.refund(url)
+                continue
+            self.crawler.report(url, time.time() - t0)
+            if clean: return clean, url
+            self.crawler.credit(url, 0)
         return "", ""
 
-    def clean_html(self, text):
-        text = re.sub(r'<script[\s\S]*?</script>', '', text)
-        text = re.sub(r'<style[\s\S]*?</style>', '', text)
-        text = re.sub(r'<!--[\s\S]*?-->', '', text)
-        text = re.sub(r'<.*?>', '', text)
-        text = re.sub(r'&#\d+;', ' ', text)
-        text = re.sub(r'[^a-zA-Zа-яА-Я0-9\s\n:;.,_+=\-\/\(\)\[\]\{\}#@!%*]', '', text)
-        text = re.sub(r'\n+', '\n', text)
-        text = re.sub(r' +', ' ', text)
-        return text.strip()
-    def analyze_text(self, text, url):
-        words = text.lower().split()
-        unique = len(set(words))
-        keyword_count = sum(1 for w in words if w in self.skill_keywords)
+    def clean_html(self, text, budget=None):
+        extractor = HtmlTextExtractor(budget)
+        extractor.feed(text)
+        if not extractor.done: extractor.close()
+        return extractor.result()
+
+    def analyze_text(self, text, url, feats=None):
+        feats = feats or self.analyzer.analyze(text)
+        unique = len(feats.words)
+        keyword_count = sum(c for w, c in feats.words.items() if w in self.skill_keywords)
         score = unique * 0.28 + keyword_count * 3.9 + len(text) * 0.00088 + self.complexity * 0.57
-        for i in range(len(self.weights)):
-            if i < keyword_count:
-                self.weights[i] += 0.004 * random.uniform(0.8, 1.2)
-            else:
-                self.weights[i] -= 0.001 * random.uniform(0.7, 1.3)
-        self.weights = [max(-5, min(5, w)) for w in self.weights]
+        # Первые keyword_count весов подтягиваются вверх, остальные понемногу затухают
+        w, k = self.weights, min(keyword_count, len(self.weights))
+        w[:k] += 0.004 * self.rng.uniform(0.8, 1.2, k)
+        w[k:] -= 0.001 * self.rng.uniform(0.7, 1.3, len(w) - k)
+        np.clip(w, -5, 5, out=w)
         self.log_metric("analyze", {'unique': unique, 'keywords': keyword_count, 'url': url})
-        return {'unique': unique, 'score': score, 'url': url, 'keywords': keyword_count}
+        return experience_record("analyze", self.epoch, score, unique=unique, url=url, keywords=keyword_count)
 
     def grow_complexity(self):
         if self.epoch % 7 == 0 and self.complexity < 333:
             self.complexity += 1
-            self.weights += [random.uniform(-1.2, 1.2)]
-            for k in self.skills: self.skills[k]['level'] += 1
+            self.weights = np.append(self.weights, self.rng.uniform(-1.2, 1.2))
+            self.skills.shift(1)
             self.log_metric("complexity_grow", {'complexity': self.complexity})
 
     def evaluate(self):
-        base = sum(abs(w) for w in self.weights) / len(self.weights)
-        exp = sum(i['score'] for i in self.experience[-50:]) if self.experience else 0
-        skills = sum(self.skills[k]['level'] for k in self.skills)
+        base = float(np.abs(self.weights).mean())
+        # В оценку идут только записи анализа документов; deep и записи старого формата без score не ломают её
+        exp = sum(i.get('score', 0) for i in self.experience[-50:] if experience_kind(i) == "analyze")
+        skills = self.skills.total()
         value = base + self.complexity * 1.15 + exp * 0.013 + skills * 0.39
         self.log_metric("evaluate", {'base': base, 'skills': skills, 'value': value})
         return value
 
     def get_top_skills(self, topn=8):
-        lst = sorted(self.skills.items(), key=lambda x: x[1]['level'], reverse=True)
-        return [f"{k}:{v['level']}" for k, v in lst[:topn]]
+        return [f"{k}:{lv}" for k, lv in self.skills.top(topn)]
 
     def check_corpus_limit(self):
-        if len(self.corpus) > 950:
-            self.corpus = self.corpus[-950:]
-        if len(self.coding_examples) > 555:
-            self.coding_examples = self.coding_examples[-555:]
+        # Обрезка на месте (del), чтобы журналируемые списки не подменялись копиями
+        if self.loaded("corpus") and len(self.corpus) > 950:
+            del self.corpus[:-950]
         if len(self.knowledge) > 1111:
-            self.knowledge = self.knowledge[-1111:]
-        if len(self.command_history) > 1200:
-            self.command_history = self.command_history[-1200:]
-        if len(self.user_feedback) > 444:
-            self.user_feedback = self.user_feedback[-444:]
-        if len(self.diag_history) > 400:
-            self.diag_history = self.diag_history[-400:]
-
-    def update_skills(self, text):
-        for kw in KEYWORDS:
-            cnt = len(re.findall(r'\b'+re.escape(kw)+r'\b', text.lower()))
-            if cnt:
-                if kw not in self.skills: self.skills[kw] = {'level': 1, 'count': 0}
-                self.skills[kw]['level'] += cnt
-                self.skills[kw]['count'] += cnt
-        words = set(re.findall(r'\b[a-zA-Z_]{3,24}\b', text.lower()))
-        self.skill_keywords.update(words)
+            del self.knowledge[:-1111]
+
+    def update_skills(self, text, feats=None):
+        feats = feats or self.analyzer.analyze(text)
+        for kw, cnt in feats.keyword_hits.items():
+            self.skills.bump(kw, cnt, cnt)
+        self.skill_keywords.update(feats.skill_words)
 
     def learn_from_code(self, text):
         code_blocks = re.findall(r'```(?:[a-z]+)?(.*?)```', text, re.DOTALL)
@@ -195,144 +2501,222 @@ class UltraEvoAI:
         code_blocks += re.findall(r'(\bdef [\s\S]{10,240}\:)', text)
         for code in code_blocks:
             cln = code.strip()
-            if cln and len(cln) < 1600 and cln not in self.coding_examples:
-                self.coding_examples.append(cln)
+            if cln and len(cln) < 1600:
+                self.coding_examples.add(cln)
         # Пополняет language_models мини-сниппетами
         for lang in ["python", "js", "javascript", "html", "css"]:
             for m in re.findall(rf'{lang}[\s\S]{{10,800}}', text, re.IGNORECASE):
-                if lang not in self.language_models: self.language_models[lang] = []
-                if m not in self.language_models[lang] and len(m) < 1600:
-                    self.language_models[lang].append(m)
+                if len(m) < 1600:
+                    self.language_models.add(m, lang)
 
-    def find_facts(self, text):
-        facts = re.findall(r'([A-Z][a-z]+ is [^\.]{10,110}\.)', text)
-        for f in facts:
+    def find_facts(self, text, feats=None):
+        feats = feats or self.analyzer.analyze(text)
+        for f in feats.facts:
             k = f.split(' is ')[0]
             self.facts[k] = f
         # Вытаскивает статистику и определения
-        for stat in re.findall(r'([A-Za-z_]{3,32}[:=]\s*[0-9\.]+)', text):
+        for stat in feats.stats:
             k, v = stat.split(":")[0], stat.split(":")[-1]
             self.facts[k.strip()] = f"{k.strip()} = {v.strip()}"
 
-    def update_trends(self, text, url):
-        topics = re.findall(r'\b[a-zA-Z]{6,}\b', text)
-        for t in topics:
-            t = t.lower()
-            if t not in self.trends: self.trends[t] = 1
-            else: self.trends[t] += 1
+    def update_trends(self, text, url, feats=None):
+        feats = feats or self.analyzer.analyze(text)
+        for t, c in feats.trend_words.items():
+            self.trends.add(t, c)
         if url:
             domain = url.split('/')[2]
             if domain not in self.topics: self.topics.add(domain)
 
-    def track_metrics(self, text):
+    def track_metrics(self, text, feats=None):
         # Сохраняет основные метрики, что встречал
-        n_lines = text.count('\n')
-        n_code = text.count("def ") + text.count("class ") + text.count("import ")
-        n_words = len(text.split())
-        self.code_metrics[self.epoch] = {
-            "lines": n_lines,
-            "code": n_code,
-            "words": n_words,
+        feats = feats or self.analyzer.analyze(text)
+        self.code_metrics.append({
+            "epoch": self.epoch,
+            "lines": feats.lines,
+            "code": feats.code,
+            "words": sum(feats.words.values()),
             "timestamp": time.time()
-        }
+        })
 
-    def auto_project_detection(self, text, url):
+    def auto_project_detection(self, text, url, feats=None):
         # Если встречает "project", "repo", "package" — выделяет как отдельный проект
-        if any(w in text.lower() for w in ["project", "repo", "package", "framework", "dataset"]):
-            project_name = ""
-            match = re.search(r'project ([a-zA-Z0-9_\-]+)', text)
-            if match: project_name = match.group(1)
-            elif url: project_name = url.split('/')[-1]
-            else: project_name = f"proj_{self.epoch}"
+        feats = feats or self.analyzer.analyze(text)
+        if feats.has_project:
+            project_name = feats.project
+            if not project_name:
+                project_name = url.split('/')[-1] if url else f"proj_{self.epoch}"
             if project_name not in self.projects:
                 self.projects[project_name] = {
                     "epoch": self.epoch,
                     "from_url": url,
                     "samples": []
                 }
-            self.projects[project_name]["samples"].append(text[:500])
+            samples = self.projects[project_name]["samples"]
+            samples.append(text[:500])
+            del samples[:-PROJECT_SAMPLES]
+            self.projects.touch(project_name)
 
-    def run_self_test(self, text):
+    def run_self_test(self, text, feats=None):
         # Примитивные тесты кода/логики (можно расширить до автотестов!)
-        if "def " in text and "return" in text:
-            tests = re.findall(r'def ([a-zA-Z_][\w]*)\(', text)
-            for t in tests:
+        feats = feats or self.analyzer.analyze(text)
+        if feats.funcs and feats.has_return:
+            for t in feats.funcs:
                 res = {"func": t, "epoch": self.epoch, "passed": random.choice([True, False])}
                 self.self_tests.append(res)
 
     def log_metric(self, name, meta):
         entry = {"epoch": self.epoch, "type": name, "meta": meta, "time": time.time()}
         self.diag_history.append(entry)
-        if len(self.diag_history) > 800:
-            self.diag_history = self.diag_history[-800:]
 
     def backup(self):
         # Сохраняет backup JSON в отдельную папку (раз в 10 эпох)
         try:
             ts = datetime.now().strftime("%Y%m%d_%H%M%S")
             fname = os.path.join(BACKUP_DIR, f"ai_backup_{ts}.json")
+            data = json.dumps(self.export_state())  # срез неизменяемый — state_lock не нужен
             with open(fname, "w", encoding="utf-8") as f:
-                json.dump(self.export_state(), f)
+                f.write(data)
             self.last_backup = time.time()
             log_event(f"[backup] Backup saved to {fname}")
         except Exception as e:
             log_event(f"[backup_error] {e}")
     def export_state(self):
-        # Экспортирует текущее состояние для анализа/отладки/Telegram-бота
+        # Экспортирует текущее состояние для анализа/отладки/Telegram-бота — из опубликованного среза
+        v = self.view
         return {
-            'epoch': self.epoch,
-            'complexity': self.complexity,
-            'score': self.best_score,
-            'top_skills': self.get_top_skills(12),
-            'trends': dict(sorted(self.trends.items(), key=lambda x: x[1], reverse=True)[:15]),
-            'skills': {k: v['level'] for k, v in self.skills.items()},
-            'facts': self.facts,
-            'topics': list(self.topics),
-            'projects': self.projects,
-            'code_metrics': self.code_metrics,
-            'command_history': self.command_history[-50:],
-            'diag_history': self.diag_history[-50:],
-            'knowledge': self.knowledge[-10:]
+            'epoch': v.epoch,
+            'complexity': v.complexity,
+            'score': v.best_score,
+            'top_skills': v.top_skills(12),
+            'trends': v.top_trends(15),
+            'skills': self.read_records("skills"),
+            'facts': self.read_records("facts"),
+            'topics': list(v.topics),
+            'projects': self.read_records("projects"),
+            'code_metrics': list(v.code_metrics),
+            'command_history': list(v.command_history),
+            'diag_history': list(v.diag_history),
+            'knowledge': list(v.knowledge)
         }
 
+    def iter_export(self, sections=None, fmt="json", tail=None, **window):
+        # Экспорт секция за секцией: в памяти одна секция (копия ссылок на записи), текст отдаётся
+        # кусками. fmt="json" — один объект {секция: ...} с записью на строку; fmt="jsonl" — строка
+        # на запись {"section", "key" (у словарей), "value"}. window — since_epoch/until_epoch/
+        # since/until (см. in_window), tail — не больше стольких последних записей на секцию.
+        # sections=None — все EXPORT_SECTIONS, а при окне — без EXPORT_UNWINDOWED. Аргументы
+        # проверяются сразу, до первой строки: кривые — ValueError у вызывающего, а не обрыв
+        # уже начатого ответа
+        if sections is None:
+            sections = [s for s in EXPORT_SECTIONS if not window or s not in EXPORT_UNWINDOWED]
+        unknown = [s for s in sections if s not in EXPORT_SECTIONS]
+        if unknown or fmt not in ("json", "jsonl"):
+            raise ValueError(f"unknown export sections {unknown} or format {fmt!r}")
+        if tail is not None and (not isinstance(tail, int) or tail < 0):
+            raise ValueError(f"bad tail: {tail!r}")
+        if set(window) - {"since_epoch", "until_epoch", "since", "until"}:
+            raise ValueError(f"unknown export window: {sorted(window)}")
+        return self._iter_export(sections, fmt, tail, export_window(window))
+
+    def _iter_export(self, sections, fmt, tail, window):
+        first = True
+        for name in sections:
+            kind, items = self._export_section(name, tail, window)
+            if fmt == "jsonl":
+                if kind == "value":
+                    yield json.dumps({"section": name, "value": items}, ensure_ascii=False, default=str) + "\n"
+                    continue
+                for key, value in items:
+                    rec = {"section": name, "key": key, "value": value} if kind == "dict" else {"section": name, "value": value}
+                    yield json.dumps(rec, ensure_ascii=False, default=str) + "\n"
+                continue
+            yield ("{" if first else ",\n") + json.dumps(name) + ": "
+            first = False
+            if kind == "value":
+                yield json.dumps(items, ensure_ascii=False, default=str)
+                continue
+            brackets = "{}" if kind == "dict" else "[]"
+            yield brackets[0]
+            sep = "\n"
+            for key, value in items:
+                prefix = json.dumps(str(key), ensure_ascii=False) + ": " if kind == "dict" else ""
+                yield sep + prefix + json.dumps(value, ensure_ascii=False, default=str)
+                sep = ",\n"
+            yield brackets[1] if sep == "\n" else "\n" + brackets[1]
+        if fmt != "jsonl":
+            yield "{}\n" if first else "}\n"
+
+    def _export_section(self, name, tail, window):
+        v = self.view
+        if name == "summary":
+            return "value", {
+                "epoch": v.epoch,
+                "complexity": v.complexity,
+                "best_score": v.best_score,
+                "skills": v.top_skills(20),
+                "trends": v.summarize_trends(18),
+                "topics": list(v.topics),
+                "projects": list(v.projects)[-10:],
+                "docs": v.docs,
+                "examples": v.examples,
+                "tests": {"passed": v.tests[0], "total": v.tests[1]},
+            }
+        if name in EXPORT_DICTS:
+            items = ((k, x) for k, x in self.read_records(name).items() if in_window(x, **window))
+        elif name in EXPORT_SECTIONS:
+            if name in LAZY_SECTIONS:
+                self._materialize(name)
+            records = self.read_records(name)  # только ссылки; сами записи после добавления не меняются
+            items = ((None, x) for x in records if in_window(x, **window))
+        else:
+            raise ValueError(f"unknown export section: {name}")
+        return "dict" if name in EXPORT_DICTS else "list", deque(items, maxlen=tail) if tail else items
+
     def expand_knowledge(self):
         # Компилирует "лучшие" знания, навыки, факты, тренды
         if self.epoch % 12 == 0:
-            self.knowledge = sorted(self.knowledge, key=lambda x: x['score'], reverse=True)[
-                :max(18, self.complexity)]
-            self.skill_keywords.update({k for k in self.skills if self.skills[k]['level'] > 6})
+            # В knowledge лежат и срезы памяти {'epoch', 'memory'} без score — они идут в конец
+            self.knowledge.rewrite(sorted(self.knowledge, key=lambda x: x.get('score', 0), reverse=True)[
+                :max(18, self.complexity)])
+            self.skill_keywords.update({k for k, lv in self.skills.levels().items() if lv > 6})
 
     def summarize_trends(self, topn=14):
-        trends_sorted = sorted(self.trends.items(), key=lambda x: x[1], reverse=True)
-        return [f"{k}:{v}" for k, v in trends_sorted[:topn]]
+        # Счётчики приблизительные: при err > 0 рядом пишется граница ошибки
+        return [f"{k}:{c}±{e}" if e else f"{k}:{c}" for k, c, e in self.trends.top(topn)]
+
+    def top_trends(self, topn=15):
+        return {k: c for k, c, _ in self.trends.top(topn)}
 
     def export_projects(self):
         # Отдельный экспорт найденных проектов и репозиториев
-        return dict(list(self.projects.items())[-12:])
+        return dict(list(self.view.projects.items())[-12:])
 
     def generate_idea(self):
         # Создаёт новую идею на основе трендов, навыков, кода, проектов
-        tr = self.summarize_trends(4)
-        sk = self.get_top_skills(4)
-        pr = list(self.projects.keys())[-2:] if self.projects else []
+        view = self.view
+        tr = view.summarize_trends(4)
+        sk = view.top_skills(4)
+        pr = list(view.projects)[-2:]
         base = f"Combine {' & '.join(sk)} with trending topics: {'; '.join(tr)}"
         if pr: base += f"\nInspired by projects: {', '.join(pr)}"
-        if self.coding_examples:
-            base += "\nExample code:\n" + random.choice(self.coding_examples)
+        code = view.sample_code()
+        if code:
+            base += "\nExample code:\n" + code
         return base
 
     def answer(self, prompt):
         prompt = prompt.lower().strip()
-        self.command_history.append({"prompt": prompt, "epoch": self.epoch, "time": time.time()})
+        self.defer("command_history", {"prompt": prompt, "epoch": self.epoch, "time": time.time()})
         if "code" in prompt or "пример" in prompt:
-            if self.coding_examples:
-                return "Code:\n" + random.choice(self.coding_examples)
+            code = self.view.sample_code()
+            if code:
+                return "Code:\n" + code
         if "тренд" in prompt or "trend" in prompt:
-            return "Trends: " + ", ".join(self.summarize_trends(6))
+            return "Trends: " + ", ".join(self.view.summarize_trends(6))
         if "скилл" in prompt or "skill" in prompt or "навык" in prompt:
-            return "Skills: " + ", ".join(self.get_top_skills(10))
+            return "Skills: " + ", ".join(self.view.top_skills(10))
         if "факт" in prompt or "fact" in prompt or "опред" in prompt:
-            fs = list(self.facts.values())
+            fs = list(self.view.facts.values())
             return "Fact: " + (random.choice(fs) if fs else "None")
         if "идея" in prompt or "idea" in prompt:
             return "Idea:\n" + self.generate_idea()
@@ -343,9 +2727,9 @@ class UltraEvoAI:
         if "проект" in prompt or "project" in prompt or "репоз" in prompt:
             return json.dumps(self.export_projects(), ensure_ascii=False, indent=2)
         if "память" in prompt or "memory" in prompt:
-            return f"Память: {len(self.corpus)} docs, Кода: {len(self.coding_examples)} примеров"
+            return f"Память: {self.view.docs} docs, Кода: {self.view.examples} примеров"
         if "диаг" in prompt or "diag" in prompt or "отчет" in prompt:
-            return json.dumps(self.diag_history[-8:], ensure_ascii=False, indent=2)
+            return json.dumps(self.view.diag_history[-8:], ensure_ascii=False, indent=2)
         if "export" in prompt:
             return json.dumps(self.export_state(), ensure_ascii=False, indent=2)
         if prompt.startswith("найди ") or prompt.startswith("search "):
@@ -359,230 +2743,425 @@ class UltraEvoAI:
         return self.reflect()
 
     def status(self):
-        return (f"Эпоха: {self.epoch}, Комплексность: {self.complexity}, Лучшая оценка: {round(self.best_score, 2)}\n"
-                f"Топ скиллы: {', '.join(self.get_top_skills(5))}, Тренды: {', '.join(self.summarize_trends(5))}\n"
-                f"Память: {len(self.corpus)} док., Примеров кода: {len(self.coding_examples)}, Проектов: {len(self.projects)}")
+        v = self.view
+        return (f"Эпоха: {v.epoch}, Комплексность: {v.complexity}, Лучшая оценка: {round(v.best_score, 2)}\n"
+                f"Топ скиллы: {', '.join(v.top_skills(5))}, Тренды: {', '.join(v.summarize_trends(5))}\n"
+                f"Память: {v.docs} док., Примеров кода: {v.examples}, Проектов: {v.project_count}")
 
     def reflect(self):
         # Самооценка текущего состояния
-        skills = self.get_top_skills(4)
-        tr = self.summarize_trends(4)
+        v = self.view
+        skills = v.top_skills(4)
+        tr = v.summarize_trends(4)
         return (f"My top skills: {', '.join(skills)}; Trending: {', '.join(tr)}; "
-                f"Projects: {len(self.projects)}; Examples: {len(self.coding_examples)}; Docs: {len(self.corpus)}")
+                f"Projects: {v.project_count}; Examples: {v.examples}; Docs: {v.docs}")
     def search(self, query):
-        res = []
         q = query.lower()
-        # Поиск по корпусу
-        for txt in self.corpus[-200:]:
-            if q in txt.lower():
-                res.append(txt.strip()[:350])
-                if len(res) >= 5:
-                    break
+        self._materialize("corpus")  # индекс корпуса строится при загрузке секции
+        return self.read_indexes(lambda: self._search(q))
+
+    def _search(self, q):
+        idx = self.indexes
+        # Поиск по корпусу (сначала свежие документы)
+        res = [txt.strip()[:350] for _, txt in idx["corpus"].find(q, 5)]
         # Поиск по коду
-        for code in self.coding_examples[-200:]:
-            if q in code.lower():
-                res.append("Код: " + code.strip()[:250])
-                if len(res) >= 8:
-                    break
+        res += ["Код: " + code.strip()[:250] for _, code in idx["coding_examples"].find(q, 8 - len(res))]
         # Поиск по фактам
-        for f in self.facts:
-            if q in f.lower() or q in self.facts[f].lower():
-                res.append("Факт: " + self.facts[f])
-        # Поиск по знаниям
+        res += ["Факт: " + f for _, f in idx["facts"].find(q, 12 - len(res))]
+        # Поиск по знаниям — скан последних 20 записей по закэшированному JSON
         for k in self.knowledge[-20:]:
             if isinstance(k, dict):
-                j = json.dumps(k, ensure_ascii=False)
-                if q in j.lower():
+                j, low = self.knowledge_json(k)
+                if q in low:
                     res.append("Знание: " + j[:400])
-        # Поиск по трендам и скиллам
-        for t in self.trends:
-            if q in t.lower():
-                res.append(f"Тренд: {t}:{self.trends[t]}")
-        for s in self.skills:
-            if q in s.lower():
-                res.append(f"Скилл: {s}:{self.skills[s]['level']}")
-        # Поиск по проектам
-        for p in self.projects:
-            if q in p.lower():
-                res.append(f"Проект: {p}")
-        return res[:12] if res else []
+        # Поиск по трендам, скиллам и проектам
+        res += [f"Тренд: {t}:{v[0]}" for t, v in idx["trends"].find(q, 12 - len(res))]
+        res += [f"Скилл: {s}:{self.skills.level(s)}" for s, _ in idx["skills"].find(q, 12 - len(res))]
+        res += [f"Проект: {p}" for p, _ in idx["projects"].find(q, 12 - len(res))]
+        return res[:12]
+
+    RANKED = (("corpus", "", 350), ("coding_examples", "Код: ", 250), ("facts", "Факт: ", None))
+
+    def ranked_search(self, query, k=SEARCH_PAGE, cursor=None):
+        # BM25 по корпусу, коду и фактам: top-k через кучу, без сортировки всех совпадений.
+        # Курсор — "score|источник|id" последнего результата страницы; следующая страница —
+        # всё, что строго ниже него. Индекс живой: между страницами порядок может немного
+        # сдвинуться, но повторов в пределах одного ключа (score, источник, id) не будет
+        after = None
+        if cursor:
+            after = self.parse_cursor(cursor)
+        q = query.lower()
+        self._materialize("corpus")
+        top, res = self.read_indexes(lambda: self._ranked(q, k, after))
+        nxt = None
+        if len(top) > k:
+            score, src, key = top[k - 1]
+            nxt = f"{score!r}|{src}|{key}"
+        return res, nxt
+
+    def parse_cursor(self, cursor):
+        # Кривой курсор (не три поля, не число, источник вне RANKED) — ValueError, в API это 400
+        parts = str(cursor).split("|", 2)
+        if len(parts) != 3:
+            raise ValueError(f"bad cursor: {cursor!r}")
+        score, src, key = parts
+        score, src = float(score), int(src)
+        if not 0 <= src < len(self.RANKED) or math.isnan(score):
+            raise ValueError(f"bad cursor: {cursor!r}")
+        return score, src, int(key) if self.RANKED[src][0] in STATE_LISTS else key
+
+    def _ranked(self, q, k, after):
+        def ranked():
+            for src, (name, _, _) in enumerate(self.RANKED):
+                for key, score in self.indexes[name].scores(q).items():
+                    item = (score, src, key)
+                    if after is None or item < after:
+                        yield item
+        top = heapq.nlargest(k + 1, ranked())
+        res = []
+        for score, src, key in top[:k]:
+            name, prefix, cut = self.RANKED[src]
+            text = self.indexes[name].get(key)
+            res.append(prefix + (text.strip()[:cut] if cut else text))
+        return top, res
+
+    def knowledge_json(self, k):
+        # Записи knowledge после добавления не меняются — json.dumps делается один раз
+        hit = self._knowledge_json.get(id(k))
+        if hit is None or hit[0] is not k:
+            if len(self._knowledge_json) > 64:
+                recent = {id(x) for x in self.knowledge[-20:]}
+                self._knowledge_json = {i: v for i, v in list(self._knowledge_json.items()) if i in recent}
+            j = json.dumps(k, ensure_ascii=False)
+            hit = self._knowledge_json[id(k)] = (k, j, j.lower())
+        return hit[1], hit[2]
 
     def smart_learn(self, text):
         # Извлекает программные конструкции и обучается им
         funcs = re.findall(r'def ([a-zA-Z_][\w]*)\(', text)
         classes = re.findall(r'class ([a-zA-Z_][\w]*)\(', text)
         for f in funcs:
-            k = f.lower()
-            if k not in self.skills: self.skills[k] = {'level': 1, 'count': 0}
-            self.skills[k]['level'] += 2; self.skills[k]['count'] += 1
+            self.skills.bump(f.lower(), 2, 1)
         for c in classes:
-            k = c.lower()
-            if k not in self.skills: self.skills[k] = {'level': 1, 'count': 0}
-            self.skills[k]['level'] += 3; self.skills[k]['count'] += 1
+            self.skills.bump(c.lower(), 3, 1)
         # Учится у терминов, связанных с ИИ, программированием, web, data, etc.
         topics = re.findall(r'\b(ai|ml|dl|python|java|web|data|network|blockchain|nlp|robot)\b', text.lower())
         for t in topics:
-            if t not in self.skills: self.skills[t] = {'level': 1, 'count': 0}
-            self.skills[t]['level'] += 5; self.skills[t]['count'] += 1
+            self.skills.bump(t, 5, 1)
         # Сохраняет важные структуры
         for snippet in re.findall(r'(import [a-zA-Z_\.]+)', text):
-            if snippet not in self.coding_examples:
-                self.coding_examples.append(snippet)
+            self.coding_examples.add(snippet)
         for snippet in re.findall(r'(for [\w\s,()]+ in [\w\.]+:)', text):
-            if snippet not in self.coding_examples:
-                self.coding_examples.append(snippet)
+            self.coding_examples.add(snippet)
         for snippet in re.findall(r'(while [\w\s<>!=]+:)', text):
-            if snippet not in self.coding_examples:
-                self.coding_examples.append(snippet)
+            self.coding_examples.add(snippet)
         # Учится у комментариев
         comments = re.findall(r'#.*', text)
         for com in comments:
             if com not in self.corpus:
                 self.corpus.append(com)
 
-    def deep_analyze(self, text):
-        # Глубокий анализ паттернов
-        lines = text.split('\n')
-        code_score = sum(1 for l in lines if l.strip().startswith(('def ', 'class ', 'import ', 'for ', 'while ')))
-        comment_score = sum(1 for l in lines if l.strip().startswith('#'))
-        fact_score = sum(1 for l in lines if ' is ' in l)
-        avg_len = sum(len(l) for l in lines) / max(1, len(lines))
-        features = {
-            'lines': len(lines),
-            'code_score': code_score,
-            'comment_score': comment_score,
-            'fact_score': fact_score,
-            'avg_line_len': avg_len
-        }
-        self.experience.append({'deep_features': features, 'epoch': self.epoch})
-        self.weights = [
-            w + random.uniform(-0.007, 0.019) + (0.0007 * code_score) - (0.0007 * fact_score)
-            for w in self.weights
-        ]
-        self.weights = [max(-8, min(8, w)) for w in self.weights]
+    def deep_analyze(self, *texts):
+        # Глубокий анализ паттернов; несколько документов — одним пакетным сдвигом весов
+        shift = 0.0
+        for text in texts:
+            lines = text.split('\n')
+            code_score = sum(1 for l in lines if l.strip().startswith(('def ', 'class ', 'import ', 'for ', 'while ')))
+            comment_score = sum(1 for l in lines if l.strip().startswith('#'))
+            fact_score = sum(1 for l in lines if ' is ' in l)
+            avg_len = sum(len(l) for l in lines) / max(1, len(lines))
+            features = {
+                'lines': len(lines),
+                'code_score': code_score,
+                'comment_score': comment_score,
+                'fact_score': fact_score,
+                'avg_line_len': avg_len
+            }
+            self.experience.append(experience_record("deep", self.epoch, deep_features=features))
+            shift += 0.0007 * (code_score - fact_score)
+        if texts:
+            noise = self.rng.uniform(-0.007, 0.019, (len(texts), len(self.weights))).sum(axis=0)
+            self.weights += noise + shift
+            np.clip(self.weights, -8, 8, out=self.weights)
 
     def long_term_memory(self):
         # Формирует итоговые знания
         memory = {
-            'skills': dict(sorted({k: v['level'] for k, v in self.skills.items()}.items(),
-                                  key=lambda x: x[1], reverse=True)[:18]),
-            'trends': dict(sorted(self.trends.items(), key=lambda x: x[1], reverse=True)[:15]),
+            'skills': dict(self.skills.top(18)),
+            'trends': self.top_trends(15),
             'facts': dict(list(self.facts.items())[:18]),
-            'examples': self.coding_examples[-10:],
+            'examples': self.coding_examples.recent(10),
             'docs': len(self.corpus)
         }
         return memory
     def auto_expand_keywords(self):
-        # Сам расширяет список ключевых слов, находит новые темы
+        # Сам расширяет список ключевых слов, находит новые темы (по каждому документу один раз)
         if self.epoch % 6 == 0:
             new_keys = set()
             for txt in self.corpus[-18:]:
-                kws = set(re.findall(r'\b[a-zA-Z_]{4,}\b', txt))
-                new_keys |= kws
+                if self.docs.claim(txt, "expand_keywords"):
+                    new_keys |= self.docs.cached(txt, "words", lambda t: set(re.findall(r'\b[a-zA-Z_]{4,}\b', t)))
             self.skill_keywords |= set(list(new_keys)[:35])
 
+    def learn_documents(self, *texts):
+        # Расширенное самообучение; smart_learn/deep_analyze по документу — ровно один раз,
+        # deep_analyze по всем новым документам — одним пакетом
+        for txt in texts:
+            if self.docs.claim(txt, "smart_learn"):
+                self.run_stage("smart_learn", self.smart_learn, txt)
+        fresh = [txt for txt in texts if self.docs.claim(txt, "deep_analyze")]
+        if fresh:
+            self.run_stage("deep_analyze", self.deep_analyze, *fresh)
+
     def life_cycle(self):
-        # Главный авто-эволюционный цикл
+        # Главный авто-эволюционный цикл; каждый этап изолирован через run_stage
         self.evolve()
-        if self.corpus:
-            # Для последних 5 документов — расширенное самообучение
-            for txt in self.corpus[-5:]:
-                self.smart_learn(txt)
-                self.deep_analyze(txt)
-            self.auto_expand_keywords()
-            self.expand_knowledge()
-        # Каждые 10 эпох — формирует срез памяти
-        if self.epoch % 10 == 0:
-            mem = self.long_term_memory()
-            self.knowledge.append({'epoch': self.epoch, 'memory': mem})
-        # Чистка, если слишком большой массив данных
-        self.check_corpus_limit()
-
-    def save(self):
-        # Безопасное сохранение — с бэкапом
-        try:
-            if os.path.exists(SAVE_FILE):
-                os.rename(SAVE_FILE, SAVE_FILE + ".bak")
-        except: pass
-        d = {
+        with self.state_lock:
+            if self.corpus:
+                # Для последних 5 документов — расширенное самообучение (только ещё не пройденные)
+                self.learn_documents(*self.corpus[-5:])
+                self.run_stage("expand_keywords", self.auto_expand_keywords)
+                self.run_stage("expand_knowledge", self.expand_knowledge)
+            # Каждые 10 эпох — формирует срез памяти
+            if self.epoch % 10 == 0:
+                self.run_stage("memory", self.remember_epoch)
+            # Чистка, если слишком большой массив данных
+            self.run_stage("limits", self.check_corpus_limit)
+            self.publish()
+
+    def remember_epoch(self):
+        self.knowledge.append({'epoch': self.epoch, 'memory': self.long_term_memory()})
+
+    def save(self, wait=False):
+        # Неблокирующее сохранение: запрос уходит фоновому писателю (StateWriter); заодно
+        # читателям публикуется свежий срез
+        self.publish()
+        self.writer.request(wait=wait)
+
+    def publish(self):
+        # Новый ReadView после этапа записи. Секция копируется заново, только если она
+        # сменилась (load/system_reset) или изменилась (version) с прошлого среза
+        with self.state_lock:
+            self.drain_inbox()
+            old = self.view
+            sections = (self.skills, self.trends, self.facts, self.projects, self.coding_examples)
+            versions = tuple((id(x), x.version) for x in sections)
+            same = [old is not None and a == b for a, b in zip(versions, old.versions if old else versions)]
+            tests = self.self_tests.tail(100)
+            self.view = ReadView(
+                seq=old.seq + 1 if old else 1,
+                epoch=self.epoch,
+                complexity=self.complexity,
+                best_score=self.best_score,
+                skills=old.skills if same[0] else tuple(self.skills.top(SKILLS_TOP)),
+                trends=old.trends if same[1] else tuple(self.trends.top(VIEW_TRENDS)),
+                facts=old.facts if same[2] else dict_tail(self.facts, VIEW_TAIL),
+                projects=old.projects if same[3] else {
+                    k: dict(v, samples=list(v.get("samples", ()))) for k, v in dict_tail(self.projects, VIEW_TAIL).items()},
+                project_count=len(self.projects),
+                topics=tuple(self.topics),
+                docs=len(self.corpus) if self.loaded("corpus") else (old.docs if old else 0),
+                examples=len(self.coding_examples),
+                knowledge=tuple(self.knowledge[-10:]),
+                command_history=tuple(self.command_history.tail(VIEW_TAIL)),
+                diag_history=tuple(self.diag_history.tail(VIEW_TAIL)),
+                feedback=tuple(self.user_feedback.tail(10)),
+                code_metrics=tuple(self.code_metrics.tail(VIEW_TAIL)) if self.loaded("code_metrics")
+                else (old.code_metrics if old else ()),
+                tests=(sum(1 for t in tests if t.get('passed')), len(tests)),
+                snippets=old.snippets if same[4] else tuple(self.coding_examples.values()),
+                versions=versions,
+            )
+        return self.view
+
+    def defer(self, name, *recs):
+        # Записи из читающего пути (команды, фидбек, диагностика) без ожидания state_lock: deque.extend
+        # потокобезопасен, в историю их переносит писатель (drain_inbox) — или сразу, если лок свободен
+        self._inbox.extend((name, rec) for rec in recs)
+        if self.state_lock.acquire(blocking=False):
+            try:
+                self.drain_inbox()
+            finally:
+                self.state_lock.release()
+
+    def drain_inbox(self):
+        # Под state_lock: в начале эпохи, перед publish() и перед записью журнала
+        while self._inbox:
+            name, rec = self._inbox.popleft()
+            getattr(self, name).append(rec)
+
+    def read_records(self, name):
+        # Копия секции без state_lock: истории — tuple, словари (skills — уровни с offset, projects —
+        # с копией samples) — dict. Если писатель всё же вклинился (RuntimeError: deque/dict
+        # changed size) — повтор, после SEARCH_RETRIES неудач — под локом
+        section = getattr(self, name)
+        for _ in range(SEARCH_RETRIES):
+            try:
+                return self._copy_section(name, section)
+            except RuntimeError:
+                continue
+        with self.state_lock:
+            return self._copy_section(name, section)
+
+    @staticmethod
+    def _copy_section(name, section):
+        if name == "skills":
+            return section.levels()
+        if name == "projects":
+            return {k: dict(v, samples=list(v.get("samples", ()))) for k, v in section.items()}
+        return dict(section) if isinstance(section, dict) else tuple(section)
+
+    def read_indexes(self, fn):
+        # Поиск по живым индексам без state_lock. Индекс меняется редко (документ за эпоху)
+        # и помечает запись нечётной version: если за время чтения версия какого-то индекса
+        # сдвинулась или чтение упало на полуизменённой структуре — повтор; после
+        # SEARCH_RETRIES неудач — под state_lock
+        indexes = list(self.indexes.values())
+        for attempt in range(SEARCH_RETRIES):
+            before = [idx.version for idx in indexes]
+            if not any(v & 1 for v in before):
+                try:
+                    result = fn()
+                except (RuntimeError, KeyError, IndexError, ValueError):
+                    pass
+                else:
+                    if [idx.version for idx in indexes] == before:
+                        return result
+            time.sleep(0.001 * (attempt + 1))
+        with self.state_lock:
+            return fn()
+
+    def capture_state(self, full=False):
+        # Срез изменений с прошлой записи; вызывается писателем под state_lock.
+        # full=True — все секции целиком (после ошибки записи, когда дельты потеряны)
+        self.drain_inbox()
+        scalars = {
             'epoch': self.epoch,
-            'weights': self.weights,
+            'weights': pack_weights(self.weights),
             'complexity': self.complexity,
-            'experience': self.experience,
             'best_score': self.best_score,
-            'knowledge': self.knowledge,
-            'skills': self.skills,
-            'corpus': self.corpus,
-            'facts': self.facts,
-            'coding_examples': self.coding_examples,
-            'trends': self.trends,
             'topics': list(self.topics),
-            'projects': self.projects,
-            'code_metrics': self.code_metrics,
-            'command_history': self.command_history,
-            'user_feedback': self.user_feedback,
-            'self_tests': self.self_tests,
-            'diag_history': self.diag_history,
-            'language_models': self.language_models
+            'skills_offset': self.skills.offset
         }
-        try:
-            with open(SAVE_FILE, "w", encoding="utf-8") as f:
-                json.dump(d, f)
-        except Exception as e:
-            log_event(f"[SaveError] {e}")
+        sections = {}
+        for name in STATE_LISTS + STATE_DICTS:
+            if not self.loaded(name):
+                continue  # незагруженная ленивая секция не менялась — на диске она актуальна
+            section = getattr(self, name)
+            delta = section.take_delta()
+            if full:
+                delta = {"reset": list(section) if name in STATE_LISTS else dict(section)}
+            if delta is not None:
+                sections[name] = delta
+        return self.journal.record(scalars, sections)
 
     def load(self):
-        if os.path.exists(SAVE_FILE):
+        try:
+            d, lazy = self.journal.load()
+        except Exception as e:
+            log_event(f"[LoadError] {e}")
+            d, lazy = {}, {}
+        self.epoch = d.get('epoch', 0)
+        self.weights = unpack_weights(d.get('weights'), self.weights)
+        self.complexity = d.get('complexity', 1)
+        self.best_score = d.get('best_score', 0)
+        self.topics = set(d.get('topics', []))
+        for name in STATE_LISTS + STATE_DICTS:
+            if name in lazy:
+                self.__dict__.pop(name, None)
+                self._lazy[name] = lazy[name]
+            else:
+                setattr(self, name, self._hydrate(name, d.get(name)))
+        self.skills.offset = d.get('skills_offset', 0)
+
+    def _hydrate(self, name, value):
+        # Плоское значение секции из снапшота/журнала -> рабочий контейнер
+        if name == "trends":
+            section = TrendSketch(value or {})
+        elif name == "coding_examples":
+            section = SnippetStore(value or [])
+        elif name == "language_models":
+            section = SnippetStore(value or {}, LANG_SNIPPETS_CAP)
+        elif name == "fingerprints":
+            section = FingerprintIndex(value or {})
+        elif name == "skills":
+            section = SkillStore(value or {})
+        elif name == "docs":
+            section = DocStore(value or {})
+        elif name == "code_metrics" and isinstance(value, dict):
+            # Старый формат {эпоха: метрики} -> записи кольца по порядку эпох, секция уйдёт целиком
+            section = RingBuffer([dict(m, epoch=int(k)) for k, m in sorted(value.items(), key=lambda kv: int(kv[0]))],
+                                 RING_CAPS[name])
+            section._rewritten = True
+        elif name in RING_CAPS:
+            section = RingBuffer(value or [], RING_CAPS[name])
+        else:
+            section = JournaledList(value or []) if name in STATE_LISTS else JournaledDict(value or {})
+        if name in self.indexes:
+            self.indexes[name].attach(section)
+        return section
+
+    def loaded(self, name):
+        return name not in self._lazy
+
+    def _materialize(self, name):
+        loaded = False
+        with self._lazy_lock:
+            if name not in self.__dict__:
+                loader = self._lazy.get(name)
+                t0 = time.perf_counter()
+                self.__dict__[name] = self._hydrate(name, loader() if loader else None)
+                self._lazy.pop(name, None)
+                loaded = True
+                if loader:
+                    log_event(f"[LazyLoad] {name}: {round((time.perf_counter() - t0) * 1000, 1)} ms")
+            section = self.__dict__[name]
+        if loaded:
+            self._refresh_view(name, section)  # state_lock — уже после _lazy_lock, порядок как у писателя
+        return section
+
+    def _refresh_view(self, name, section):
+        # Пока секция не загружена, срез держит её прежние числа (docs=0 после load()) — догоняем
+        with self.state_lock:
+            v = self.view
+            if v is None:
+                return
+            if name == "corpus":
+                self.view = v.refreshed(docs=len(section))
+            elif name == "code_metrics":
+                self.view = v.refreshed(code_metrics=tuple(section.tail(VIEW_TAIL)))
+
+    def preload_sections(self):
+        # Фоновая подгрузка тяжёлых секций, пока бот уже отвечает по горячим
+        for name in list(self._lazy):
             try:
-                d = json.load(open(SAVE_FILE, encoding="utf-8"))
-                self.epoch = d.get('epoch', 0)
-                self.weights = d.get('weights', self.weights)
-                self.complexity = d.get('complexity', 1)
-                self.experience = d.get('experience', [])
-                self.best_score = d.get('best_score', 0)
-                self.knowledge = d.get('knowledge', [])
-                self.skills = d.get('skills', {})
-                self.corpus = d.get('corpus', [])
-                self.facts = d.get('facts', {})
-                self.coding_examples = d.get('coding_examples', [])
-                self.trends = d.get('trends', {})
-                self.topics = set(d.get('topics', []))
-                self.projects = d.get('projects', {})
-                self.code_metrics = d.get('code_metrics', {})
-                self.command_history = d.get('command_history', [])
-                self.user_feedback = d.get('user_feedback', [])
-                self.self_tests = d.get('self_tests', [])
-                self.diag_history = d.get('diag_history', [])
-                self.language_models = d.get('language_models', {})
+                getattr(self, name)
             except Exception as e:
-                log_event(f"[LoadError] {e}")
+                log_event(f"[LazyLoadError] {name}: {e}")
 
     def reflect(self):
         # Автоматически пишет анализ своего опыта и состояния
-        skills = self.get_top_skills(5)
-        tr = self.summarize_trends(5)
+        v = self.view
+        skills = v.top_skills(5)
+        tr = v.summarize_trends(5)
         return (f"My top skills: {', '.join(skills)}; Trending: {', '.join(tr)}; " +
-                f"Projects: {len(self.projects)}; Code examples: {len(self.coding_examples)}; Docs: {len(self.corpus)}")
+                f"Projects: {v.project_count}; Code examples: {v.examples}; Docs: {v.docs}")
     def add_feedback(self, feedback):
         # Добавляет пользовательский фидбек для автообучения и аналитики
-        entry = {
-            "feedback": feedback,
-            "epoch": self.epoch,
-            "timestamp": time.time()
-        }
-        self.user_feedback.append(entry)
-        if len(self.user_feedback) > 444:
-            self.user_feedback = self.user_feedback[-444:]
+        self.add_feedbacks([feedback])
+
+    def add_feedbacks(self, feedbacks):
+        # Пачка фидбека — в очередь писателя, без ожидания state_lock (см. defer)
+        now = time.time()
+        self.defer("user_feedback", *({"feedback": fb, "epoch": self.epoch, "timestamp": now} for fb in feedbacks))
 
     def add_command(self, command):
         # Сохраняет историю команд для анализа интеракции пользователя
-        self.command_history.append({
+        self.defer("command_history", {
             "command": command,
             "epoch": self.epoch,
             "timestamp": time.time()
         })
-        if len(self.command_history) > 1200:
-            self.command_history = self.command_history[-1200:]
 
     def run_task_queue(self):
         # Асинхронное выполнение задач из очереди (например, для интеграции с Telegram)
@@ -621,8 +3200,9 @@ class UltraEvoAI:
             while True:
                 try:
                     time.sleep(interval)
-                    self.auto_expand_keywords()
-                    self.expand_knowledge()
+                    with self.state_lock:
+                        self.auto_expand_keywords()
+                        self.expand_knowledge()
                     self.save()
                     log_event("[AI] Автообновление ключевых знаний.")
                 except Exception as e:
@@ -643,15 +3223,15 @@ class UltraEvoAI:
                     continue
                 cmdl = cmd.lower()
                 if cmdl in ["выход", "exit", "quit", "stop"]:
+                    self.save(wait=True)
                     print("ИИ завершил работу. Все изменения сохранены.")
-                    self.save()
                     break
                 elif cmdl in ["статус", "status"]:
                     print(self.status())
                 elif cmdl in ["skills", "скиллы"]:
-                    print("Skills:", ", ".join(self.get_top_skills(10)))
+                    print("Skills:", ", ".join(self.view.top_skills(10)))
                 elif cmdl in ["trends", "тренды"]:
-                    print("Trends:", ", ".join(self.summarize_trends(10)))
+                    print("Trends:", ", ".join(self.view.summarize_trends(10)))
                 elif cmdl in ["idea", "идея"]:
                     print(self.generate_idea())
                 elif cmdl in ["code", "код"]:
@@ -661,7 +3241,8 @@ class UltraEvoAI:
                 elif cmdl in ["project", "проект", "проекты", "репозиторий"]:
                     print(json.dumps(self.export_projects(), ensure_ascii=False, indent=2))
                 elif cmdl in ["export"]:
-                    print(json.dumps(self.export_state(), ensure_ascii=False, indent=2))
+                    for part in self.iter_export():
+                        sys.stdout.write(part)
                 elif cmdl in ["reflect", "отрази"]:
                     print(self.reflect())
                 elif cmdl.startswith("feedback "):
@@ -680,7 +3261,7 @@ class UltraEvoAI:
                     print(resp)
             except KeyboardInterrupt:
                 print("\nЗавершение по Ctrl+C.")
-                self.save()
+                self.save(wait=True)
                 break
             except Exception as e:
                 print("[CLIError]", e)
@@ -692,7 +3273,7 @@ class UltraEvoAI:
             try:
                 self.life_cycle()
                 print("[AI] " + self.status())
-                time.sleep(random.randint(2, 6))
+                time.sleep(random.randint(*EVOLVE_PAUSE))
             except Exception as e:
                 log_event(f"[EvolveLoopError] {e}")
                 time.sleep(2)
@@ -702,20 +3283,19 @@ class UltraEvoAI:
             while True:
                 try:
                     time.sleep(interval)
+                    v = self.view
                     diag_report = {
-                        "epoch": self.epoch,
-                        "best_score": self.best_score,
-                        "skills": self.get_top_skills(10),
-                        "trends": self.summarize_trends(10),
-                        "projects": list(self.projects.keys())[-5:],
-                        "examples": len(self.coding_examples),
-                        "memory_docs": len(self.corpus),
-                        "tests_passed": sum(1 for t in self.self_tests[-100:] if t['passed']),
-                        "tests_total": len(self.self_tests[-100:])
+                        "epoch": v.epoch,
+                        "best_score": v.best_score,
+                        "skills": v.top_skills(10),
+                        "trends": v.summarize_trends(10),
+                        "projects": list(v.projects)[-5:],
+                        "examples": v.examples,
+                        "memory_docs": v.docs,
+                        "tests_passed": v.tests[0],
+                        "tests_total": v.tests[1]
                     }
-                    self.diag_history.append({"type": "auto_diag", "report": diag_report, "time": time.time()})
-                    if len(self.diag_history) > 800:
-                        self.diag_history = self.diag_history[-800:]
+                    self.defer("diag_history", {"type": "auto_diag", "report": diag_report, "time": time.time()})
                     log_event(f"[AutoDiag] {json.dumps(diag_report)}")
                 except Exception as e:
                     log_event(f"[AutoDiagError] {e}")
@@ -735,15 +3315,20 @@ class UltraEvoAI:
                     with open(path, encoding="utf-8") as f:
                         txt = f.read()
                         if txt and len(txt) > 40:
-                            self.corpus.append(txt)
-                            self.smart_learn(txt)
-                            self.deep_analyze(txt)
-                            self.expand_knowledge()
-                            self.auto_expand_keywords()
+                            with self.state_lock:
+                                if not self.admit_document(txt, source=path):
+                                    continue
+                                self.corpus.append(txt)
+                                self.learn_documents(txt)
+                                self.expand_knowledge()
+                                self.auto_expand_keywords()
                             log_event(f"[DataLearn] Обучен на {fname}")
                 except Exception as e:
                     log_event(f"[DataLearnFileError] {fname}: {e}")
-            self.check_corpus_limit()
+            with self.state_lock:
+                self.check_corpus_limit()
+            # Корпус и индексы изменились — новый срез сбрасывает кэш ответов search/rank
+            self.publish()
         except Exception as e:
             log_event(f"[DataLearnError] {e}")
 
@@ -769,15 +3354,14 @@ class UltraEvoAI:
         return tokens
 
     def nlp_extract_keywords(self, text, topn=10):
-        # Выделяет топовые встречающиеся слова как ключевые термины
-        tokens = self.nlp_tokenize(text)
-        freq = {}
-        for t in tokens:
-            freq[t] = freq.get(t, 0) + 1
-        sorted_words = sorted(freq.items(), key=lambda x: x[1], reverse=True)
-        return [w for w, _ in sorted_words[:topn]]
+        # Выделяет топовые встречающиеся слова как ключевые термины (частоты кэшируются в docs)
+        freq = self.docs.cached(text, "freq", lambda t: Counter(self.nlp_tokenize(t)))
+        return [w for w, _ in freq.most_common(topn)]
 
     def nlp_find_entities(self, text):
+        return self.docs.cached(text, "entities", self._find_entities)
+
+    def _find_entities(self, text):
         # Очень простая "NER" — выделяет имена, термины, функции, классы
         names = re.findall(r'\b[A-Z][a-z]{2,15}\b', text)
         funcs = re.findall(r'def ([a-zA-Z_][\w]*)\(', text)
@@ -796,31 +3380,25 @@ class UltraEvoAI:
         return " | ".join(best)[:maxlen] if best else text[:maxlen]
 
     def auto_nlp_features(self):
-        # Каждые 8 эпох выделяет новые термины, имена, ключевые сущности из корпуса
+        # Каждые 8 эпох выделяет новые термины, имена, ключевые сущности из новых документов корпуса
         if self.epoch % 8 == 0:
             for txt in self.corpus[-12:]:
+                if not self.docs.claim(txt, "nlp"):
+                    continue  # документ уже разобран — повторный bump раздувал бы уровни
                 kws = self.nlp_extract_keywords(txt, 7)
                 ents = self.nlp_find_entities(txt)
                 self.skill_keywords |= set(kws)
+                # Новый навык получает стартовый уровень (имя 1, функция 2, класс 3), известный — +1
                 for n in ents["names"]:
-                    if n.lower() not in self.skills:
-                        self.skills[n.lower()] = {"level": 1, "count": 1}
-                    else:
-                        self.skills[n.lower()]["level"] += 1
+                    self.skills.bump(n.lower(), 1, 0, new=(0, 1))
                 for f in ents["funcs"]:
-                    if f.lower() not in self.skills:
-                        self.skills[f.lower()] = {"level": 2, "count": 1}
-                    else:
-                        self.skills[f.lower()]["level"] += 1
+                    self.skills.bump(f.lower(), 1, 0, new=(1, 1))
                 for c in ents["classes"]:
-                    if c.lower() not in self.skills:
-                        self.skills[c.lower()] = {"level": 3, "count": 1}
-                    else:
-                        self.skills[c.lower()]["level"] += 1
+                    self.skills.bump(c.lower(), 1, 0, new=(2, 1))
     def auto_code_generation(self):
         # Автоматически генерирует новый код на основе изученных примеров и скиллов (демо-реализация)
-        if not self.coding_examples: return ""
-        base = random.choice(self.coding_examples)
+        base = self.coding_examples.sample()
+        if not base: return ""
         tokens = base.split()
         random.shuffle(tokens)
         gen_code = []
@@ -846,12 +3424,10 @@ class UltraEvoAI:
 
     def auto_self_test(self):
         # Автоматически тестирует сгенерированный код (имитация)
-        if self.epoch % 12 == 0 and self.coding_examples:
-            code = random.choice(self.coding_examples)
+        code = self.coding_examples.sample() if self.epoch % 12 == 0 else None
+        if code:
             res = {"code_tested": code[:60], "epoch": self.epoch, "passed": random.choice([True, False])}
             self.self_tests.append(res)
-            if len(self.self_tests) > 500:
-                self.self_tests = self.self_tests[-500:]
 
     def auto_self_diagnostics(self):
         # Каждые 9 эпох — диагностирует память и знания
@@ -865,14 +3441,13 @@ class UltraEvoAI:
                 "trends": self.summarize_trends(5)
             }
             self.diag_history.append({"type": "self_diag", "report": report, "time": time.time()})
-            if len(self.diag_history) > 800:
-                self.diag_history = self.diag_history[-800:]
 
     def system_maintenance(self):
         # Самообслуживание: backup, диагностика, очистка памяти
         if self.epoch % 22 == 0:
             self.backup()
-            self.check_corpus_limit()
+            with self.state_lock:
+                self.check_corpus_limit()
             self.save()
             log_event(f"[SystemMaintenance] Epoch {self.epoch}")
     def integrate_external_data(self, sources=None):
@@ -884,26 +3459,31 @@ class UltraEvoAI:
                 "https://raw.githubusercontent.com/ossu/computer-science/master/README.md",
                 "https://raw.githubusercontent.com/jakevdp/PythonDataScienceHandbook/master/notebooks/Index.ipynb"
             ]
+        session = make_session(2)
         for src in sources:
             try:
                 if src.startswith("http"):
-                    r = requests.get(src, timeout=20)
-                    if r.status_code != 200:
-                        continue
-                    text = r.text
+                    text, changed = self.http_cache.get(session, src, self.read_text, timeout=20)
+                    if not changed:
+                        continue  # README не менялся (свежий кэш или 304) — учиться нечему
                 else:
                     with open(src, encoding="utf-8") as f:
-                        text = f.read()
+                        text = f.read(EXTERNAL_MAX_BYTES)
                 if text and len(text) > 40:
-                    self.corpus.append(text)
-                    self.smart_learn(text)
-                    self.deep_analyze(text)
-                    self.expand_knowledge()
-                    self.auto_expand_keywords()
+                    with self.state_lock:
+                        if not self.admit_document(text, source=src):
+                            continue
+                        self.corpus.append(text)
+                        self.learn_documents(text)
+                        self.expand_knowledge()
+                        self.auto_expand_keywords()
                     log_event(f"[IntegrateData] Обучен на {src}")
             except Exception as e:
                 log_event(f"[IntegrateDataError] {src}: {e}")
-        self.check_corpus_limit()
+        session.close()
+        with self.state_lock:
+            self.check_corpus_limit()
+        self.publish()
 
     def auto_external_data_integration(self, interval=10800):
         # Автоматическая интеграция внешних данных (по умолчанию каждые 3 часа)
@@ -931,11 +3511,10 @@ class UltraEvoAI:
             res = {
                 "memory_mb": mem,
                 "state_file_kb": file_sz,
+                "journal_kb": self.journal.bytes // 1024,
                 "uptime_sec": uptime
             }
-            self.diag_history.append({"type": "resource_monitor", "meta": res, "time": time.time()})
-            if len(self.diag_history) > 800:
-                self.diag_history = self.diag_history[-800:]
+            self.defer("diag_history", {"type": "resource_monitor", "meta": res, "time": time.time()})
             return res
         except Exception as e:
             log_event(f"[ResourceMonitorError] {e}")
@@ -971,20 +3550,28 @@ class UltraEvoAI:
 
     def summarize_state(self):
         # Краткое резюме состояния для Telegram/web-интеграции
+        v = self.view
         state = {
-            "epoch": self.epoch,
-            "complexity": self.complexity,
-            "top_skills": self.get_top_skills(7),
-            "trends": self.summarize_trends(6),
-            "projects": list(self.projects.keys())[-4:],
-            "examples": len(self.coding_examples),
-            "memory_docs": len(self.corpus),
-            "best_score": self.best_score
+            "epoch": v.epoch,
+            "complexity": v.complexity,
+            "top_skills": v.top_skills(7),
+            "trends": v.summarize_trends(6),
+            "projects": list(v.projects)[-4:],
+            "examples": v.examples,
+            "memory_docs": v.docs,
+            "best_score": v.best_score
         }
         return json.dumps(state, ensure_ascii=False, indent=2)
 
     def handle_external_query(self, qtype, data=None):
-        # Обработка внешних запросов (например, от Telegram-модуля)
+        # Обработка внешних запросов (например, от Telegram-модуля). Детерминированные ответы
+        # берутся из response_cache, пока не опубликован новый срез состояния
+        if qtype in CACHED_QUERIES:
+            key = (qtype, str(data or "").lower())
+            return self.response_cache.get(self.view.seq, key, lambda: self._external_query(qtype, data))
+        return self._external_query(qtype, data)
+
+    def _external_query(self, qtype, data=None):
         if qtype == "status":
             return self.status()
         if qtype == "state":
@@ -998,12 +3585,15 @@ class UltraEvoAI:
         if qtype == "project":
             return json.dumps(self.export_projects(), ensure_ascii=False, indent=2)
         if qtype == "skills":
-            return ", ".join(self.get_top_skills(10))
+            return ", ".join(self.view.top_skills(10))
         if qtype == "trends":
-            return ", ".join(self.summarize_trends(10))
+            return ", ".join(self.view.summarize_trends(10))
         if qtype == "search" and data:
             found = self.search(data)
             return "\n\n".join(found) if found else "Ничего не найдено."
+        if qtype == "rank" and data:
+            found, _ = self.ranked_search(data)
+            return "\n\n".join(found) if found else "Ничего не найдено."
         if qtype == "feedback" and data:
             self.add_feedback(data)
             return "Фидбек принят!"
@@ -1022,15 +3612,52 @@ class UltraEvoAI:
 
     def batch_telegram_task(self, tasks, reply_func=None, user_id=None):
         # Для массовых запросов из Telegram (например, история диалога)
+        return self.run_batch(tasks, "Telegram", reply_func)
+
+    def run_batch(self, tasks, source, reply_func=None):
+        # Пакет запросов: одинаковые (qtype, data) считаются один раз, читающие запросы идут
+        # параллельно в пуле, пишущие (feedback, code/fact) — по порядку в этом потоке. Ответы из
+        # ReadView (status, skills, idea...) — все из одного закреплённого среза; search/rank идут
+        # по живым индексам и видят состояние на момент своего выполнения. Ответы — в порядке задач,
+        # фидбек по всему пакету — одной вставкой
+        pairs = [(t.get('qtype', ''), t.get('data', '')) for t in tasks]
+        keys = [(qt, data if isinstance(data, (str, int, float, type(None))) else repr(data)) for qt, data in pairs]
+        view, answers, pending = self.view, {}, {}
+        for key, (qt, data) in zip(keys, pairs):
+            if qt in READ_QUERIES and key not in pending:
+                pending[key] = self.batch_pool().submit(self._pinned_query, view, qt, data)
         results = []
-        for t in tasks:
-            qt, data = t.get('qtype', ''), t.get('data', '')
-            res = self.telegram_task(qt, data, reply_func=reply_func, user_id=user_id)
-            results.append(res)
+        for key, (qt, data) in zip(keys, pairs):
+            if key in pending:
+                if key not in answers:
+                    answers[key] = pending[key].result()
+                results.append(answers[key])
+            else:
+                results.append(self.handle_external_query(qt, data))
+        self.add_feedbacks([f"[{source}] {qt.upper()} Q: {data} | A: {resp}" for (qt, data), resp in zip(pairs, results)])
+        if reply_func:
+            for resp in results:
+                try:
+                    reply_func(resp)
+                except Exception as e:
+                    log_event(f"[{source}ReplyError] {e}")
         return results
 
+    def batch_pool(self):
+        with self._batch_lock:
+            if self._batch_pool is None:
+                self._batch_pool = ThreadPoolExecutor(BATCH_WORKERS, thread_name_prefix="batch")
+            return self._batch_pool
+
+    def _pinned_query(self, view, qtype, data):
+        self._pinned.view = view
+        try:
+            return self.handle_external_query(qtype, data)
+        finally:
+            self._pinned.view = None
+
     def web_api_task(self, qtype, data, reply_func=None, user_id=None):
-        # Заглушка для web API интеграции (можно расширить под Flask/FastAPI)
+        # Запрос из web API (ApiServer, POST /query) — ответ и фидбек с пометкой [WebAPI]
         resp = self.handle_external_query(qtype, data)
         fb = f"[WebAPI] {qtype.upper()} Q: {data} | A: {resp}"
         self.add_feedback(fb)
@@ -1042,21 +3669,24 @@ class UltraEvoAI:
         return resp
 
     def batch_web_api_task(self, tasks, reply_func=None, user_id=None):
-        results = []
-        for t in tasks:
-            qt, data = t.get('qtype', ''), t.get('data', '')
-            res = self.web_api_task(qt, data, reply_func=reply_func, user_id=user_id)
-            results.append(res)
-        return results
+        return self.run_batch(tasks, "WebAPI", reply_func)
 
     # --- системные команды для глубокой диагностики и управления ---
     def system_diag_report(self):
+        v = self.view
         report = {
-            "epoch": self.epoch,
-            "complexity": self.complexity,
-            "best_score": self.best_score,
-            "diag_last": self.diag_history[-6:],
-            "projects": list(self.projects.keys())[-7:],
+            "epoch": v.epoch,
+            "complexity": v.complexity,
+            "best_score": v.best_score,
+            "diag_last": v.diag_history[-6:],
+            "projects": list(v.projects)[-7:],
+            "dedup": dict(self.dedup_stats, fingerprints=len(self.fingerprints)),
+            "http_cache": dict(self.http_cache.stats),
+            "crawl": self.crawler.table(),
+            "stages": self.stage_report(),
+            "log": dict(EVENT_LOG.stats),
+            "response_cache": dict(self.response_cache.stats, size=len(self.response_cache)),
+            "api": dict(self.api.stats, port=self.api.port) if self.api else None,
             "resource": self.monitor_resources()
         }
         return json.dumps(report, ensure_ascii=False, indent=2)
@@ -1071,31 +3701,29 @@ class UltraEvoAI:
     def start_all(self, with_cli=True):
         # Запуск всех автоматических потоков и CLI (если нужно)
         self.schedule_all_autos()
+        self.start_fetch_pipeline()
         threading.Thread(target=self.run_evolve_loop, daemon=True).start()
         if with_cli:
             self.cli_interaction()
 
+    def start_api(self, host=API_HOST, port=API_PORT):
+        # HTTP/JSON API в фоновом потоке (см. ApiServer); повторный вызов вернёт уже запущенный
+        if self.api is None:
+            self.api = ApiServer(self, host, port).start()
+        return self.api
+
     # --- Упрощённый запуск для Telegram/веб-модуля ---
     def start_background(self):
+        threading.Thread(target=self.preload_sections, daemon=True).start()
         self.schedule_all_autos()
+        self.start_fetch_pipeline()
         threading.Thread(target=self.run_evolve_loop, daemon=True).start()
 
     # --- Генерация большого отчёта для администратора ---
-    def admin_report(self):
-        rep = {
-            "epoch": self.epoch,
-            "complexity": self.complexity,
-            "best_score": self.best_score,
-            "skills": self.get_top_skills(20),
-            "trends": self.summarize_trends(18),
-            "projects": list(self.projects.keys())[-10:],
-            "diag_history": self.diag_history[-15:],
-            "feedback": self.user_feedback[-10:],
-            "code_metrics": self.code_metrics,
-            "memory_docs": len(self.corpus),
-            "examples": len(self.coding_examples)
-        }
-        return json.dumps(rep, ensure_ascii=False, indent=2)
+    def admin_report(self, **window):
+        # Сводка + последние ADMIN_TAIL записей диагностики, фидбека и метрик кода в окне window
+        # (since_epoch/until_epoch/since/until). Потоком — iter_export(ADMIN_SECTIONS, ...)
+        return "".join(self.iter_export(ADMIN_SECTIONS, tail=ADMIN_TAIL, **window))
 
     # --- Встроенная справка ---
     def help_text(self):
@@ -1108,6 +3736,22 @@ class UltraEvoAI:
 # --- Запуск как отдельного модуля или с Telegram/web-интеграцией ---
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--convert":
+        # python ai.py --convert [старый.json] [новый.bin]
+        convert_json_brain(*sys.argv[2:4])
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "--api":
+        # python ai.py --api [порт] [хост] — обучение в фоне + HTTP/JSON API без CLI
+        ai = UltraEvoAI()
+        ai.start_background()
+        ai.api = ApiServer(ai, sys.argv[3] if len(sys.argv) > 3 else API_HOST,
+                           int(sys.argv[2]) if len(sys.argv) > 2 else API_PORT)
+        print(f"\n=== Ultra Evo AI API: http://{ai.api.host}:{ai.api.port} ===\n")
+        try:
+            ai.api.run()
+        except KeyboardInterrupt:
+            ai.save(wait=True)
+        sys.exit(0)
     ai = UltraEvoAI()
     print("\n=== Ultra Evo AI started ===\n")
     print(ai.help_text())
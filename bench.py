@@ -0,0 +1,370 @@
+# Микро-бенчмарки горячих путей ai.py.
+#   python bench.py analyzer [--docs DIR] [-n 200]
+#   python bench.py html [--pages bench_pages] [--save]
+#   python bench.py search [--docs DIR] [-n 950]
+#   python bench.py trends [--words 400000] [--capacity 4096]
+#   python bench.py weights [--size 333] [--docs 5]
+#   python bench.py api [--url http://127.0.0.1:8377] [-c 16] [--seconds 5]
+import argparse, hashlib, http.client, os, random, re, statistics, tempfile, threading, time
+import numpy as np
+from ai import (KEYWORDS, URLS, FETCH_CHUNK, FETCH_TEXT_BUDGET, TextAnalyzer, HtmlTextExtractor, make_session,
+                JournaledList, SearchIndex, TrendSketch, TRENDS_CAPACITY, UltraEvoAI, ApiServer)
+from urllib.parse import urlsplit
+from collections import Counter
+
+def load_docs(folder, n):
+    # Документы из папки (сохранённые страницы, ai_data/) или синтетика из KEYWORDS
+    docs = []
+    if folder and os.path.isdir(folder):
+        for fname in sorted(os.listdir(folder)):
+            path = os.path.join(folder, fname)
+            if os.path.isfile(path):
+                with open(path, encoding="utf-8", errors="replace") as f:
+                    docs.append(f.read()[:18000])
+    if not docs:
+        rnd = random.Random(7)
+        vocab = KEYWORDS + ["project", "return", "import", "class", "def", "function", "Python is a language.",
+                            "accuracy: 0.95", "results", "framework", "developers", "performance"]
+        for _ in range(n):
+            words = [rnd.choice(vocab) for _ in range(2600)]
+            docs.append(" ".join(w + ("\n" if rnd.random() < 0.06 else "") for w in words)[:18000])
+    return docs[:n]
+
+def timeit(fn, docs, rounds=3):
+    best = None
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        for d in docs:
+            fn(d)
+        dt = (time.perf_counter() - t0) / len(docs)
+        best = dt if best is None else min(best, dt)
+    return best * 1e6
+
+# --- analyzer: по-этапные сканы evolve() до слитного анализатора ---
+
+def legacy_scans(text, skill_keywords=frozenset(KEYWORDS)):
+    # То, что делали analyze_text/update_skills/update_trends/track_metrics/find_facts/
+    # auto_project_detection/run_self_test каждый по отдельности
+    words = text.lower().split()
+    unique = len(set(words))
+    keyword_count = sum(1 for w in words if w in skill_keywords)
+    hits = {}
+    for kw in KEYWORDS:
+        cnt = len(re.findall(r'\b' + re.escape(kw) + r'\b', text.lower()))
+        if cnt:
+            hits[kw] = cnt
+    skill_words = set(re.findall(r'\b[a-zA-Z_]{3,24}\b', text.lower()))
+    trends = {}
+    for t in re.findall(r'\b[a-zA-Z]{6,}\b', text):
+        t = t.lower()
+        trends[t] = trends.get(t, 0) + 1
+    metrics = (text.count('\n'), text.count("def ") + text.count("class ") + text.count("import "), len(text.split()))
+    facts = re.findall(r'([A-Z][a-z]+ is [^\.]{10,110}\.)', text)
+    stats = re.findall(r'([A-Za-z_]{3,32}[:=]\s*[0-9\.]+)', text)
+    project = None
+    if any(w in text.lower() for w in ["project", "repo", "package", "framework", "dataset"]):
+        project = re.search(r'project ([a-zA-Z0-9_\-]+)', text)
+    funcs = re.findall(r'def ([a-zA-Z_][\w]*)\(', text) if "def " in text and "return" in text else []
+    return unique, keyword_count, hits, skill_words, trends, metrics, facts, stats, project, funcs
+
+def fused_scans(analyzer, skill_keywords=frozenset(KEYWORDS)):
+    def run(text):
+        f = analyzer.analyze(text)
+        keyword_count = sum(c for w, c in f.words.items() if w in skill_keywords)
+        return len(f.words), keyword_count, f
+    return run
+
+def bench_analyzer(args):
+    docs = load_docs(args.docs, args.n)
+    analyzer = TextAnalyzer()
+    before = timeit(legacy_scans, docs)
+    after = timeit(fused_scans(analyzer), docs)
+    # Признаки, которые должны совпадать один в один
+    same = sum(1 for d in docs if (lambda o, f: o[2] == f.keyword_hits and o[3] == f.skill_words
+                                   and o[4] == f.trend_words and o[6] == f.facts)(legacy_scans(d), analyzer.analyze(d)))
+    print(f"docs: {len(docs)}, avg {sum(map(len, docs)) // len(docs)} chars")
+    print(f"before (per-stage scans): {before:9.1f} us/doc")
+    print(f"after  (TextAnalyzer):    {after:9.1f} us/doc   x{before / after:.1f}")
+    print(f"identical keyword/trend/skill/fact features: {same}/{len(docs)}")
+
+# --- html: regex clean_html против потокового HtmlTextExtractor ---
+
+def legacy_clean_html(text):
+    # Прежний clean_html: восемь re.sub по всей странице, обрезка уже после
+    text = re.sub(r'<script[\s\S]*?</script>', '', text)
+    text = re.sub(r'<style[\s\S]*?</style>', '', text)
+    text = re.sub(r'<!--[\s\S]*?-->', '', text)
+    text = re.sub(r'<.*?>', '', text)
+    text = re.sub(r'&#\d+;', ' ', text)
+    text = re.sub(r'[^a-zA-Zа-яА-Я0-9\s\n:;.,_+=\-\/\(\)\[\]\{\}#@!%*]', '', text)
+    text = re.sub(r'\n+', '\n', text)
+    text = re.sub(r' +', ' ', text)
+    return text.strip()[:FETCH_TEXT_BUDGET]
+
+def streaming_clean_html(page):
+    # Как в fetch_url: куски по FETCH_CHUNK, остановка по бюджету
+    extractor = HtmlTextExtractor(FETCH_TEXT_BUDGET)
+    for i in range(0, len(page), FETCH_CHUNK):
+        extractor.feed(page[i:i + FETCH_CHUNK])
+        if extractor.done:
+            break
+    if not extractor.done:
+        extractor.close()
+    return extractor.result()
+
+def save_pages(folder):
+    os.makedirs(folder, exist_ok=True)
+    session = make_session()
+    for url in URLS:
+        try:
+            r = session.get(url, timeout=14)
+            if r.status_code == 200:
+                name = hashlib.sha1(url.encode()).hexdigest()[:12] + ".html"
+                with open(os.path.join(folder, name), "w", encoding="utf-8") as f:
+                    f.write(r.text)
+                print(f"saved {url} ({len(r.text) // 1024} KB)")
+        except Exception as e:
+            print(f"skip {url}: {e}")
+
+def synthetic_page(seed, size=600_000):
+    rnd = random.Random(seed)
+    parts = ["<html><head><style>body{margin:0}</style><script>var cfg = {a: 1};</script></head><body>"]
+    total = 0
+    while total < size:
+        if rnd.random() < 0.1:
+            chunk = "<script>window.data = " + "x" * rnd.randint(200, 4000) + ";</script>"
+        else:
+            words = " ".join(rnd.choice(KEYWORDS) for _ in range(rnd.randint(5, 40)))
+            chunk = f'<div class="row"><a href="/p/{rnd.randint(1, 9999)}">{words}</a> &amp; &#169;</div>\n'
+        parts.append(chunk)
+        total += len(chunk)
+    return "".join(parts) + "</body></html>"
+
+def bench_html(args):
+    if args.save:
+        save_pages(args.pages)
+    pages = []
+    if os.path.isdir(args.pages):
+        for fname in sorted(os.listdir(args.pages)):
+            with open(os.path.join(args.pages, fname), encoding="utf-8", errors="replace") as f:
+                pages.append(f.read())
+    source = args.pages
+    if not pages:
+        pages, source = [synthetic_page(i) for i in range(8)], "synthetic"
+    print(f"pages: {len(pages)} ({source}), avg {sum(map(len, pages)) // len(pages) // 1024} KB")
+    before = timeit(legacy_clean_html, pages)
+    after = timeit(streaming_clean_html, pages)
+    print(f"regex clean_html + truncate: {before / 1000:8.2f} ms/page")
+    print(f"HtmlTextExtractor (budget):  {after / 1000:8.2f} ms/page   x{before / after:.1f}")
+
+# --- search: скан корпуса против инвертированного индекса ---
+
+def bench_search(args):
+    docs = [d + f" doc{i}marker" for i, d in enumerate(load_docs(args.docs, args.n))]
+    corpus = JournaledList()
+    index = SearchIndex()
+    t0 = time.perf_counter()
+    index.attach(corpus)
+    corpus.extend(docs)
+    build = time.perf_counter() - t0
+    queries = ["python", "machine learning", "earning da", "zzzz", f"doc{len(docs) // 2}marker", "ork", "x"]
+
+    def scan(q):
+        return [d for d in reversed(corpus) if q in d.lower()][:5]
+
+    def indexed(q):
+        return [d for _, d in index.find(q, 5)]
+
+    same = sum(1 for q in queries if scan(q) == indexed(q))
+    before = timeit(scan, queries)
+    after = timeit(indexed, queries)
+    print(f"docs: {len(docs)}, terms: {len(index.postings)}, trigrams: {len(index.grams)}, build {build * 1000:.0f} ms")
+    print(f"scan:          {before / 1000:8.3f} ms/query")
+    print(f"SearchIndex:   {after / 1000:8.3f} ms/query   x{before / after:.1f}")
+    print(f"identical results: {same}/{len(queries)}")
+
+# --- trends: неограниченный dict + сортировка против TrendSketch ---
+
+def bench_trends(args):
+    rnd = random.Random(3)
+    vocab = [f"trend{i:06d}" for i in range(args.words // 2)]
+    weights = [1 / (i + 1) ** 1.1 for i in range(len(vocab))]
+    stream = rnd.choices(vocab, weights, k=args.words)
+    batches = [Counter(stream[i:i + 500]) for i in range(0, len(stream), 500)]  # ~ trend_words одного документа
+    exact, sketch = {}, TrendSketch(capacity=args.capacity)
+    t0 = time.perf_counter()
+    for b in batches:
+        for t, c in b.items():
+            exact[t] = exact.get(t, 0) + c
+    t1 = time.perf_counter()
+    for b in batches:
+        for t, c in b.items():
+            sketch.add(t, c)
+    t2 = time.perf_counter()
+    top_before = timeit(lambda _: sorted(exact.items(), key=lambda x: x[1], reverse=True)[:14], range(20))
+    top_after = timeit(lambda _: sketch.top(14), range(20))
+    top = sketch.top(14)
+    ok = all(c - e <= exact[k] <= c for k, c, e in top)
+    same = [k for k, _, _ in top] == [k for k, _ in sorted(exact.items(), key=lambda x: x[1], reverse=True)[:14]]
+    print(f"words: {len(stream)}, distinct: {len(exact)}, sketch size: {len(sketch)}")
+    print(f"updates  dict: {(t1 - t0) * 1000:8.1f} ms   sketch: {(t2 - t1) * 1000:8.1f} ms")
+    print(f"top-14   sort: {top_before / 1000:8.3f} ms   sketch: {top_after / 1000:8.3f} ms")
+    print(f"error bounds hold: {ok}, same top-14: {same}")
+
+# --- weights: поэлементные списки против вектора NumPy ---
+
+def legacy_weights_cycle(weights, keyword_count, docs):
+    # analyze_text + deep_analyze по каждому из docs документов + evaluate, как было на списках
+    for i in range(len(weights)):
+        if i < keyword_count:
+            weights[i] += 0.004 * random.uniform(0.8, 1.2)
+        else:
+            weights[i] -= 0.001 * random.uniform(0.7, 1.3)
+    weights = [max(-5, min(5, w)) for w in weights]
+    for code_score, fact_score in docs:
+        weights = [w + random.uniform(-0.007, 0.019) + (0.0007 * code_score) - (0.0007 * fact_score) for w in weights]
+        weights = [max(-8, min(8, w)) for w in weights]
+    return weights, sum(abs(w) for w in weights) / len(weights)
+
+def numpy_weights_cycle(rng):
+    def run(weights, keyword_count, docs):
+        k = min(keyword_count, len(weights))
+        weights[:k] += 0.004 * rng.uniform(0.8, 1.2, k)
+        weights[k:] -= 0.001 * rng.uniform(0.7, 1.3, len(weights) - k)
+        np.clip(weights, -5, 5, out=weights)
+        shift = sum(0.0007 * (c - f) for c, f in docs)
+        weights += rng.uniform(-0.007, 0.019, (len(docs), len(weights))).sum(axis=0) + shift
+        np.clip(weights, -8, 8, out=weights)
+        return weights, float(np.abs(weights).mean())
+    return run
+
+def bench_weights(args):
+    rnd = random.Random(5)
+    cycles = [(rnd.randint(0, 60), [(rnd.randint(0, 40), rnd.randint(0, 20)) for _ in range(args.docs)])
+              for _ in range(200)]
+    state = {"list": [rnd.uniform(-1, 1) for _ in range(args.size)], "np": np.random.default_rng(5).uniform(-1, 1, args.size)}
+    vec = numpy_weights_cycle(np.random.default_rng(5))
+
+    def before(c):
+        state["list"], _ = legacy_weights_cycle(state["list"], *c)
+
+    def after(c):
+        state["np"], _ = vec(state["np"], *c)
+    t_before, t_after = timeit(before, cycles), timeit(after, cycles)
+    print(f"weights: {args.size}, documents per life_cycle: {args.docs}")
+    print(f"lists:  {t_before:9.1f} us/cycle")
+    print(f"numpy:  {t_after:9.1f} us/cycle   x{t_before / t_after:.1f}")
+
+# --- api: нагрузка на ApiServer, keep-alive против соединения на запрос ---
+
+class DocFeed:
+    # Вместо FetchPipeline: evolve() берёт документы из списка, без сети
+    def __init__(self, docs):
+        self.docs = docs
+        self.i = 0
+
+    def get(self):
+        self.i += 1
+        return self.docs[(self.i - 1) % len(self.docs)], f"local://doc{self.i}"
+
+def api_fixture(docs, epochs):
+    # Свежий UltraEvoAI во временной папке, обученный на синтетике, и ApiServer на свободном порту
+    os.chdir(tempfile.mkdtemp(prefix="bench_api_"))
+    ai = UltraEvoAI()
+    ai.fetcher = DocFeed(docs)
+    for _ in range(epochs):
+        ai.life_cycle()
+    ai.save(wait=True)
+    return ApiServer(ai, port=0).start()
+
+def load(host, port, paths, clients, seconds, keep):
+    # clients потоков шлют GET по кругу paths; keep=False — новое соединение на каждый запрос
+    lat, errors, stop = [], [0], time.perf_counter() + seconds
+
+    def client(n):
+        conn, mine = None, []
+        while time.perf_counter() < stop:
+            path = paths[(n + len(mine)) % len(paths)]
+            t0 = time.perf_counter()
+            try:
+                if conn is None:
+                    conn = http.client.HTTPConnection(host, port, timeout=30)
+                conn.request("GET", path, headers={} if keep else {"Connection": "close"})
+                r = conn.getresponse()
+                r.read()
+                if r.status != 200:
+                    errors[0] += 1
+            except (OSError, http.client.HTTPException):
+                errors[0] += 1
+                conn.close()
+                conn = None
+                continue
+            mine.append(time.perf_counter() - t0)
+            if not keep:
+                conn.close()
+                conn = None
+        lat.extend(mine)
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    lat.sort()
+    q = statistics.quantiles(lat, n=100) if len(lat) > 1 else [0] * 99
+    return len(lat) / seconds, q[49] * 1000, q[98] * 1000, errors[0]
+
+def bench_api(args):
+    if args.url:
+        u = urlsplit(args.url)
+        host, port, server = u.hostname, u.port or 80, None
+    else:
+        server = api_fixture(load_docs(args.docs, 60), args.epochs)
+        host, port = server.host, server.port
+    paths = ["/health", "/query?qtype=status", "/query?qtype=skills", "/query?qtype=trends",
+             "/search?q=python", "/search?q=machine+learning&k=10", "/query?qtype=search&data=data"]
+    print(f"server: http://{host}:{port}, clients: {args.c}, {args.seconds}s per run")
+    for name, keep in (("connection per request", False), ("keep-alive", True)):
+        rps, p50, p99, err = load(host, port, paths, args.c, args.seconds, keep)
+        print(f"{name:24} {rps:8.0f} req/s   p50 {p50:6.2f} ms   p99 {p99:6.2f} ms   errors {err}")
+    conn = http.client.HTTPConnection(host, port, timeout=60)
+    t0 = time.perf_counter()
+    conn.request("GET", "/export")
+    r = conn.getresponse()
+    size = len(r.read())
+    print(f"/export: {size / 1024:.0f} KiB, {r.getheader('Transfer-Encoding')}, {(time.perf_counter() - t0) * 1000:.1f} ms")
+    if server:
+        server.stop()
+        print("server stats:", server.stats)
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Бенчмарки UltraEvoAI")
+    sub = p.add_subparsers(dest="what", required=True)
+    a = sub.add_parser("analyzer", help="по-этапные сканы evolve() против TextAnalyzer")
+    a.add_argument("--docs", help="папка с текстами (по умолчанию — синтетика)")
+    a.add_argument("-n", type=int, default=200)
+    a.set_defaults(run=bench_analyzer)
+    h = sub.add_parser("html", help="regex clean_html против потокового HtmlTextExtractor")
+    h.add_argument("--pages", default="bench_pages", help="папка с сохранёнными страницами")
+    h.add_argument("--save", action="store_true", help="сначала скачать страницы из URLS в --pages")
+    h.set_defaults(run=bench_html)
+    s = sub.add_parser("search", help="скан корпуса против SearchIndex")
+    s.add_argument("--docs", help="папка с текстами (по умолчанию — синтетика)")
+    s.add_argument("-n", type=int, default=950)
+    s.set_defaults(run=bench_search)
+    t = sub.add_parser("trends", help="dict трендов против TrendSketch")
+    t.add_argument("--words", type=int, default=400000)
+    t.add_argument("--capacity", type=int, default=TRENDS_CAPACITY)
+    t.set_defaults(run=bench_trends)
+    w = sub.add_parser("weights", help="веса списком против вектора NumPy")
+    w.add_argument("--size", type=int, default=333)
+    w.add_argument("--docs", type=int, default=5)
+    w.set_defaults(run=bench_weights)
+    ap = sub.add_parser("api", help="нагрузка на ApiServer: keep-alive против соединения на запрос")
+    ap.add_argument("--url", help="уже запущенный сервер (python ai.py --api); по умолчанию — свой во временной папке")
+    ap.add_argument("--docs", help="папка с текстами для обучения своего сервера (по умолчанию — синтетика)")
+    ap.add_argument("--epochs", type=int, default=60)
+    ap.add_argument("-c", type=int, default=16, help="параллельных клиентов")
+    ap.add_argument("--seconds", type=float, default=5)
+    ap.set_defaults(run=bench_api)
+    args = p.parse_args()
+    args.run(args)
@@ -0,0 +1,102 @@
+# Общие фикстуры тестов: у каждого теста своя временная папка состояния, документы — синтетика без сети
+import random, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import ai
+
+class DocFeed:
+    # Вместо FetchPipeline: evolve() берёт документы из списка по кругу
+    def __init__(self, docs):
+        self.docs = docs
+        self.i = 0
+
+    def get(self):
+        if not self.docs:
+            return "", ""
+        self.i += 1
+        return self.docs[(self.i - 1) % len(self.docs)], f"local://doc{self.i}"
+
+def synthetic_docs(n, seed=7, words=2600):
+    # Тексты из KEYWORDS с кодом, фактами и метриками — проходят фильтры evolve() и не дублируют друг друга
+    rnd = random.Random(seed)
+    vocab = ai.KEYWORDS + ["project", "return", "import", "class", "def", "function", "Python is a language.",
+                           "accuracy: 0.95", "results", "framework", "developers", "performance"]
+    return [" ".join(w + ("\n" if rnd.random() < 0.06 else "") for w in rnd.choices(vocab, k=words))[:18000]
+            for _ in range(n)]
+
+class LocalSite:
+    # Локальный HTTP-сервер вместо интернета: routes[путь] = (код, заголовки, тело) или
+    # функция(заголовки запроса) -> такой же кортеж; requests — [(путь, заголовки)] по порядку
+    def __init__(self):
+        self.routes = {}
+        self.requests = []
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                site.requests.append((self.path, dict(self.headers)))
+                route = site.routes.get(self.path, (404, {}, b""))
+                status, headers, body = route(self.headers) if callable(route) else route
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def page(self, path, title, words=400, **headers):
+        # HTML-страница с текстом длиннее FETCH_MIN_TEXT; одинаковый title — одинаковое содержимое
+        body = " ".join(f"{title} python data {i}" for i in range(words))
+        html = f"<html><head><title>{title}</title></head><body><p>{body}</p></body></html>".encode()
+        self.routes[path] = (200, dict({"Content-Type": "text/html; charset=utf-8"}, **headers), html)
+        return self.url(path)
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.server.server_port}{path}"
+
+    def hits(self, path):
+        return [h for p, h in self.requests if p == path]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def site():
+    s = LocalSite()
+    yield s
+    s.close()
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    # Снапшот, журнал, ai_data/ и лог — во временной папке теста
+    monkeypatch.chdir(tmp_path)
+    ai.EVENT_LOG.path = str(tmp_path / ai.LOG_FILE)
+    return tmp_path
+
+@pytest.fixture
+def docs():
+    return synthetic_docs(40)
+
+@pytest.fixture
+def make_ai():
+    # make_ai(docs, epochs) — UltraEvoAI на DocFeed; писатели останавливаются после теста
+    made = []
+    def make(docs=(), epochs=0):
+        a = ai.UltraEvoAI()
+        a.fetcher = DocFeed(list(docs))
+        for _ in range(epochs):
+            a.life_cycle()
+        made.append(a)
+        return a
+    yield make
+    for a in made:
+        a.writer.stop()
@@ -1,8 +1,9 @@
 import os, time, threading, json, queue, sys, traceback
-from ai import UltraEvoAI  # ai.py должен быть в той же папке
+from itertools import islice
+from ai import UltraEvoAI, SEARCH_PAGE, ADMIN_SECTIONS, ADMIN_TAIL, chunk_lines  # ai.py должен быть в той же папке
 from telegram import Update, Bot
 from telegram.ext import (
-    Updater, CommandHandler, MessageHandler, Filters, CallbackContext, ConversationHandler
+    Updater, CommandHandler, MessageHandler, Filters, CallbackContext, ConversationHandler, CallbackQueryHandler
 )
 
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN", "8015046873:AAFfJIj_TNa8zr-kc8lgHRdF0ZwU5bX3zz4")  # вставь свой токен!
@@ -12,6 +13,9 @@ ai = UltraEvoAI()
 ai.start_background()
 task_q = queue.Queue()
 HISTORY_LIMIT = 30
+EXPORT_MAX_MESSAGES = 20   # сообщений на один /export_full; дальше — просьба сузить окно
+AUTO_REPORT_MAX_MESSAGES = 5
+SEARCH_KEEP = 20  # сколько последних поисков пользователя можно листать кнопкой "Дальше"
 
 def ai_respond(qtype, data, user_id=None):
     # Обертка для ответа ИИ на запрос из Telegram
@@ -56,8 +60,8 @@ def skills(update: Update, context: CallbackContext):
     context.bot.send_message(chat_id=update.effective_chat.id, text=s)
 
 def export(update: Update, context: CallbackContext):
-    s = ai_respond("state", "")
-    context.bot.send_message(chat_id=update.effective_chat.id, text=s[:4096])
+    lines = ai.iter_export(("summary", "knowledge"), fmt="jsonl", tail=10)
+    send_records(context.bot, update.effective_chat.id, lines)
 
 def reflect(update: Update, context: CallbackContext):
     s = ai_respond("reflect", "")
@@ -65,8 +69,10 @@ def reflect(update: Update, context: CallbackContext):
 
 def admin_report(update: Update, context: CallbackContext):
     if update.effective_user.id in ADMIN_IDS:
-        s = ai.admin_report()
-        context.bot.send_message(chat_id=update.effective_chat.id, text=s[:4096])
+        window = epoch_window(update, context)
+        if window is not None:
+            lines = ai.iter_export(ADMIN_SECTIONS, fmt="jsonl", tail=ADMIN_TAIL, **window)
+            send_records(context.bot, update.effective_chat.id, lines)
     else:
         context.bot.send_message(chat_id=update.effective_chat.id, text="Нет доступа.")
 
@@ -116,20 +122,43 @@ def send_long_message(bot, chat_id, text, chunk=3900):
     for p in parts:
         bot.send_message(chat_id=chat_id, text=p)
 
+def send_records(bot, chat_id, lines, max_messages=EXPORT_MAX_MESSAGES):
+    """Отправить JSONL-экспорт сообщениями, разрезая только между записями."""
+    sent = 0
+    for msg in chunk_lines(lines):
+        if sent == max_messages:
+            bot.send_message(chat_id=chat_id, text="… экспорт обрезан, сузьте окно: /export_full <с эпохи> [по эпоху]")
+            break
+        bot.send_message(chat_id=chat_id, text=msg)
+        sent += 1
+    if not sent:
+        bot.send_message(chat_id=chat_id, text="В этом окне записей нет.")
+    return sent
+
+def epoch_window(update, context):
+    """Окно эпох из аргументов команды: [с эпохи] [по эпоху]; None — аргументы неверные."""
+    args = context.args or []
+    try:
+        return {k: int(v) for k, v in zip(("since_epoch", "until_epoch"), args)}
+    except ValueError:
+        context.bot.send_message(chat_id=update.effective_chat.id, text="Формат: <с эпохи> [по эпоху], числа.")
+        return None
+
 def export_full(update: Update, context: CallbackContext):
-    """Полный экспорт всех знаний/состояния — длинными чанками."""
-    s = ai.admin_report()
-    send_long_message(context.bot, update.effective_chat.id, s)
+    """Полный экспорт знаний/состояния за окно эпох — сообщениями по границам записей."""
+    window = epoch_window(update, context)
+    if window is not None:
+        send_records(context.bot, update.effective_chat.id, ai.iter_export(fmt="jsonl", **window))
 
 def history(update: Update, context: CallbackContext):
     """Показать последние вопросы/ответы (история CLI и Telegram)."""
-    h = ai.command_history[-HISTORY_LIMIT:]
+    h = ai.view.command_history[-HISTORY_LIMIT:]
     msg = "\n\n".join(f"{c['command']}" for c in h if 'command' in c)
     send_long_message(context.bot, update.effective_chat.id, "Последние команды:\n" + msg if msg else "Истории нет.")
 
 def diag(update: Update, context: CallbackContext):
     """Отправить последние диагностические отчёты/мониторинг."""
-    d = ai.diag_history[-12:]
+    d = ai.view.diag_history[-12:]
     txt = json.dumps(d, ensure_ascii=False, indent=2)
     send_long_message(context.bot, update.effective_chat.id, txt)
 
@@ -168,36 +197,53 @@ def error_handler(update: Update, context: CallbackContext):
 
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
+def search_page_text(query, page, hits):
+    """Текст одной страницы ранжированной выдачи."""
+    lines = [f"🔎 {query} — стр. {page}"]
+    lines += [f"{(page - 1) * SEARCH_PAGE + i + 1}. {h}" for i, h in enumerate(hits)]
+    return "\n\n".join(lines)[:4096]
+
+def search_page_markup(qid, cursor):
+    """Кнопка следующей страницы, если она есть; в callback_data — номер поиска."""
+    if not cursor:
+        return None
+    return InlineKeyboardMarkup([[InlineKeyboardButton("Дальше ▶", callback_data=f"search_next:{qid}")]])
+
 def inline_search(update: Update, context: CallbackContext):
-    """Поиск по знаниям ИИ через inline-кнопку."""
+    """Ранжированный поиск (BM25) по знаниям ИИ с постраничной выдачей."""
     query = update.message.text.partition(' ')[2].strip()
     if not query:
         context.bot.send_message(chat_id=update.effective_chat.id, text="Пример: /inline_search python")
         return
-    results = ai.search(query)
-    if results:
-        keyboard = [
-            [InlineKeyboardButton(f"Показать {i+1}", callback_data=f"showres_{i}")]
-            for i in range(min(len(results), 5))
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        context.user_data['inline_results'] = results
-        context.bot.send_message(chat_id=update.effective_chat.id, text="Результаты поиска:", reply_markup=reply_markup)
+    hits, cursor = ai.ranked_search(query, SEARCH_PAGE)
+    if hits:
+        # В user_data — только запрос и курсор следующей страницы, а не весь список результатов.
+        # Ключ — номер поиска из кнопки: "Дальше" под старым сообщением листает свой запрос
+        searches = context.user_data.setdefault('inline_search', {})
+        qid = context.user_data['inline_search_seq'] = context.user_data.get('inline_search_seq', 0) + 1
+        searches[qid] = {"q": query, "page": 1, "cursor": cursor}
+        for old in sorted(searches)[:-SEARCH_KEEP]:
+            del searches[old]
+        context.bot.send_message(chat_id=update.effective_chat.id, text=search_page_text(query, 1, hits),
+                                 reply_markup=search_page_markup(qid, cursor))
     else:
         context.bot.send_message(chat_id=update.effective_chat.id, text="Ничего не найдено.")
 
 def button(update: Update, context: CallbackContext):
-    """Обработка inline-кнопок для выдачи результатов поиска."""
+    """Обработка inline-кнопок: следующая страница поиска считается по курсору."""
     query = update.callback_query
-    data = query.data
-    if data.startswith("showres_"):
-        idx = int(data.split("_")[1])
-        results = context.user_data.get('inline_results', [])
-        if 0 <= idx < len(results):
-            query.answer()
-            query.edit_message_text(text=results[idx][:4096])
-        else:
-            query.answer("Результат не найден.")
+    if query.data.startswith("search_next:"):
+        qid = query.data.partition(":")[2]
+        st = context.user_data.get('inline_search', {}).get(int(qid)) if qid.isdigit() else None
+        hits, cursor = ai.ranked_search(st["q"], SEARCH_PAGE, st["cursor"]) if st and st["cursor"] else ([], None)
+        if not hits:
+            query.answer("Больше результатов нет.")
+            return
+        st["page"] += 1
+        st["cursor"] = cursor
+        query.answer()
+        query.edit_message_text(text=search_page_text(st["q"], st["page"], hits),
+                                reply_markup=search_page_markup(qid, cursor))
     else:
         query.answer()
 
@@ -226,12 +272,20 @@ def notify_admins(text):
             print(f"[AdminNotifyError] {e}")
 
 def auto_admin_reports():
-    """Автоматически отправляет отчёт админу раз в час."""
+    """Раз в час отправляет админам отчёт — только записи, появившиеся с прошлого отчёта."""
     def loop():
+        window = {}  # первый отчёт — последние ADMIN_TAIL записей
         while True:
             try:
-                txt = ai.admin_report()
-                notify_admins("🦾 Автоотчёт AI:\n" + txt[:3500])
+                # Курсор — только время: записи той же эпохи, появившиеся после отчёта, уйдут в следующий.
+                # publish() после отметки времени переносит в истории всё, что записано до неё
+                now = time.time()
+                epoch = ai.publish().epoch
+                lines = ai.iter_export(ADMIN_SECTIONS, fmt="jsonl", tail=ADMIN_TAIL, **window)
+                notify_admins(f"🦾 Автоотчёт AI, эпоха {epoch}:")
+                for msg in islice(chunk_lines(lines), AUTO_REPORT_MAX_MESSAGES):
+                    notify_admins(msg)
+                window = {"since": now}
                 time.sleep(3600)
             except Exception as e:
                 print(f"[AutoAdminReportError] {e}")
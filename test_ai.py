@@ -0,0 +1,492 @@
+import http.client, json, os, random, socket, threading, time
+from collections import Counter
+import pytest
+import ai
+
+def snapshot_of(a):
+    return {
+        "epoch": a.epoch,
+        "corpus": list(a.corpus),
+        "facts": dict(a.facts),
+        "skills": a.skills.levels(),
+        "trends": {k: list(v) for k, v in a.trends.items()},
+        "experience": list(a.experience),
+        "weights": a.weights.tolist(),
+    }
+
+def reload(a, make_ai):
+    a.save(wait=True)
+    a.writer.stop()
+    return make_ai()
+
+# --- Журнал и снапшот ---
+
+def test_journal_replay_and_compaction_round_trip():
+    j = ai.StateJournal()
+    j.write(j.record({"epoch": 1}, {"corpus": {"add": ["a", "b"], "keep": 2}, "facts": {"put": {"x": "1"}}}))
+    j.write(j.record({"epoch": 2}, {"corpus": {"add": ["c"], "keep": 2}, "facts": {"put": {"y": "2"}, "del": ["x"]}}))
+    state, lazy = ai.StateJournal().load()
+    assert state["epoch"] == 2 and state["facts"] == {"y": "2"}
+    assert lazy["corpus"]() == ["b", "c"]
+
+    j.compact()
+    assert os.path.getsize(ai.JOURNAL_FILE) == 0
+    j.write(j.record({"epoch": 3}, {"facts": {"put": {"z": "3"}}}))
+    state, lazy = ai.StateJournal().load()
+    assert state["epoch"] == 3 and state["facts"] == {"y": "2", "z": "3"}
+    assert lazy["corpus"]() == ["b", "c"]
+
+def test_state_round_trip(make_ai, docs, monkeypatch):
+    a = make_ai(docs[:12], 6)
+    before = snapshot_of(a)
+    b = reload(a, make_ai)
+    assert snapshot_of(b) == before
+
+    # Сворачивание после каждой записи: состояние то же, журнал пуст
+    monkeypatch.setattr(ai, "JOURNAL_COMPACT_RECORDS", 0)
+    b.fetcher.docs = docs[12:18]
+    for _ in range(3):
+        b.life_cycle()
+    before = snapshot_of(b)
+    c = reload(b, make_ai)
+    assert os.path.getsize(ai.JOURNAL_FILE) == 0
+    assert snapshot_of(c) == before
+
+def test_torn_tail_is_cut_before_next_append():
+    j = ai.StateJournal()
+    for epoch in (1, 2):
+        j.write(j.record({"epoch": epoch}, {}))
+    with open(ai.JOURNAL_FILE, "ab") as f:
+        f.write(b'{"seq": 3, "scalars": {"epo')  # запись оборвалась посреди строки
+    j = ai.StateJournal()
+    state, _ = j.load()
+    assert state["epoch"] == 2
+    j.write(j.record({"epoch": 3}, {}))
+    state, _ = ai.StateJournal().load()
+    assert state["epoch"] == 3
+    with open(ai.JOURNAL_FILE, "rb") as f:
+        lines = f.read().split(b"\n")
+    assert lines[-1] == b"" and all(json.loads(line) for line in lines[:-1])
+
+def test_failed_write_starts_next_record_on_new_line():
+    j = ai.StateJournal()
+    j.write(j.record({"epoch": 1}, {}))
+    with open(ai.JOURNAL_FILE, "ab") as f:
+        f.write(b'{"seq": 2, "sca')
+    j._torn = True  # write() упал, часть строки ушла на диск
+    j.write(j.record({"epoch": 3}, {}))
+    state, _ = ai.StateJournal().load()
+    assert state["epoch"] == 3
+
+# --- Пул загрузчиков ---
+
+def wait_for(cond, timeout=10):
+    deadline = time.time() + timeout
+    while not cond():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+def test_fetch_pipeline_feeds_evolve_and_stops(make_ai, site, monkeypatch):
+    monkeypatch.setattr(ai, "CRAWL_RATE", 1000)
+    urls = [site.page("/a", "alpha"), site.page("/b", "alpha"), site.page("/c", "gamma")]  # /b — копия /a
+    a = make_ai()
+    a.fetcher = None
+    pipeline = a.start_fetch_pipeline(urls, workers=2, depth=4)
+    for _ in range(60):  # выбор URL случайный — эпох с запасом, пока не придут обе страницы и копия
+        a.evolve()
+        if len(a.corpus) == 2 and a.dedup_stats["exact"]:
+            break
+    assert len(a.corpus) == 2  # alpha и gamma, копии отброшены дедупликацией
+    assert a.dedup_stats["exact"] >= 1
+    assert pipeline.stats["fetched"] >= 3 and {p for p, _ in site.requests} <= {"/a", "/b", "/c"}
+    pipeline.stop(timeout=5)
+    assert not any(t.is_alive() for t in pipeline._threads)
+
+def test_system_reset_restarts_fetch_pipeline(make_ai, site, monkeypatch):
+    monkeypatch.setattr(ai, "CRAWL_RATE", 1000)
+    a = make_ai()
+    a.fetcher = None
+    old = a.start_fetch_pipeline([site.page("/a", "alpha")], workers=2, depth=4)
+    a.system_reset(confirm=True)
+    assert old._stop.is_set()
+    assert isinstance(a.fetcher, ai.FetchPipeline) and a.fetcher is not old
+    assert a.fetcher.scheduler.urls == [site.url("/a")] and a.fetcher.workers == 2
+    assert a.fetcher.get(timeout=10)[1] == site.url("/a")
+    a.fetcher.stop(timeout=5)
+    for t in old._threads:
+        t.join(5)
+    assert not any(t.is_alive() for t in old._threads)
+
+# --- Ранжированный поиск ---
+
+def test_ranked_search_cursor_pages_cover_full_ranking(make_ai, docs):
+    a = make_ai()
+    with a.state_lock:
+        for doc in docs:
+            a.corpus.append(doc)
+        a.facts["Python"] = "Python is a programming language for data and web."
+    full, _ = a.ranked_search("python data", k=1000)
+    pages, cursor = [], None
+    while True:
+        page, cursor = a.ranked_search("python data", k=3, cursor=cursor)
+        pages += page
+        if cursor is None:
+            break
+    assert len(full) > 3 and pages == full
+
+@pytest.mark.parametrize("cursor", ["x", "1.0|0", "nan|0|1", "1.0|9|1", "1.0|-1|1", "1.0|0|key", "a|0|1"])
+def test_malformed_cursor_raises_value_error(make_ai, cursor):
+    with pytest.raises(ValueError):
+        make_ai().ranked_search("python", cursor=cursor)
+
+# --- Счётчики ---
+
+def zipf_stream(seed, n, vocab):
+    rnd = random.Random(seed)
+    words = [f"w{i}" for i in range(vocab)]
+    return rnd.choices(words, [1 / (i + 1) ** 1.1 for i in range(vocab)], k=n)
+
+@pytest.mark.parametrize("capacity", [16, 128, 1024])
+def test_trend_sketch_error_bounds(capacity):
+    stream = zipf_stream(capacity, 20000, 3000)
+    exact, sketch = Counter(stream), ai.TrendSketch(capacity=capacity)
+    for i in range(0, len(stream), 250):
+        for w, c in Counter(stream[i:i + 250]).items():
+            sketch.add(w, c)
+    n = len(stream)
+    assert len(sketch) <= capacity
+    for w, (count, err) in sketch.items():
+        assert count - err <= exact[w] <= count
+        assert err <= n / capacity
+    # Любое слово с частотой больше N/capacity обязано остаться в сводке
+    assert all(w in sketch for w, c in exact.items() if c > n / capacity)
+
+@pytest.mark.parametrize("capacity,top", [(4096, 64), (50, 64), (200, 8)])
+def test_trend_sketch_top_matches_naive(capacity, top):
+    sketch = ai.TrendSketch(capacity=capacity, top=top)
+    for w in zipf_stream(top, 30000, 5000):
+        sketch.add(w)
+    naive = sorted((v[0] for v in sketch.values()), reverse=True)
+    for n in (0, 1, 14, 64, 100):
+        assert [c for _, c, _ in sketch.top(n)] == naive[:n]
+    reloaded = ai.TrendSketch(dict(sketch), capacity=capacity, top=top)
+    assert reloaded.top(14) == sketch.top(14)
+
+def test_skill_store_top_matches_naive():
+    rnd = random.Random(7)
+    store = ai.SkillStore(top=8)
+    for step in range(3000):
+        store.bump(f"s{rnd.randrange(200)}", rnd.randint(1, 5), 1)
+        if step % 500 == 0:
+            store.shift(1)
+    naive = sorted(((lv, k) for k, lv in store.levels().items()), reverse=True)
+    for n in (0, 1, 5, 8, 20, 300):
+        assert store.top(n) == [(k, lv) for lv, k in naive[:n]]
+    assert store.total() == sum(store.levels().values())
+
+# --- Дедупликация ---
+
+def test_admit_document_skips_exact_and_near_duplicates(make_ai):
+    rnd = random.Random(1)
+    words = [f"term{rnd.randrange(10 ** 6)}" for _ in range(400)]
+    base = " ".join(words)
+    near = " ".join(words[:-3] + ["other1", "other2", "other3"])  # SimHash в 1 бите от base
+    fresh = " ".join(f"word{rnd.randrange(10 ** 6)}" for _ in range(400))
+    a = make_ai()
+    assert a.admit_document(base)
+    assert not a.admit_document(base)
+    assert not a.admit_document(near)
+    assert a.admit_document(fresh)
+    assert a.dedup_stats == {"checked": 4, "new": 2, "exact": 1, "near": 1}
+    # Отпечатки переживают перезагрузку
+    a.save(wait=True)
+    a.writer.stop()
+    assert not make_ai().admit_document(base)
+
+# --- HTTP-кэш ---
+
+def test_http_cache_revalidates_with_304(site, tmp_path):
+    def page(headers):
+        if headers.get("If-None-Match") == '"v1"':
+            return 304, {"ETag": '"v1"'}, b""
+        return 200, {"Content-Type": "text/plain", "ETag": '"v1"'}, b"hello cache"
+    site.routes["/doc"] = page
+    url = site.url("/doc")
+
+    def read(r):
+        return "".join(ai.iter_text(r, 1 << 20))
+    os.makedirs(tmp_path / "cache")
+    cache = ai.HttpCache(str(tmp_path / "cache"), {"*": 0})
+    session = ai.make_session(1)
+    assert cache.get(session, url, read) == ("hello cache", True)
+    assert cache.get(session, url, read) == ("hello cache", False)  # 304: текст с диска
+    assert site.hits("/doc")[1]["If-None-Match"] == '"v1"'
+    assert cache.stats == {"fresh": 0, "not_modified": 1, "fetched": 1, "errors": 0}
+
+    # Свежая по политике запись отдаётся без сети
+    fresh = ai.HttpCache(str(tmp_path / "cache"), {"*": 3600})
+    assert fresh.get(session, url, read) == ("hello cache", None)
+    assert len(site.hits("/doc")) == 2
+
+    # Источник поменялся — 200 с новым текстом
+    site.routes["/doc"] = (200, {"Content-Type": "text/plain", "ETag": '"v2"'}, b"new text")
+    assert cache.get(session, url, read) == ("new text", True)
+    session.close()
+
+# --- Планировщик обхода ---
+
+def test_crawl_breaker_half_open_allows_single_trial(monkeypatch):
+    monkeypatch.setattr(ai, "CRAWL_BURST", 10)  # токенов с запасом: ограничивает только размыкатель
+    s = ai.CrawlScheduler(["http://a/1", "http://a/2", "http://a/3"])
+    for _ in range(ai.CRAWL_BREAKER):
+        s.report("http://a/1", 0.1, Exception("down"))
+    st = s.domains["a"]
+    assert s.pick() is None and s.table()["a"]["state"] == "open"
+
+    st.open_until = st.retry_at = time.time() - 1  # пауза разомкнутого домена истекла
+    trial = s.pick()
+    assert trial and s.pick() is None  # полуоткрыт: ровно один пробный запрос
+    assert s.table()["a"]["state"] == "half-open"
+    s.report(trial, 0.1, Exception("still down"))
+    assert s.pick() is None and s.table()["a"]["state"] == "open"
+
+    st.open_until = st.retry_at = time.time() - 1
+    s.refund(s.pick())  # ответ из свежего кэша — пробной попыткой не считается
+    trial = s.pick()
+    assert trial
+    s.report(trial, 0.1)
+    assert s.table()["a"]["state"] == "ok"
+    assert s.pick()  # замкнут: обычные запросы по токенам
+
+def test_crawl_refund_restores_token_and_skips_accounting(monkeypatch):
+    monkeypatch.setattr(ai, "CRAWL_RATE", 0)
+    s = ai.CrawlScheduler(["http://a/1"])
+    url = s.pick()
+    st = s.domains["a"]
+    yield_, requests = st.yield_, st.requests
+    s.refund(url)
+    assert st.tokens == ai.CRAWL_BURST and st.requests == requests - 1 and st.yield_ == yield_
+
+# --- Потоковое чтение ответов ---
+
+def test_iter_text_rejects_binary_and_caps_bytes(site):
+    site.routes["/img"] = (200, {"Content-Type": "image/png"}, b"\x89PNG" + b"\0" * 5000)
+    site.routes["/big"] = (200, {"Content-Type": "text/plain"}, "жж".encode() * 50000)  # без charset
+    session = ai.make_session(1)
+    with session.get(site.url("/img"), stream=True) as r:
+        assert list(ai.iter_text(r, 1 << 20)) == []
+    with session.get(site.url("/big"), stream=True) as r:
+        text = "".join(ai.iter_text(r, 5000, chunk=1001))
+    session.close()
+    # Не больше max_bytes + кусок, utf-8 по умолчанию, символы на стыках кусков целы
+    # (битым может быть только последний, оборванный лимитом)
+    assert 5000 <= len(text.encode()) < 5000 + 1001 + 3
+    assert set(text[:-1]) == {"ж"}
+
+# --- Журнал событий ---
+
+def read_log(path):
+    with open(path, encoding="utf-8") as f:
+        return [line.split(" | ", 1)[1].rstrip("\n") for line in f]
+
+def test_event_log_collapses_repeats(tmp_path):
+    log = ai.EventLog(str(tmp_path / "events.log"), flush_sec=60, repeat_sec=60)
+    for _ in range(5):
+        log.write("[Crawl] down")
+    log.write("[Other] once")
+    log.stop()  # дописывает буфер и итоги окон повторов
+    assert read_log(log.path) == ["[Crawl] down", "[Other] once", "[Crawl] down (repeated 4 times)"]
+    assert log.stats["suppressed"] == 4
+
+def test_event_log_rotates_by_size_and_day(tmp_path):
+    path = str(tmp_path / "events.log")
+    log = ai.EventLog(path, max_bytes=200, backups=2, repeat_sec=0)
+    log.stop()  # после stop() каждая запись сразу идёт в файл
+    for i in range(12):
+        log.write(f"message number {i:02d}")
+    assert os.path.getsize(path) <= 200 and os.path.exists(path + ".2") and not os.path.exists(path + ".3")
+    assert read_log(path)[-1] == "message number 11"
+
+    daily = ai.EventLog(path, max_bytes=0, backups=2, repeat_sec=0)
+    daily.stop()
+    yesterday = time.time() - 86400
+    os.utime(path, (yesterday, yesterday))
+    before = read_log(path)
+    daily.write("new day")
+    assert read_log(path) == ["new day"] and read_log(path + ".1") == before
+    assert daily.stats["rotations"] == 1
+
+# --- Срез для читателей ---
+
+def test_publish_keeps_view_bounded_and_reuses_unchanged_sections(make_ai, docs):
+    a = make_ai(docs[:6], 6)
+    with a.state_lock:
+        for i in range(3 * ai.VIEW_TAIL):
+            a.facts[f"Fact{i}"] = f"Fact{i} is a statement number {i}."
+    v = a.publish()
+    assert len(v.facts) == ai.VIEW_TAIL and list(v.facts)[-1] == f"Fact{3 * ai.VIEW_TAIL - 1}"
+    assert len(a.export_state()["facts"]) == len(a.facts)  # полный словарь — только по запросу экспорта
+    with a.state_lock:
+        a.command_history.append({"prompt": "x"})
+    w = a.publish()
+    assert w.seq == v.seq + 1 and w.facts is v.facts and w.trends is v.trends
+
+def test_lazy_corpus_load_refreshes_view_docs(make_ai, docs):
+    a = make_ai(docs[:8], 8)
+    n = len(a.corpus)
+    a.save(wait=True)
+    a.writer.stop()
+    b = make_ai()
+    assert not b.loaded("corpus") and b.view.docs == 0
+    seq = b.view.seq
+    b.search("python")  # первое обращение подгружает корпус
+    assert b.view.docs == n > 0 and b.view.seq == seq + 1
+
+# --- Кэш ответов ---
+
+def test_response_cache_is_scoped_to_published_view(make_ai, docs):
+    a = make_ai(docs[:4], 4)
+    cache = a.response_cache
+    assert a.handle_external_query("search", "zebraquux") == "Ничего не найдено."
+    assert a.handle_external_query("search", "ZebraQuux") == "Ничего не найдено."
+    assert cache.stats["hits"] == 1  # регистр не важен — search() сам приводит запрос к нижнему
+    os.makedirs(ai.DATA_DIR, exist_ok=True)
+    with open(os.path.join(ai.DATA_DIR, "new.txt"), "w", encoding="utf-8") as f:
+        f.write("The zebraquux library parses configuration files for Python services.")
+    a.data_folder_learn()  # пишет корпус и публикует новый срез
+    assert "zebraquux library" in a.handle_external_query("search", "zebraquux")
+    assert cache.stats["invalidations"] == 1
+
+def test_response_cache_keys_on_raw_query_spacing(make_ai):
+    a = make_ai()
+    with a.state_lock:
+        a.corpus.append("alpha beta gamma " * 20)
+    a.publish()
+    assert a.handle_external_query("search", "alpha beta") != "Ничего не найдено."
+    assert a.handle_external_query("search", "alpha  beta") == "Ничего не найдено."
+    assert len(a.response_cache) == 2
+
+# --- Пакетные запросы ---
+
+def test_run_batch_keeps_order_and_computes_duplicates_once(make_ai, docs, monkeypatch):
+    a = make_ai(docs[:4], 4)
+    calls = Counter()
+    real = a.handle_external_query
+
+    def counted(qtype, data=None):
+        calls[(qtype, data)] += 1
+        return f"{qtype}:{data}:{real(qtype, data)[:20]}"
+    monkeypatch.setattr(a, "handle_external_query", counted)
+    tasks = [{"qtype": "skills"}, {"qtype": "search", "data": "python"}, {"qtype": "feedback", "data": "nice"},
+             {"qtype": "skills"}, {"qtype": "search", "data": "python"}, {"qtype": "feedback", "data": "nice"}]
+    replies = []
+    results = a.run_batch(tasks, "test", replies.append)
+    assert [r.split(":")[0] for r in results] == [t["qtype"] for t in tasks]
+    assert results[0] == results[3] and results[1] == results[4] and replies == results
+    assert calls[("skills", "")] == 1 and calls[("search", "python")] == 1
+    assert calls[("feedback", "nice")] == 2  # пишущие запросы не склеиваются
+    a.publish()
+    assert [f["feedback"] for f in a.user_feedback if f["feedback"].startswith("[test]")] == [
+        f"[test] {t['qtype'].upper()} Q: {t.get('data', '')} | A: {r}" for t, r in zip(tasks, results)]
+
+def test_response_cache_ignores_stale_seq():
+    cache = ai.ResponseCache()
+    assert cache.get(5, "k", lambda: "new") == "new"
+    assert cache.get(4, "k", lambda: "old") == "old"  # пакет с закреплённым старым срезом
+    assert cache.get(5, "k", lambda: "recomputed") == "new" and cache.stats["invalidations"] == 0
+
+# --- HTTP API ---
+
+@pytest.fixture
+def api(make_ai, docs):
+    a = make_ai(docs[:4], 4)
+    server = ai.ApiServer(a, host="127.0.0.1", port=0, workers=4, inflight=2).start()
+    yield server
+    server.stop()
+
+def call(server, method, path, body=None, headers=None):
+    conn = http.client.HTTPConnection("127.0.0.1", server.port, timeout=10)
+    try:
+        data = body if isinstance(body, (bytes, type(None))) else json.dumps(body).encode()
+        conn.request(method, path, body=data, headers=headers or {})
+        r = conn.getresponse()
+        return r.status, r.read()
+    finally:
+        conn.close()
+
+def test_api_status_codes(api, monkeypatch):
+    assert call(api, "GET", "/health")[0] == 200
+    status, body = call(api, "GET", "/query?qtype=skills")
+    assert status == 200 and json.loads(body)["qtype"] == "skills"
+    assert call(api, "GET", "/nope")[0] == 404
+    assert call(api, "GET", "/batch")[0] == 405
+    assert call(api, "GET", "/query?qtype=feedback&data=x")[0] == 405  # пишущий запрос — только POST
+    assert call(api, "POST", "/query", b"{not json")[0] == 400
+    assert call(api, "POST", "/query", [1, 2])[0] == 400
+    assert call(api, "POST", "/query", {"qtype": "search", "data": 5})[0] == 400
+    assert call(api, "POST", "/query", {"qtype": ["status"]})[0] == 400
+    assert call(api, "POST", "/batch", {"tasks": [{"qtype": "status"}, {"qtype": 1}]})[0] == 400
+    status, body = call(api, "POST", "/batch", {"tasks": [{"qtype": "status"}, {"qtype": "skills"}]})
+    assert status == 200 and len(json.loads(body)["answers"]) == 2
+    assert call(api, "GET", "/search")[0] == 400
+    assert call(api, "GET", "/search?q=python&cursor=bad")[0] == 400
+    monkeypatch.setattr(ai, "API_MAX_BODY", 10)
+    assert call(api, "POST", "/query", {"qtype": "status", "data": "x" * 50})[0] == 413
+
+def test_api_busy_while_slots_are_held(api, monkeypatch):
+    monkeypatch.setattr(ai, "API_QUEUE_SEC", 0.2)
+    release = threading.Event()
+    real = api.ai.handle_external_query
+
+    def slow(qtype, data=None):
+        if qtype == "status":
+            release.wait(10)
+        return real(qtype, data)
+    monkeypatch.setattr(api.ai, "handle_external_query", slow)
+    held = [threading.Thread(target=call, args=(api, "GET", "/query?qtype=status")) for _ in range(2)]
+    for t in held:
+        t.start()
+    time.sleep(0.3)
+    status, _ = call(api, "GET", "/health")
+    release.set()
+    for t in held:
+        t.join(10)
+    assert status == 503 and api.stats["rejected"] == 1
+    assert call(api, "GET", "/health")[0] == 200
+
+def test_api_closes_stalled_request_body(api, monkeypatch):
+    monkeypatch.setattr(ai, "API_KEEPALIVE_SEC", 0.3)
+    with socket.create_connection(("127.0.0.1", api.port), timeout=5) as s:
+        s.sendall(b"POST /query HTTP/1.1\r\nHost: x\r\nContent-Length: 100\r\n\r\n{\"qtype\"")
+        assert s.recv(100) == b""  # тело так и не пришло — соединение закрыто, слот не занят
+
+# --- Экспорт ---
+
+def test_chunk_lines_respects_limit_and_record_boundaries():
+    lines = [json.dumps({"i": i, "text": "x" * (i * 37 % 300)}) + "\n" for i in range(200)]
+    lines.append(json.dumps({"huge": "y" * 5000}) + "\n")
+    msgs = list(ai.chunk_lines(lines, limit=1000))
+    assert all(len(m) <= 1000 for m in msgs)
+    records = [json.loads(line) for m in msgs for line in m.split("\n")]  # каждое сообщение — целый JSONL
+    assert records[:200] == [json.loads(line) for line in lines[:200]]
+    assert records[-1]["truncated"] == len(lines[-1]) - 1 and records[-1]["head"].startswith('{"huge"')
+    assert list(ai.chunk_lines([])) == []
+
+def test_iter_export_validates_before_streaming(make_ai, docs):
+    a = make_ai(docs[:4], 4)
+    for bad in ({"tail": -1}, {"fmt": "xml"}, {"sections": ["nope"]}, {"since": float("nan")}, {"since_day": 1}):
+        with pytest.raises(ValueError):
+            a.iter_export(**bad)  # сразу, а не на первой строке генератора
+    out = json.loads("".join(a.iter_export(["summary", "diag_history"], tail=3)))
+    assert out["summary"]["epoch"] == a.epoch and len(out["diag_history"]) <= 3
+    rows = [json.loads(x) for x in a.iter_export(["command_history", "facts"], fmt="jsonl", since_epoch=a.epoch + 1)]
+    assert all(r["section"] == "facts" for r in rows)
+
+def test_api_export_rejects_negative_tail_before_headers(api):
+    status, body = call(api, "GET", "/export?tail=-1")
+    assert status == 400 and "tail" in json.loads(body)["error"]
+    assert call(api, "GET", "/export?since=nan")[0] == 400
+    status, body = call(api, "GET", "/export?sections=summary,diag_history&tail=2&format=jsonl")
+    assert status == 200 and {json.loads(x)["section"] for x in body.decode().splitlines()} == {"summary", "diag_history"}